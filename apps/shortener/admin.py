@@ -1,8 +1,12 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
+from .hot_links import WINDOW_NAMES, hot_links
 from .models import ShortUrl
 
 @admin.register(ShortUrl)
 class ShortURLAdmin(admin.ModelAdmin):
+    change_list_template = "admin/shortener/shorturl/change_list.html"
     list_display = (
         "short_code",
         "original_url",
@@ -13,4 +17,43 @@ class ShortURLAdmin(admin.ModelAdmin):
         "is_active",
     )
     search_fields = ("short_code", "original_url", "user__username")
-    list_filter = ("created_at", "is_active")
+    list_filter = ("created_at", "is_active", "redirect_type")
+    actions = ("activate", "deactivate")
+
+    @admin.action(description="Activate selected short URLs")
+    def activate(self, request, queryset):
+        # QuerySet.update() keeps the redirect cache in sync
+        updated = queryset.update(is_active=True)
+        self.message_user(request, f"{updated} short URLs activated.")
+
+    @admin.action(description="Deactivate selected short URLs")
+    def deactivate(self, request, queryset):
+        updated = queryset.update(is_active=False)
+        self.message_user(request, f"{updated} short URLs deactivated.")
+
+    def get_urls(self):
+        return [
+            path(
+                "hot/",
+                self.admin_site.admin_view(self.hot_links_view),
+                name="shortener_shorturl_hot",
+            ),
+        ] + super().get_urls()
+
+    def hot_links_view(self, request):
+        """Current top short codes per sliding window"""
+        tops = {window: hot_links.top(window, 25) for window in WINDOW_NAMES}
+        links = ShortUrl.objects.in_bulk(
+            {code for top in tops.values() for code, _, _ in top},
+            field_name="short_code",
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Hot links",
+            "windows": [
+                (window, [(links.get(code), code, clicks, error) for code, clicks, error in top])
+                for window, top in tops.items()
+            ],
+        }
+        return TemplateResponse(request, "admin/shortener/shorturl/hot_links.html", context)
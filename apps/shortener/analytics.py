@@ -0,0 +1,213 @@
+"""
+Per-link click time series.
+
+The click buffer writes minute buckets. compact_click_buckets() merges
+minute buckets older than the minute retention into hour buckets, and
+hour buckets older than the hour retention into day buckets, deleting
+the finer rows as it goes, so every click lives in exactly one bucket.
+Charts read the buckets only; click counts are never recomputed.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+MINUTE, HOUR, DAY = "minute", "hour", "day"
+GRANULARITIES = (MINUTE, HOUR, DAY)
+
+# Keep IN (...) lists well below SQLite's parameter limit
+UPDATE_CHUNK_SIZE = 500
+
+COMPACT_BATCH_SIZE = 5000
+
+# Upper bound on points returned by click_series(); coarser buckets are
+# used when a range would need more
+MAX_SERIES_POINTS = 2000
+
+
+def retention(granularity):
+    """
+    How long buckets of `granularity` are kept at that resolution
+
+    Returns:
+        timedelta, or None to keep them forever
+    """
+    if granularity == MINUTE:
+        return timedelta(hours=getattr(settings, "SHORTENER_CLICK_MINUTE_RETENTION_HOURS", 48))
+    if granularity == HOUR:
+        return timedelta(days=getattr(settings, "SHORTENER_CLICK_HOUR_RETENTION_DAYS", 90))
+    days = getattr(settings, "SHORTENER_CLICK_DAY_RETENTION_DAYS", 0)
+    return timedelta(days=days) if days else None
+
+
+def bucket_start(moment, granularity):
+    """Start of the bucket containing `moment`, aligned in the current time zone"""
+    local = timezone.localtime(moment)
+    if granularity == MINUTE:
+        return local.replace(second=0, microsecond=0)
+    if granularity == HOUR:
+        return local.replace(minute=0, second=0, microsecond=0)
+    return timezone.make_aware(datetime.combine(local.date(), time.min))
+
+
+def next_bucket(start, granularity):
+    if granularity == DAY:
+        return bucket_start(start + timedelta(hours=36), DAY)
+    step = timedelta(minutes=1) if granularity == MINUTE else timedelta(hours=1)
+    return timezone.localtime(start + step)
+
+
+def add_clicks(granularity, counts):
+    """
+    Add clicks to buckets, creating missing ones
+
+    Like the click counter itself this only issues `F('clicks') + n`
+    updates, one per distinct (bucket_start, n), so concurrent writers
+    never lose increments. Call inside a transaction.
+
+    Args:
+        granularity: MINUTE, HOUR or DAY
+        counts: {(short_url_id, bucket_start): clicks}
+    """
+    from .models import ClickBucket
+
+    if not counts:
+        return
+    ClickBucket.objects.bulk_create(
+        [
+            ClickBucket(short_url_id=short_url_id, granularity=granularity, bucket_start=start)
+            for short_url_id, start in counts
+        ],
+        batch_size=UPDATE_CHUNK_SIZE,
+        ignore_conflicts=True,
+    )
+
+    grouped = defaultdict(list)
+    for (short_url_id, start), clicks in counts.items():
+        grouped[start, clicks].append(short_url_id)
+    for (start, clicks), ids in grouped.items():
+        for i in range(0, len(ids), UPDATE_CHUNK_SIZE):
+            ClickBucket.objects.filter(
+                granularity=granularity,
+                bucket_start=start,
+                short_url_id__in=ids[i:i + UPDATE_CHUNK_SIZE],
+            ).update(clicks=F("clicks") + clicks)
+
+
+def _merge(finer, coarser, cutoff, batch_size):
+    from .models import ClickBucket
+
+    merged = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                ClickBucket.objects.select_for_update()
+                .filter(granularity=finer, bucket_start__lt=cutoff)
+                .order_by("pk")
+                .values_list("pk", "short_url_id", "bucket_start", "clicks")[:batch_size]
+            )
+            if not rows:
+                return merged
+
+            counts = defaultdict(int)
+            for _, short_url_id, start, clicks in rows:
+                counts[short_url_id, bucket_start(start, coarser)] += clicks
+            add_clicks(coarser, counts)
+
+            pks = [row[0] for row in rows]
+            for i in range(0, len(pks), UPDATE_CHUNK_SIZE):
+                ClickBucket.objects.filter(pk__in=pks[i:i + UPDATE_CHUNK_SIZE]).delete()
+        merged += len(rows)
+
+
+def compact_click_buckets(now=None, batch_size=COMPACT_BATCH_SIZE):
+    """
+    Roll expired minute buckets into hours and hours into days, then drop
+    day buckets past their retention
+
+    Only whole coarser buckets are merged, so a chart at a resolution that
+    is still retained never sees a partially merged bucket. Safe to run
+    concurrently with click flushes.
+
+    Returns:
+        dict: rows merged or deleted per granularity
+    """
+    from .models import ClickBucket
+
+    now = now or timezone.now()
+    result = {}
+    for finer, coarser in ((MINUTE, HOUR), (HOUR, DAY)):
+        cutoff = bucket_start(now - retention(finer), coarser)
+        result[f"{finer}_buckets_merged"] = _merge(finer, coarser, cutoff, batch_size)
+
+    keep = retention(DAY)
+    deleted = 0
+    if keep is not None:
+        deleted, _ = ClickBucket.objects.filter(
+            granularity=DAY, bucket_start__lt=bucket_start(now - keep, DAY)
+        ).delete()
+    result["day_buckets_deleted"] = deleted
+    return result
+
+
+def series_granularity(start, end, requested=None, now=None):
+    """
+    Resolution for a chart of [start, end)
+
+    Without `requested`, ranges up to 6 hours are charted per minute and
+    up to 7 days per hour. The result is never finer than what is still
+    retained at `start`, nor finer than MAX_SERIES_POINTS allows.
+    """
+    now = now or timezone.now()
+    if requested is None:
+        span = end - start
+        if span <= timedelta(hours=6):
+            requested = MINUTE
+        elif span <= timedelta(days=7):
+            requested = HOUR
+        else:
+            requested = DAY
+
+    for granularity in GRANULARITIES[GRANULARITIES.index(requested):]:
+        if granularity == DAY:
+            return DAY
+        step = timedelta(minutes=1) if granularity == MINUTE else timedelta(hours=1)
+        if start >= now - retention(granularity) and (end - start) / step <= MAX_SERIES_POINTS:
+            return granularity
+
+
+def click_series(short_url, start, end, granularity=None):
+    """
+    Clicks on a link per bucket over [start, end), read from the buckets
+
+    Rows at the chosen granularity and at any finer one are summed into
+    the chosen buckets; buckets without clicks are filled with zeros.
+
+    Returns:
+        tuple: (granularity, [(bucket_start, clicks), ...])
+    """
+    from .models import ClickBucket
+
+    granularity = series_granularity(start, end, granularity)
+    first = bucket_start(start, granularity)
+    finer = GRANULARITIES[:GRANULARITIES.index(granularity) + 1]
+
+    totals = defaultdict(int)
+    rows = ClickBucket.objects.filter(
+        short_url=short_url,
+        granularity__in=finer,
+        bucket_start__gte=first,
+        bucket_start__lt=end,
+    ).values_list("bucket_start", "clicks")
+    for moment, clicks in rows:
+        totals[bucket_start(moment, granularity)] += clicks
+
+    points = []
+    current = first
+    while current < end and len(points) < MAX_SERIES_POINTS:
+        points.append((current, totals.get(current, 0)))
+        current = next_bucket(current, granularity)
+    return granularity, points
@@ -0,0 +1,343 @@
+"""
+Load drivers and helpers for the benchmark commands.
+
+run_wsgi()/run_asgi() feed requests straight into the WSGI/ASGI
+callables, so the numbers measure Django and this app rather than a
+network stack or HTTP parser; run_http() drives a real server over
+keep-alive connections. seed_links() and compare_results() back
+`manage.py bench_suite`.
+"""
+import asyncio
+import http.client
+import io
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+BENCH_HOST = "localhost"
+
+# Owners of seeded links are named BENCH_USER_PREFIX + number
+BENCH_USER_PREFIX = "__bench_"
+
+SEED_BATCH_SIZE = 5000
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(latencies, elapsed):
+    """
+    Reduce per-request latencies (seconds) to throughput and percentiles
+
+    Returns:
+        dict: requests, seconds, rps and p50/p90/p99 in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def wsgi_environ(path):
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": path,
+        "SCRIPT_NAME": "",
+        "QUERY_STRING": "",
+        "SERVER_NAME": BENCH_HOST,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": BENCH_HOST,
+        "REMOTE_ADDR": "127.0.0.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+
+def run_wsgi(app, paths, concurrency=1):
+    """Drive a WSGI callable with `concurrency` threads, one request per path"""
+    statuses = {}
+
+    def call(path):
+        def start_response(status, headers, exc_info=None):
+            statuses[status[:3]] = statuses.get(status[:3], 0) + 1
+
+        started = time.perf_counter()
+        result = app(wsgi_environ(path), start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, paths))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["statuses"] = statuses
+    return result
+
+
+def asgi_scope(path):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", BENCH_HOST.encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": (BENCH_HOST, 80),
+    }
+
+
+async def _run_asgi(app, paths, concurrency):
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(path):
+        request_sent = False
+        never = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # The client stays connected; Django cancels this once it responds
+            await never.wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async with semaphore:
+            started = time.perf_counter()
+            await app(asgi_scope(path), receive, send)
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(call(path) for path in paths))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["statuses"] = statuses
+    return result
+
+
+def run_asgi(app, paths, concurrency=1):
+    """Drive an ASGI callable with up to `concurrency` requests in flight"""
+    return asyncio.run(_run_asgi(app, paths, concurrency))
+
+
+def run_calls(func, calls):
+    """
+    Time `func(*args)` for every args tuple in `calls`, one after another
+
+    Returns:
+        dict: as summarize()
+    """
+    latencies = []
+    started = time.perf_counter()
+    for args in calls:
+        call_started = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_http(base_url, paths, concurrency=1):
+    """
+    Drive a running server with `concurrency` keep-alive connections
+
+    Redirects are not followed; the status of the first response counts.
+    """
+    parts = urlsplit(base_url)
+    statuses = {}
+    local = threading.local()
+
+    def call(path):
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        started = time.perf_counter()
+        connection.request("GET", parts.path.rstrip("/") + path, headers={"Host": parts.netloc})
+        response = connection.getresponse()
+        response.read()
+        elapsed = time.perf_counter() - started
+        status = str(response.status)
+        statuses[status] = statuses.get(status, 0) + 1
+        if response.will_close:
+            connection.close()
+            local.connection = None
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, paths))
+    result = summarize(latencies, time.perf_counter() - started)
+    result["statuses"] = statuses
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+SERVER_COMMANDS = {
+    "wsgi": ["-m", "gunicorn", "config.wsgi:application", "--bind", "{bind}", "--workers", "{workers}"],
+    "asgi": ["-m", "uvicorn", "config.asgi:application", "--host", "127.0.0.1", "--port", "{port}",
+             "--workers", "{workers}", "--no-access-log"],
+}
+
+SERVER_MODULES = {"wsgi": "gunicorn", "asgi": "uvicorn"}
+
+
+@contextmanager
+def spawn_server(kind, workers=2, timeout=30):
+    """
+    Run gunicorn ("wsgi") or uvicorn ("asgi") on a free local port
+
+    The server inherits this process's environment, so it uses the same
+    settings and database.
+
+    Yields:
+        str: base URL of the server
+    """
+    port = free_port()
+    args = [
+        arg.format(bind=f"127.0.0.1:{port}", port=port, workers=workers)
+        for arg in SERVER_COMMANDS[kind]
+    ]
+    env = dict(os.environ)
+    if kind == "asgi":
+        env["SHORTENER_ASYNC_REDIRECT"] = "True"
+    process = subprocess.Popen(
+        [sys.executable, *args],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"{SERVER_MODULES[kind]} exited with status {process.returncode}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{SERVER_MODULES[kind]} did not start within {timeout}s")
+                time.sleep(0.2)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def seed_links(rows, users):
+    """
+    Make sure `rows` benchmark links exist, spread over `users` owners
+
+    Existing benchmark links are kept, so a large data set is only built
+    once; only the missing rows are inserted.
+
+    Returns:
+        list: the benchmark users
+    """
+    from django.contrib.auth import get_user_model
+
+    from .bloom import short_code_filter
+    from .code_pool import code_pool
+    from .models import ShortUrl, UserLinkStats
+
+    User = get_user_model()
+    existing = set(
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX).values_list("username", flat=True)
+    )
+    User.objects.bulk_create([
+        User(username=f"{BENCH_USER_PREFIX}{i}")
+        for i in range(users)
+        if f"{BENCH_USER_PREFIX}{i}" not in existing
+    ])
+    owners = list(
+        User.objects.filter(username__in=[f"{BENCH_USER_PREFIX}{i}" for i in range(users)]).order_by("pk")
+    )
+
+    links = ShortUrl.objects.filter(user__in=owners)
+    missing = rows - links.count()
+    created = 0
+    while created < missing:
+        size = min(SEED_BATCH_SIZE, missing - created)
+        codes = code_pool.take_many(size)
+        ShortUrl.objects.bulk_create([
+            ShortUrl(
+                user=owners[(created + i) % len(owners)],
+                original_url=f"https://example.com/bench/{created + i}",
+                short_code=code,
+            )
+            for i, code in enumerate(codes)
+        ])
+        short_code_filter.add_many(codes)
+        created += size
+
+    if created:
+        UserLinkStats.objects.rebuild([owner.pk for owner in owners])
+    return owners
+
+
+def compare_results(baseline, current, max_p99_regression, max_rps_regression):
+    """
+    Compare two benchmark result sets scenario by scenario
+
+    Args:
+        baseline, current: {scenario: summarize() dict}
+        max_p99_regression: allowed relative p99 increase (0.1 = 10%)
+        max_rps_regression: allowed relative throughput drop
+
+    Returns:
+        list: (scenario, metric, baseline, current, change, regressed)
+    """
+    rows = []
+    for scenario in sorted(set(baseline) & set(current)):
+        before, after = baseline[scenario], current[scenario]
+        if before.get("p99_ms"):
+            change = (after["p99_ms"] - before["p99_ms"]) / before["p99_ms"]
+            rows.append((scenario, "p99_ms", before["p99_ms"], after["p99_ms"], change, change > max_p99_regression))
+        if before.get("rps"):
+            change = (after["rps"] - before["rps"]) / before["rps"]
+            rows.append((scenario, "rps", before["rps"], after["rps"], change, -change > max_rps_regression))
+    return rows
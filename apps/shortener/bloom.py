@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from .cache import is_process_local
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Sized from the expected number of items and the target false-positive
+    rate; k bit positions per item come from double hashing one blake2b
+    digest.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.num_bits / 8))
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+    def estimated_error_rate(self):
+        """False-positive rate implied by the current fill level"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class ShortCodeFilter:
+    """
+    Per-process Bloom filter of every existing short code.
+
+    A code the filter has never seen cannot exist, so the redirect path
+    can reject it without a DB query. The filter is rebuilt from the DB in
+    a background thread every SHORTENER_BLOOM_REBUILD_INTERVAL seconds,
+    which also forgets deleted codes. Codes created in between are added
+    locally and flagged in the shared cache so other workers keep letting
+    them through until their next rebuild.
+
+    That only works if the shared cache really is shared: with a
+    per-process backend (locmem, the default without REDIS_URL) the filter
+    stays off, as other workers would 404 new codes until their rebuild.
+    """
+
+    marker_prefix = "shortener:bloom:new:"
+
+    def __init__(self):
+        self._filter = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._unshared = False
+        self.rejected = 0
+        self.passed = 0
+        self.last_build_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return getattr(settings, "SHORTENER_BLOOM_ENABLED", True)
+
+    @property
+    def rebuild_interval(self):
+        return getattr(settings, "SHORTENER_BLOOM_REBUILD_INTERVAL", 600)
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "SHORTENER_REDIRECT_CACHE_ALIAS", "default")
+        return caches[alias]
+
+    def _marker_key(self, short_code):
+        return f"{self.marker_prefix}{short_code}"
+
+    def might_exist(self, short_code):
+        """
+        False only if the short code definitely does not exist
+        """
+        if not self._ready():
+            return True
+        if short_code in self._filter or self.shared.get(self._marker_key(short_code)):
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    async def amight_exist(self, short_code):
+        """Async version of might_exist()"""
+        if not self._ready():
+            return True
+        if short_code in self._filter or await self.shared.aget(self._marker_key(short_code)):
+            self.passed += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def add_many(self, short_codes):
+        """Record newly created short codes in this process and for other workers"""
+        short_codes = list(short_codes)
+        if not short_codes or not self.enabled:
+            return
+        if self._pid != os.getpid():
+            self.start()
+        if self._unshared:
+            return
+        bloom = self._filter
+        if bloom is not None:
+            for short_code in short_codes:
+                bloom.add(short_code)
+        self.shared.set_many(
+            {self._marker_key(code): True for code in short_codes},
+            self.rebuild_interval * 3,
+        )
+
+    def add(self, short_code):
+        self.add_many([short_code])
+
+    def build(self):
+        """Rebuild the filter from every short code in the DB"""
+        from .models import ShortUrl
+
+        started = time.monotonic()
+        total = ShortUrl.objects.count()
+        capacity = max(getattr(settings, "SHORTENER_BLOOM_CAPACITY", 1000000), total * 2)
+        bloom = BloomFilter(capacity, getattr(settings, "SHORTENER_BLOOM_ERROR_RATE", 0.001))
+        for short_code in ShortUrl.objects.values_list("short_code", flat=True).iterator(chunk_size=5000):
+            bloom.add(short_code)
+        self._filter = bloom
+        self.last_build_seconds = time.monotonic() - started
+        return bloom
+
+    def _ready(self):
+        """Start the background builder if needed; True once a filter exists"""
+        if not self.enabled:
+            return False
+        if self._pid != os.getpid():
+            self.start()
+        return self._filter is not None
+
+    def start(self):
+        """Build the filter in the background and keep rebuilding it"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._filter = None
+            self._unshared = is_process_local(self.shared)
+            if self._unshared:
+                logger.warning(
+                    "Short code Bloom filter disabled: the redirect cache is not shared "
+                    "between processes, so other workers would reject new codes; set REDIS_URL"
+                )
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="short-code-bloom", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.build()
+            except Exception:
+                logger.exception("Failed to build the short code Bloom filter")
+            finally:
+                close_old_connections()
+            time.sleep(self.rebuild_interval)
+
+    def stats(self):
+        bloom = self._filter
+        if bloom is None:
+            return {"ready": False, "shared": not self._unshared, "rejected": self.rejected, "passed": self.passed}
+        return {
+            "ready": True,
+            "items": bloom.count,
+            "capacity": bloom.capacity,
+            "bits": bloom.num_bits,
+            "hashes": bloom.num_hashes,
+            "memory_bytes": bloom.memory_bytes,
+            "target_error_rate": bloom.error_rate,
+            "estimated_error_rate": bloom.estimated_error_rate(),
+            "rejected": self.rejected,
+            "passed": self.passed,
+            "last_build_seconds": self.last_build_seconds,
+        }
+
+
+short_code_filter = ShortCodeFilter()
@@ -0,0 +1,239 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django import forms
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .bloom import short_code_filter
+from .cache import redirect_cache
+from .code_pool import code_pool
+from .fastpath import reserved_paths
+from .models import ShortUrl, UserLinkStats
+from .services import MAX_CREATE_ATTEMPTS
+
+DEFAULT_CHUNK_SIZE = 1000
+
+_url_field = ShortUrl._meta.get_field("original_url").formfield()
+_custom_code_field = forms.CharField(min_length=6, max_length=10)
+
+
+def iter_jsonl_rows(lines):
+    """Yield row dicts from JSON Lines; a bare string is taken as the URL"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield {"error": "Invalid JSON"}
+            continue
+        yield row if isinstance(row, dict) else {"original_url": row}
+
+
+def iter_csv_rows(stream):
+    """Yield row dicts from CSV with an original_url[,expires_at,custom_code] header"""
+    lines = (
+        line.decode("utf-8") if isinstance(line, bytes) else line
+        for line in stream
+    )
+    yield from csv.DictReader(lines)
+
+
+def _validate(row):
+    """
+    Clean one input row
+
+    Returns:
+        tuple: (cleaned dict, None) or (None, error message)
+    """
+    if not isinstance(row, dict):
+        return None, "Row must be an object"
+    if row.get("error"):
+        return None, row["error"]
+
+    try:
+        original_url = _url_field.clean(row.get("original_url") or row.get("url"))
+    except forms.ValidationError as e:
+        return None, e.messages[0]
+
+    expires_at = row.get("expires_at") or None
+    if expires_at:
+        expires_at = parse_datetime(str(expires_at))
+        if expires_at is None:
+            return None, "Invalid expires_at"
+        if timezone.is_naive(expires_at):
+            expires_at = timezone.make_aware(expires_at)
+        if expires_at <= timezone.now():
+            return None, "Expiration date/time must be in the future."
+
+    custom_code = row.get("custom_code") or None
+    if custom_code:
+        try:
+            custom_code = _custom_code_field.clean(custom_code)
+        except forms.ValidationError as e:
+            return None, e.messages[0]
+        if custom_code in reserved_paths():
+            return None, "This short code is reserved."
+
+    return {
+        "original_url": original_url,
+        "expires_at": expires_at,
+        "custom_code": custom_code,
+    }, None
+
+
+def _shorten_chunk(user, rows, offset):
+    results = [None] * len(rows)
+    pending = []
+
+    for i, row in enumerate(rows):
+        cleaned, error = _validate(row)
+        if error:
+            results[i] = {"row": offset + i, "error": error}
+        else:
+            pending.append((i, cleaned))
+
+    # One query for every custom code in the chunk instead of one per row
+    custom_codes = [c["custom_code"] for _, c in pending if c["custom_code"]]
+    taken = set(
+        ShortUrl.objects.filter(short_code__in=custom_codes)
+        .values_list("short_code", flat=True)
+    ) if custom_codes else set()
+
+    accepted = []
+    for i, cleaned in pending:
+        code = cleaned["custom_code"]
+        if code and code in taken:
+            results[i] = {"row": offset + i, "error": "This short code is already taken."}
+            continue
+        if code:
+            taken.add(code)
+        accepted.append((i, cleaned))
+
+    generated = iter(code_pool.take_many(
+        sum(1 for _, c in accepted if not c["custom_code"])
+    ))
+    objs = [
+        ShortUrl(
+            user=user,
+            original_url=cleaned["original_url"],
+            short_code=cleaned["custom_code"] or next(generated),
+            expires_at=cleaned["expires_at"],
+        )
+        for _, cleaned in accepted
+    ]
+
+    try:
+        with transaction.atomic():
+            ShortUrl.objects.bulk_create(objs)
+            UserLinkStats.objects.record_links_created(objs)
+    except IntegrityError:
+        # Something raced us for a code; fall back to one savepoint per row
+        # (save() keeps the user's stats up to date itself)
+        objs = _create_one_by_one(objs, [not cleaned["custom_code"] for _, cleaned in accepted])
+
+    # bulk_create skips save(): announce the new codes and drop cached 404s
+    created_codes = [obj.short_code for obj in objs if obj is not None]
+    short_code_filter.add_many(created_codes)
+    redirect_cache.invalidate_many(created_codes)
+
+    for (i, cleaned), obj in zip(accepted, objs):
+        if obj is None:
+            error = "This short code is already taken." if cleaned["custom_code"] else "Could not allocate a short code."
+            results[i] = {"row": offset + i, "error": error}
+        else:
+            results[i] = {
+                "row": offset + i,
+                "original_url": obj.original_url,
+                "short_code": obj.short_code,
+            }
+    return results
+
+
+def _create_one_by_one(objs, generated):
+    """
+    Insert `objs` in one savepoint each; None for rows that still clash
+
+    Rows whose code was generated (flagged in `generated`) retry with a
+    fresh code, as in shorten_url(); custom codes fail at once.
+    """
+    created = []
+    with transaction.atomic():
+        for obj, is_generated in zip(objs, generated):
+            attempts = MAX_CREATE_ATTEMPTS if is_generated else 1
+            for attempt in range(attempts):
+                if attempt:
+                    obj.short_code = code_pool.take()
+                try:
+                    with transaction.atomic():
+                        obj.save(force_insert=True)
+                    break
+                except IntegrityError:
+                    pass
+            else:
+                obj = None
+            created.append(obj)
+    return created
+
+
+def bulk_shorten(user, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Create short URLs for a stream of input rows
+
+    Rows are validated, allocated codes and inserted `chunk_size` at a time,
+    each chunk in its own transaction, so memory use does not depend on the
+    size of the input.
+
+    Args:
+        user: owner of the created links
+        rows: iterable of dicts with original_url and optional
+            expires_at/custom_code
+        chunk_size: rows per transaction
+
+    Yields:
+        dict: per-row result with either short_code or error
+    """
+    rows = iter(rows)
+    offset = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _shorten_chunk(user, chunk, offset)
+        offset += len(chunk)
+
+
+class BulkStats:
+    """Counts results as they stream past and reports throughput"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+        self.created = 0
+        self.errors = 0
+
+    def track(self, results):
+        for result in results:
+            self.rows += 1
+            if "error" in result:
+                self.errors += 1
+            else:
+                self.created += 1
+            yield result
+
+    def summary(self):
+        seconds = time.monotonic() - self.started
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds, 1) if seconds else None,
+        }
@@ -0,0 +1,362 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+
+PERMANENT_REDIRECTS = (301, 308)
+
+_TARGET_FIELDS = ["original_url", "is_active", "expires_at", "redirect_type", "cache_max_age"]
+
+
+class RedirectTarget(namedtuple("RedirectTarget", _TARGET_FIELDS, defaults=(302, None))):
+    """What the redirect view needs to answer a request without touching the DB"""
+
+    __slots__ = ()
+
+    def is_live(self, now=None):
+        """True if the link is active and has not expired yet"""
+        if not self.is_active:
+            return False
+        return self.expires_at is None or self.expires_at > (now or timezone.now())
+
+    def seconds_to_expiry(self):
+        if self.expires_at is None:
+            return None
+        return (self.expires_at - timezone.now()).total_seconds()
+
+    def cache_seconds(self):
+        """
+        Cache-Control max-age for the redirect response
+
+        The link's cache_max_age, or the default for permanent/temporary
+        redirects, cut short so caches never serve it past expires_at.
+
+        Returns:
+            int: 0 means the response must not be cached
+        """
+        max_age = self.cache_max_age
+        if max_age is None:
+            if self.redirect_type in PERMANENT_REDIRECTS:
+                max_age = getattr(settings, "SHORTENER_PERMANENT_REDIRECT_MAX_AGE", 86400)
+            else:
+                max_age = getattr(settings, "SHORTENER_TEMPORARY_REDIRECT_MAX_AGE", 0)
+        remaining = self.seconds_to_expiry()
+        if remaining is not None:
+            max_age = min(max_age, max(0, int(remaining)))
+        return max_age
+
+    def cache_control(self):
+        """Cache-Control header value for the redirect response"""
+        max_age = self.cache_seconds()
+        if max_age <= 0:
+            return "no-cache"
+        return f"public, max-age={max_age}"
+
+
+# Cached stand-in for a short code that does not exist; inactive, so every
+# caller that checks is_active already treats it as a 404
+NOT_FOUND = RedirectTarget(None, False, None)
+
+_MISSING = object()
+
+
+def is_process_local(cache):
+    """True if `cache` keeps its entries in this process only (locmem, dummy)"""
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+class LocalLRUCache:
+    """
+    Bounded, thread-safe LRU map with a per-entry TTL.
+
+    Lives in process memory, so a hit costs a dict lookup instead of a
+    network or DB round trip.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key in this process
+
+    The first caller runs the function; callers arriving while it runs
+    wait and get its result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = func()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines, per event loop"""
+
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        loop = asyncio.get_running_loop()
+        future = self._calls.get((loop, key))
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self._calls[loop, key] = loop.create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved, in case nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[loop, key]
+
+
+class RedirectCache:
+    """
+    Two-tier short_code -> RedirectTarget cache.
+
+    The first tier is a LocalLRUCache private to the worker process, the
+    second a Django cache backend (locmem, file, Redis...) shared by all
+    workers. Local entries use a short TTL because invalidations only
+    reach the shared tier and the local tier of the invalidating process.
+    """
+
+    key_prefix = "shortener:redirect:"
+
+    def __init__(self):
+        self._local = None
+        self._init_lock = threading.Lock()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        # Coalesce DB lookups of concurrent misses on the same code
+        self.loads = SingleFlight()
+        self.aloads = AsyncSingleFlight()
+
+    @property
+    def local(self):
+        if self._local is None:
+            with self._init_lock:
+                if self._local is None:
+                    self._local = LocalLRUCache(
+                        maxsize=getattr(settings, "SHORTENER_REDIRECT_CACHE_SIZE", 10000),
+                        ttl=getattr(settings, "SHORTENER_REDIRECT_CACHE_LOCAL_TTL", 30),
+                    )
+        return self._local
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "SHORTENER_REDIRECT_CACHE_ALIAS", "default")
+        return caches[alias]
+
+    @property
+    def shared_ttl(self):
+        return getattr(settings, "SHORTENER_REDIRECT_CACHE_TTL", 300)
+
+    def make_key(self, short_code):
+        return f"{self.key_prefix}{short_code}"
+
+    def _from_shared(self, value):
+        target = RedirectTarget(*value)
+        return NOT_FOUND if target == NOT_FOUND else target
+
+    def get(self, short_code):
+        """
+        Look up a short code in both tiers
+
+        Returns:
+            RedirectTarget or None on a miss in both tiers
+        """
+        target = self.local.get(short_code)
+        if target is not None:
+            return target
+
+        value = self.shared.get(self.make_key(short_code))
+        if value is None:
+            self.shared_misses += 1
+            return None
+
+        self.shared_hits += 1
+        target = self._from_shared(value)
+        self.local.set(short_code, target, self._ttls(target)[1])
+        return target
+
+    async def aget(self, short_code):
+        """Async version of get(); only the shared tier is awaited"""
+        target = self.local.get(short_code)
+        if target is not None:
+            return target
+
+        value = await self.shared.aget(self.make_key(short_code))
+        if value is None:
+            self.shared_misses += 1
+            return None
+
+        self.shared_hits += 1
+        target = self._from_shared(value)
+        self.local.set(short_code, target, self._ttls(target)[1])
+        return target
+
+    @property
+    def negative_ttl(self):
+        return getattr(settings, "SHORTENER_NEGATIVE_CACHE_TTL", 30)
+
+    def _ttls(self, target):
+        """(shared, local) TTLs; live links expire from the cache at expires_at"""
+        if target is NOT_FOUND:
+            return self.negative_ttl, min(self.negative_ttl, self.local.ttl)
+        remaining = target.seconds_to_expiry()
+        if remaining is not None and remaining > 0:
+            return (
+                min(self.shared_ttl, max(1, int(remaining))),
+                min(self.local.ttl, remaining),
+            )
+        return self.shared_ttl, None
+
+    def set_local(self, short_code, target, ttl=None):
+        """
+        Store a RedirectTarget in this process's tier only (e.g. from a snapshot)
+
+        `ttl` overrides the local tier's TTL; the entry still expires at
+        the link's expires_at.
+        """
+        if ttl is None:
+            ttl = self._ttls(target)[1]
+        else:
+            remaining = target.seconds_to_expiry()
+            if remaining is not None:
+                ttl = min(ttl, remaining)
+        self.local.set(short_code, target, ttl)
+
+    def set(self, short_code, target):
+        """Store a RedirectTarget (or NOT_FOUND, with a short TTL) in both tiers"""
+        shared_ttl, local_ttl = self._ttls(target)
+        self.shared.set(self.make_key(short_code), tuple(target), shared_ttl)
+        self.local.set(short_code, target, local_ttl)
+
+    async def aset(self, short_code, target):
+        """Async version of set()"""
+        shared_ttl, local_ttl = self._ttls(target)
+        await self.shared.aset(self.make_key(short_code), tuple(target), shared_ttl)
+        self.local.set(short_code, target, local_ttl)
+
+    def invalidate(self, short_code):
+        """Drop a short code from both tiers"""
+        self.local.delete(short_code)
+        self.shared.delete(self.make_key(short_code))
+
+    def invalidate_many(self, short_codes):
+        short_codes = list(short_codes)
+        for short_code in short_codes:
+            self.local.delete(short_code)
+        self.shared.delete_many([self.make_key(code) for code in short_codes])
+
+    def clear_local(self):
+        self.local.clear()
+
+    def stats(self):
+        """Hit/miss/eviction counters for both tiers of this process"""
+        local = self.local
+        return {
+            "local_hits": local.hits,
+            "local_misses": local.misses,
+            "local_evictions": local.evictions,
+            "local_expirations": local.expirations,
+            "local_size": len(local),
+            "shared_hits": self.shared_hits,
+            "shared_misses": self.shared_misses,
+            "coalesced_loads": self.loads.coalesced + self.aloads.coalesced,
+        }
+
+
+redirect_cache = RedirectCache()
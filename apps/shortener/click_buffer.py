@@ -0,0 +1,250 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from .analytics import MINUTE, UPDATE_CHUNK_SIZE, add_clicks
+from .cache import is_process_local
+
+logger = logging.getLogger(__name__)
+
+# Set by `manage.py flush_clicks`; every worker flushes when the value changes
+FLUSH_REQUEST_KEY = "shortener:clicks:flush_request"
+
+
+class ClickBuffer:
+    """
+    Write-behind aggregation of redirect clicks.
+
+    Redirects only bump an in-memory counter per (short code, minute). A
+    background thread flushes the counters with one `F('click_count') + n`
+    UPDATE per distinct n, so concurrent workers never lose increments and
+    a redirect never waits on a row lock. The same flush adds the clicks to
+    the per-link minute buckets behind the click charts.
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(int)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._seen_flush_request = None
+        self._unshared = False
+        self.flushed_clicks = 0
+        self.flush_count = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def interval(self):
+        return getattr(settings, "SHORTENER_CLICK_FLUSH_INTERVAL", 5)
+
+    @property
+    def threshold(self):
+        return getattr(settings, "SHORTENER_CLICK_FLUSH_THRESHOLD", 1000)
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "SHORTENER_REDIRECT_CACHE_ALIAS", "default")
+        return caches[alias]
+
+    def record(self, short_code, count=1):
+        """
+        Buffer `count` clicks for a short code
+
+        With SHORTENER_CLICK_FLUSH_INTERVAL <= 0 clicks are written through
+        immediately instead.
+        """
+        key = (short_code, int(time.time() // 60))
+        if self.interval <= 0:
+            self._write({key: count})
+            return
+
+        with self._lock:
+            self._counts[key] += count
+            self._pending += count
+            full = self._pending >= self.threshold
+
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    async def arecord(self, short_code, count=1):
+        """Async version of record(); only awaits in write-through mode"""
+        if self.interval <= 0:
+            await sync_to_async(self._write)({(short_code, int(time.time() // 60)): count})
+            return
+        self.record(short_code, count)
+
+    @property
+    def depth(self):
+        """Number of clicks waiting to be flushed"""
+        return self._pending
+
+    def flush(self):
+        """
+        Write all buffered clicks to the database
+
+        Returns:
+            int: number of clicks written
+        """
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            self._pending = 0
+
+        if not counts:
+            return 0
+
+        started = time.monotonic()
+        try:
+            self._write(counts)
+        except Exception:
+            logger.exception("Failed to flush %d buffered click counters", len(counts))
+            # Put the clicks back so the next flush retries them
+            with self._lock:
+                for key, count in counts.items():
+                    self._counts[key] += count
+                    self._pending += count
+            return 0
+
+        total = sum(counts.values())
+        self.flushed_clicks += total
+        self.flush_count += 1
+        self.last_flush_seconds = time.monotonic() - started
+        return total
+
+    def write_counts(self, counts):
+        """
+        Write clicks counted outside this process (e.g. from CDN logs) now
+
+        Args:
+            counts: {(short_code, minute since the epoch): clicks}
+        """
+        self._write(counts)
+
+    def _write(self, counts):
+        """
+        Args:
+            counts: {(short_code, minute since the epoch): clicks}
+        """
+        from .models import ShortUrl, UserLinkStats
+
+        per_code = defaultdict(int)
+        for (short_code, _), count in counts.items():
+            per_code[short_code] += count
+
+        links = {}
+        codes = list(per_code)
+        for i in range(0, len(codes), UPDATE_CHUNK_SIZE):
+            for pk, short_code, user_id in ShortUrl.objects.filter(
+                short_code__in=codes[i:i + UPDATE_CHUNK_SIZE]
+            ).values_list("pk", "short_code", "user_id"):
+                links[short_code] = (pk, user_id)
+
+        by_count = defaultdict(list)
+        clicks_by_user = defaultdict(int)
+        for short_code, count in per_code.items():
+            if short_code in links:
+                by_count[count].append(links[short_code][0])
+                clicks_by_user[links[short_code][1]] += count
+
+        minute_counts = defaultdict(int)
+        for (short_code, minute), count in counts.items():
+            if short_code in links:
+                start = datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc)
+                minute_counts[links[short_code][0], start] += count
+
+        with transaction.atomic():
+            for count, pks in by_count.items():
+                for i in range(0, len(pks), UPDATE_CHUNK_SIZE):
+                    ShortUrl.objects.filter(
+                        pk__in=pks[i:i + UPDATE_CHUNK_SIZE]
+                    ).update(click_count=F("click_count") + count)
+            UserLinkStats.objects.record_clicks(clicks_by_user)
+            add_clicks(MINUTE, minute_counts)
+
+    def request_flush(self):
+        """
+        Ask every worker sharing the cache backend to flush on its next tick
+
+        Needs a cache shared between processes (REDIS_URL); with a
+        per-process one (locmem) no other worker can see the request.
+
+        Returns:
+            bool: False if the request cannot reach other workers
+        """
+        if is_process_local(self.shared):
+            logger.warning("Flush request not sent: the cache is not shared between processes; set REDIS_URL")
+            return False
+        self.shared.set(FLUSH_REQUEST_KEY, uuid.uuid4().hex, None)
+        return True
+
+    def _flush_requested(self):
+        if self._unshared:
+            return False
+        try:
+            token = self.shared.get(FLUSH_REQUEST_KEY)
+        except Exception:
+            return False
+        if token is None or token == self._seen_flush_request:
+            return False
+        self._seen_flush_request = token
+        return True
+
+    def _ensure_thread(self):
+        # A forked worker inherits the attribute but not the thread itself
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wakeup = threading.Event()
+            self._unshared = is_process_local(self.shared)
+            try:
+                self._seen_flush_request = self.shared.get(FLUSH_REQUEST_KEY)
+            except Exception:
+                self._seen_flush_request = None
+            self._thread = threading.Thread(
+                target=self._run, name="click-buffer-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            self._wakeup.wait(timeout=min(self.interval, 1))
+            self._wakeup.clear()
+            try:
+                due = time.monotonic() - last_flush >= self.interval
+                if due or self._pending >= self.threshold or self._flush_requested():
+                    self.flush()
+                    last_flush = time.monotonic()
+                    close_old_connections()
+            except Exception:
+                logger.exception("Click buffer flush loop failed")
+
+    def stats(self):
+        return {
+            "depth": self._pending,
+            "flushed_clicks": self.flushed_clicks,
+            "flush_count": self.flush_count,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+
+click_buffer = ClickBuffer()
+
+# Flush whatever is left when the worker shuts down
+atexit.register(click_buffer.flush)
@@ -0,0 +1,300 @@
+import atexit
+import logging
+import os
+import socket
+import string
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ShortCodeLease, ShortCodeSequence, ShortUrl
+
+logger = logging.getLogger(__name__)
+
+BASE62 = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+CODE_SPACE = len(BASE62) ** CODE_LENGTH
+
+# n -> (n * CODE_MULTIPLIER + CODE_OFFSET) % CODE_SPACE is a bijection because
+# the multiplier shares no factor with 62**6, so consecutive sequence values
+# map to unrelated-looking codes that can never collide with each other.
+CODE_MULTIPLIER = 2654435761
+CODE_OFFSET = 19731208471
+
+SEQUENCE_NAME = "short_code"
+
+# Keep IN (...) lists well below SQLite's parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def encode_base62(number, length=0):
+    """Encode a non-negative integer, left-padded to `length` characters"""
+    chars = []
+    while number:
+        number, rem = divmod(number, len(BASE62))
+        chars.append(BASE62[rem])
+    return "".join(reversed(chars)).rjust(length, BASE62[0])
+
+
+def sequence_to_short_code(value):
+    """
+    Map a sequence value to its short code
+
+    The first 62**6 values become scrambled 6-character codes; later values
+    are encoded as-is and are therefore 7+ characters long.
+    """
+    if value < CODE_SPACE:
+        return encode_base62(
+            (value * CODE_MULTIPLIER + CODE_OFFSET) % CODE_SPACE, CODE_LENGTH
+        )
+    return encode_base62(value)
+
+
+def reserve_sequence_block(size):
+    """
+    Reserve `size` consecutive sequence values in one DB round trip
+
+    Returns:
+        range: the reserved values
+    """
+    with transaction.atomic():
+        sequence, _ = (
+            ShortCodeSequence.objects
+            .select_for_update()
+            .get_or_create(name=SEQUENCE_NAME)
+        )
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=["next_value"])
+    return range(start, start + size)
+
+
+def unused_values(values):
+    """Drop sequence values whose short code already belongs to a ShortUrl"""
+    values = list(values)
+    codes = {sequence_to_short_code(value): value for value in values}
+    taken = set()
+    code_list = list(codes)
+    for i in range(0, len(code_list), LOOKUP_CHUNK_SIZE):
+        taken.update(
+            ShortUrl.objects
+            .filter(short_code__in=code_list[i:i + LOOKUP_CHUNK_SIZE])
+            .values_list("short_code", flat=True)
+        )
+    return [value for code, value in codes.items() if code not in taken]
+
+
+class CodePool:
+    """
+    Per-process pool of pre-allocated short codes.
+
+    Codes are leased from the sequence in batches and handed out from
+    memory. A background thread tops the pool up once it drops below the
+    low-water mark and heartbeats the leases this process holds. On a
+    clean shutdown the unused tail of each lease is released; leases whose
+    heartbeat stops (crashed worker) go stale. Both are recycled by the
+    next refill after filtering out codes that did get used.
+    """
+
+    def __init__(self):
+        self._values = deque()
+        self._remaining = {}
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.owner = None
+        self.refill_count = 0
+        self.recycled_codes = 0
+        self.last_refill_seconds = 0.0
+        self.max_refill_seconds = 0.0
+
+    @property
+    def batch_size(self):
+        return getattr(settings, "SHORTENER_CODE_POOL_SIZE", 1000)
+
+    @property
+    def low_water(self):
+        return getattr(settings, "SHORTENER_CODE_POOL_LOW_WATER", 200)
+
+    @property
+    def lease_ttl(self):
+        return getattr(settings, "SHORTENER_CODE_LEASE_TTL", 3600)
+
+    @property
+    def depth(self):
+        """Number of codes ready to be handed out"""
+        return len(self._values)
+
+    def take(self):
+        """Hand out one short code"""
+        return self.take_many(1)[0]
+
+    def take_many(self, count):
+        """
+        Hand out `count` short codes, refilling inline if the pool runs dry
+
+        Returns:
+            list: short codes
+        """
+        self._check_fork()
+        codes = []
+        while len(codes) < count:
+            with self._lock:
+                while self._values and len(codes) < count:
+                    value, lease_id = self._values.popleft()
+                    self._remaining[lease_id] -= 1
+                    codes.append(sequence_to_short_code(value))
+            if len(codes) < count:
+                self.refill(max(self.batch_size, count - len(codes)))
+
+        self._ensure_thread()
+        if self.depth < self.low_water:
+            self._wakeup.set()
+        return codes
+
+    def refill(self, size=None):
+        """
+        Lease at least `size` more codes, recycling released or stale leases first
+        """
+        size = size or self.batch_size
+        with self._refill_lock:
+            started = time.monotonic()
+            added = 0
+            while added < size:
+                lease, values = self._lease(size - added)
+                with self._lock:
+                    self._values.extend((value, lease.pk) for value in values)
+                    self._remaining[lease.pk] = self._remaining.get(lease.pk, 0) + len(values)
+                added += len(values)
+
+            elapsed = time.monotonic() - started
+            self.refill_count += 1
+            self.last_refill_seconds = elapsed
+            self.max_refill_seconds = max(self.max_refill_seconds, elapsed)
+
+    def _lease(self, size):
+        now = timezone.now()
+        stale = now - timedelta(seconds=self.lease_ttl)
+        with transaction.atomic():
+            lease = (
+                ShortCodeLease.objects
+                .select_for_update(skip_locked=True)
+                .filter(Q(owner="") | Q(heartbeat_at__lt=stale))
+                .order_by("start")
+                .first()
+            )
+            if lease is not None:
+                values = unused_values(range(lease.start, lease.stop))
+                self.recycled_codes += len(values)
+            else:
+                block = reserve_sequence_block(size)
+                lease = ShortCodeLease(start=block.start, stop=block.stop)
+                values = list(block)
+
+            lease.owner = self.owner
+            lease.heartbeat_at = now
+            lease.save()
+        return lease, values
+
+    def heartbeat(self):
+        """Mark this process's leases as alive and forget exhausted ones"""
+        with self._lock:
+            exhausted = [pk for pk, left in self._remaining.items() if left <= 0]
+            for pk in exhausted:
+                del self._remaining[pk]
+            alive = list(self._remaining)
+        ShortCodeLease.objects.filter(pk__in=exhausted, owner=self.owner).delete()
+        ShortCodeLease.objects.filter(pk__in=alive, owner=self.owner).update(
+            heartbeat_at=timezone.now()
+        )
+
+    def release(self):
+        """Hand the unused part of every lease back for other processes to recycle"""
+        with self._lock:
+            first_unused = {}
+            for value, lease_id in self._values:
+                first_unused.setdefault(lease_id, value)
+            self._values.clear()
+            leases = list(self._remaining)
+            self._remaining.clear()
+
+        for lease_id in leases:
+            if lease_id in first_unused:
+                ShortCodeLease.objects.filter(pk=lease_id, owner=self.owner).update(
+                    start=first_unused[lease_id], owner=""
+                )
+            else:
+                ShortCodeLease.objects.filter(pk=lease_id, owner=self.owner).delete()
+
+    def _check_fork(self):
+        # A forked worker must not hand out codes its parent also holds
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._values = deque()
+            self._remaining = {}
+            self._thread = None
+            self._wakeup = threading.Event()
+            self.owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="code-pool-refill", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        last_heartbeat = time.monotonic()
+        while True:
+            self._wakeup.wait(timeout=self.lease_ttl / 4)
+            self._wakeup.clear()
+            try:
+                if self.depth < self.low_water:
+                    self.refill()
+                if time.monotonic() - last_heartbeat >= self.lease_ttl / 4:
+                    self.heartbeat()
+                    last_heartbeat = time.monotonic()
+                close_old_connections()
+            except Exception:
+                logger.exception("Short code pool refill failed")
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "leases": len(self._remaining),
+            "refill_count": self.refill_count,
+            "recycled_codes": self.recycled_codes,
+            "last_refill_seconds": self.last_refill_seconds,
+            "max_refill_seconds": self.max_refill_seconds,
+        }
+
+
+code_pool = CodePool()
+
+
+def _release_on_exit():
+    if code_pool._pid == os.getpid() and code_pool._remaining:
+        try:
+            code_pool.release()
+        except Exception:
+            logger.exception("Failed to release short code leases")
+
+
+atexit.register(_release_on_exit)
@@ -0,0 +1,187 @@
+"""
+Serving stored QR images and archives of them.
+
+Single images are answered from the QR image LRU, offloaded to the web
+server (X-Accel-Redirect / X-Sendfile), or streamed from storage with
+FileResponse; all three honour conditional and single-range requests.
+The "download all" archive is a ZIP written into a small buffer that is
+flushed to the client after every file, so it is never held in memory.
+"""
+import hashlib
+import re
+import zipfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .qr_service import cached_qr_image, qr_storage
+
+SENDFILE_X_ACCEL = "x-accel-redirect"
+SENDFILE_X_SENDFILE = "x-sendfile"
+
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single-range `Range: bytes=...` header
+
+    Multi-range and malformed headers are ignored, as RFC 9110 allows.
+
+    Returns:
+        tuple: (start, end) inclusive, None to serve the whole file, or
+        False if the range cannot be satisfied
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _file_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(STREAM_BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve_qr_image(request, short_url):
+    """
+    Response for downloading a link's stored QR image
+
+    Args:
+        request: the download request
+        short_url: ShortUrl with a stored QR image
+    """
+    name = short_url.qr_code_image.name
+    # Image names are unique per rendered image, so the name identifies the content
+    etag = quote_etag(hashlib.sha256(name.encode("utf-8")).hexdigest()[:32])
+    last_modified = int(short_url.qr_code_generated_at.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    filename = f"qr_code_{short_url.short_code}.png"
+    sendfile = getattr(settings, "SHORTENER_QR_SENDFILE", "")
+    content = None if sendfile else cached_qr_image(name)
+
+    if sendfile:
+        # The web server reads the file and handles ranges itself
+        response = HttpResponse(content_type="image/png")
+        if sendfile == SENDFILE_X_ACCEL:
+            prefix = getattr(settings, "SHORTENER_QR_SENDFILE_PREFIX", "/protected-media/")
+            response["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{name}"
+        else:
+            response["X-Sendfile"] = qr_storage().path(name)
+    else:
+        size = len(content) if content is not None else qr_storage().size(name)
+        byte_range = None
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if if_range is None or if_range == etag:
+            byte_range = parse_byte_range(request.META.get("HTTP_RANGE"), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        if byte_range is None:
+            if content is not None:
+                response = HttpResponse(content, content_type="image/png")
+            else:
+                response = FileResponse(qr_storage().open(name, "rb"), content_type="image/png")
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            if content is not None:
+                response = HttpResponse(content[start:end + 1], content_type="image/png", status=206)
+            else:
+                response = StreamingHttpResponse(
+                    _file_range(qr_storage().open(name, "rb"), start, length),
+                    content_type="image/png",
+                    status=206,
+                )
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response["Content-Length"] = str(length)
+        response["Accept-Ranges"] = "bytes"
+
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class _ZipBuffer:
+    """Write-only sink for ZipFile that hands out what was written so far"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_qr_zip(short_urls):
+    """
+    Yield a ZIP archive of the stored QR images of `short_urls`, piece by piece
+
+    PNGs are already compressed, so entries are stored rather than
+    deflated; links whose file has gone missing are skipped.
+    """
+    storage = qr_storage()
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        rows = (
+            short_urls.filter(qr_code_generated_at__isnull=False)
+            .exclude(qr_code_image="")
+            .values_list("short_code", "qr_code_image")
+            .iterator(chunk_size=500)
+        )
+        for short_code, name in rows:
+            try:
+                image = storage.open(name, "rb")
+            except FileNotFoundError:
+                continue
+            with image, archive.open(f"qr_code_{short_code}.png", mode="w") as entry:
+                for chunk in iter(lambda: image.read(STREAM_BLOCK_SIZE), b""):
+                    entry.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def stream_qr_zip(short_urls, filename="qr_codes.zip"):
+    response = StreamingHttpResponse(iter_qr_zip(short_urls), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
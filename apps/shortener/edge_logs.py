@@ -0,0 +1,151 @@
+"""
+Click counts from CDN access logs.
+
+Once a redirect is cacheable (see RedirectTarget.cache_seconds), a CDN
+answers repeat clicks without asking us, so those clicks never reach the
+click buffer. The CDN still logs them: count_edge_clicks() reads such a
+log and counts the redirects the edge served from its cache, per short
+code and minute, ready for ClickBuffer.write_counts(). Cache misses are
+skipped because they reached us and were counted by the redirect view.
+Clicks answered from a browser's own cache are never seen by anyone.
+
+Two formats are understood:
+
+- "w3c": W3C extended logs with a #Fields header, as written by
+  CloudFront (tab separated, date/time in UTC)
+- "json": one JSON object per line, as written by Cloudflare Logpush;
+  field names are configurable
+"""
+import gzip
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import unquote
+
+from .fastpath import SHORT_CODE_PATH, reserved_paths
+
+FORMATS = ("w3c", "json")
+
+REDIRECT_STATUSES = {301, 302, 307, 308}
+
+# Cache statuses (lower case) of responses served without contacting us
+EDGE_HIT_STATUSES = {"hit", "stale", "updating"}
+
+W3C_FIELDS = {
+    "date": "date",
+    "time": "time",
+    "path": "cs-uri-stem",
+    "status": "sc-status",
+    "cache": "x-edge-result-type",
+}
+
+JSON_FIELDS = {
+    "time": "EdgeStartTimestamp",
+    "path": "ClientRequestPath",
+    "status": "EdgeResponseStatus",
+    "cache": "CacheCacheStatus",
+}
+
+
+def open_log(path):
+    """Open a log file as text, transparently un-gzipping *.gz files"""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def parse_timestamp(value):
+    """
+    Seconds since the epoch from an RFC 3339 string or a Unix timestamp in
+    seconds, milliseconds, microseconds or nanoseconds
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            return moment.timestamp()
+    for scale in (1e18, 1e15, 1e12):
+        if value >= scale:
+            return value / (scale / 1e9)
+    return float(value)
+
+
+def iter_w3c(lines):
+    """(timestamp, path, status, cache status) of each W3C log line"""
+    columns = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("#Fields:"):
+            columns = {name: i for i, name in enumerate(line.split()[1:])}
+            continue
+        if not line or line.startswith("#") or columns is None:
+            continue
+        values = line.split("\t")
+        try:
+            moment = datetime.fromisoformat(
+                f"{values[columns[W3C_FIELDS['date']]]}T{values[columns[W3C_FIELDS['time']]]}+00:00"
+            )
+            yield (
+                moment.timestamp(),
+                values[columns[W3C_FIELDS["path"]]],
+                int(values[columns[W3C_FIELDS["status"]]]),
+                values[columns[W3C_FIELDS["cache"]]],
+            )
+        except (KeyError, IndexError, ValueError):
+            continue
+
+
+def iter_json(lines, fields=JSON_FIELDS):
+    """(timestamp, path, status, cache status) of each JSON log line"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+            yield (
+                parse_timestamp(entry[fields["time"]]),
+                entry[fields["path"]],
+                int(entry[fields["status"]]),
+                str(entry.get(fields["cache"], "")),
+            )
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def count_edge_clicks(lines, fmt="w3c", fields=None, hit_statuses=EDGE_HIT_STATUSES):
+    """
+    Count the redirects a CDN served from its cache
+
+    Args:
+        lines: log lines
+        fmt: "w3c" or "json"
+        fields: JSON field names overriding JSON_FIELDS (json only)
+        hit_statuses: lower-case cache statuses that did not reach us
+
+    Returns:
+        tuple: ({(short_code, minute since the epoch): clicks}, lines skipped)
+    """
+    if fmt == "json":
+        entries = iter_json(lines, {**JSON_FIELDS, **(fields or {})})
+    else:
+        entries = iter_w3c(lines)
+
+    reserved = reserved_paths()
+    counts = defaultdict(int)
+    skipped = 0
+    for timestamp, path, status, cache_status in entries:
+        match = SHORT_CODE_PATH.match(unquote(path))
+        if (
+            status not in REDIRECT_STATUSES
+            or cache_status.lower() not in hit_statuses
+            or match is None
+            or match.group(1) in reserved
+        ):
+            skipped += 1
+            continue
+        counts[match.group(1), int(timestamp // 60)] += 1
+    return counts, skipped
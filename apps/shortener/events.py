@@ -0,0 +1,321 @@
+"""
+Append-only log of every redirect.
+
+Redirects append a tuple to an in-memory ring buffer; a background thread
+drains it every SHORTENER_CLICK_EVENT_FLUSH_INTERVAL seconds into either
+the ClickEvent table (bulk_create) or rotated JSON Lines segments on local
+disk, which `manage.py replay_click_events` loads into the table later.
+Events older than SHORTENER_CLICK_EVENT_RETENTION_DAYS are deleted by
+`manage.py purge_click_events`.
+
+The redirect never waits on the sink. When the buffer is more than half
+full only every SHORTENER_CLICK_EVENT_SAMPLE_EVERY-th event is kept, and
+once it is full new events are dropped; both are counted in stats().
+"""
+import atexit
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+SINK_DB = "db"
+SINK_FILE = "file"
+
+# Closed segments end in SEGMENT_SUFFIX; the one being written has
+# OPEN_SUFFIX appended so replay never reads a half-written file
+SEGMENT_SUFFIX = ".jsonl"
+OPEN_SUFFIX = ".open"
+
+INSERT_BATCH_SIZE = 1000
+PURGE_BATCH_SIZE = 5000
+
+USER_AGENT_MAX_LENGTH = 512
+REFERRER_MAX_LENGTH = 2048
+
+
+def hash_ip(ip):
+    """Keyed hash of a client IP, so events can be correlated but not reversed"""
+    if not ip:
+        return ""
+    key = settings.SECRET_KEY.encode()
+    return hmac.new(key, ip.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def event_row(event):
+    """Turn a buffered event tuple into the dict stored in segments"""
+    timestamp, short_code, referrer, user_agent, ip = event
+    return {
+        "clicked_at": datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat(),
+        "short_code": short_code,
+        "referrer": referrer[:REFERRER_MAX_LENGTH],
+        "user_agent": user_agent[:USER_AGENT_MAX_LENGTH],
+        "ip_hash": hash_ip(ip),
+    }
+
+
+def load_rows(rows, batch_size=INSERT_BATCH_SIZE):
+    """
+    bulk_create ClickEvent rows from event dicts
+
+    Returns:
+        int: rows inserted
+    """
+    from django.utils.dateparse import parse_datetime
+    from .models import ClickEvent
+
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(ClickEvent(
+            clicked_at=parse_datetime(row["clicked_at"]),
+            short_code=row["short_code"],
+            referrer=row.get("referrer", ""),
+            user_agent=row.get("user_agent", ""),
+            ip_hash=row.get("ip_hash", ""),
+        ))
+        if len(batch) >= batch_size:
+            ClickEvent.objects.bulk_create(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        ClickEvent.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+def purge_click_events(batch_size=PURGE_BATCH_SIZE, now=None):
+    """
+    Delete up to `batch_size` events older than
+    SHORTENER_CLICK_EVENT_RETENTION_DAYS (0 keeps events forever)
+
+    Returns:
+        int: number of events deleted
+    """
+    from django.utils import timezone
+    from .models import ClickEvent
+
+    days = getattr(settings, "SHORTENER_CLICK_EVENT_RETENTION_DAYS", 30)
+    if not days:
+        return 0
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    ids = list(
+        ClickEvent.objects.filter(clicked_at__lt=cutoff)
+        .order_by("clicked_at")
+        .values_list("pk", flat=True)[:batch_size]
+    )
+    if not ids:
+        return 0
+    ClickEvent.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+class ClickEventLog:
+    """
+    Bounded ring buffer of click events drained by a background thread.
+    """
+
+    def __init__(self):
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._segment = None
+        self._segment_path = None
+        self._segment_opened = 0.0
+        self._sample_counter = 0
+        self.recorded = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.segments_closed = 0
+
+    @property
+    def sink(self):
+        return getattr(settings, "SHORTENER_CLICK_EVENT_SINK", SINK_DB)
+
+    @property
+    def capacity(self):
+        return getattr(settings, "SHORTENER_CLICK_EVENT_BUFFER_SIZE", 100000)
+
+    @property
+    def sample_every(self):
+        return max(1, getattr(settings, "SHORTENER_CLICK_EVENT_SAMPLE_EVERY", 10))
+
+    @property
+    def interval(self):
+        return getattr(settings, "SHORTENER_CLICK_EVENT_FLUSH_INTERVAL", 1.0)
+
+    @property
+    def directory(self):
+        return Path(getattr(settings, "SHORTENER_CLICK_EVENT_DIR", settings.BASE_DIR / "click_events"))
+
+    @property
+    def segment_bytes(self):
+        return getattr(settings, "SHORTENER_CLICK_EVENT_SEGMENT_BYTES", 64 * 1024 * 1024)
+
+    @property
+    def segment_seconds(self):
+        return getattr(settings, "SHORTENER_CLICK_EVENT_SEGMENT_SECONDS", 3600)
+
+    def record(self, short_code, referrer="", user_agent="", ip=""):
+        """
+        Queue one redirect; never blocks on the sink
+
+        Returns:
+            bool: False if the event was sampled out or dropped
+        """
+        if not self.sink:
+            return False
+        events = self._events
+        depth = len(events)
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+        if depth >= self.capacity // 2:
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_every:
+                self.sampled_out += 1
+                return False
+
+        # deque.append is atomic, so the hot path takes no lock
+        events.append((time.time(), short_code, referrer or "", user_agent or "", ip or ""))
+        self.recorded += 1
+        self._ensure_thread()
+        return True
+
+    @property
+    def depth(self):
+        return len(self._events)
+
+    def drain(self):
+        """
+        Write every buffered event to the sink
+
+        Returns:
+            int: number of events written
+        """
+        events = self._events
+        batch = []
+        while events:
+            try:
+                batch.append(events.popleft())
+            except IndexError:
+                break
+        if not batch:
+            return 0
+
+        try:
+            with self._lock:
+                if self.sink == SINK_FILE:
+                    self._write_segment(batch)
+                else:
+                    load_rows(event_row(event) for event in batch)
+        except Exception:
+            logger.exception("Failed to write %d click events", len(batch))
+            self.failed += len(batch)
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    def _write_segment(self, batch):
+        segment = self._open_segment()
+        segment.write("".join(json.dumps(event_row(event)) + "\n" for event in batch))
+        segment.flush()
+        if (
+            segment.tell() >= self.segment_bytes
+            or time.monotonic() - self._segment_opened >= self.segment_seconds
+        ):
+            self._close_segment()
+
+    def _open_segment(self):
+        if self._segment is not None:
+            return self._segment
+        directory = self.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(dt_timezone.utc).strftime("%Y%m%d%H%M%S%f")
+        self._segment_path = directory / f"clicks-{stamp}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._segment = open(f"{self._segment_path}{OPEN_SUFFIX}", "a", encoding="utf-8")
+        self._segment_opened = time.monotonic()
+        return self._segment
+
+    def _close_segment(self):
+        """Finish the current segment so replay can pick it up"""
+        if self._segment is None:
+            return
+        self._segment.close()
+        os.replace(f"{self._segment_path}{OPEN_SUFFIX}", self._segment_path)
+        self._segment = None
+        self.segments_closed += 1
+
+    def close(self):
+        """Drain the buffer and close the current segment (worker shutdown)"""
+        self.drain()
+        with self._lock:
+            self._close_segment()
+
+    def closed_segments(self):
+        """Segments ready for replay, oldest first"""
+        if not self.directory.is_dir():
+            return []
+        return sorted(self.directory.glob(f"clicks-*{SEGMENT_SUFFIX}"))
+
+    def _ensure_thread(self):
+        # A forked worker inherits the attribute but not the thread itself
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Never append to the parent's segment file
+            self._segment = None
+            self._thread = threading.Thread(
+                target=self._run, name="click-event-log", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.drain()
+                if self.sink == SINK_FILE and self._segment is not None:
+                    # Rotate idle segments too, not only on the next write
+                    if time.monotonic() - self._segment_opened >= self.segment_seconds:
+                        with self._lock:
+                            self._close_segment()
+            except Exception:
+                logger.exception("Click event drain loop failed")
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        return {
+            "sink": self.sink,
+            "depth": len(self._events),
+            "capacity": self.capacity,
+            "recorded": self.recorded,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "segments_closed": self.segments_closed,
+        }
+
+
+click_events = ClickEventLog()
+
+# Write whatever is left when the worker shuts down
+atexit.register(click_events.close)
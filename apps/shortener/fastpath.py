@@ -0,0 +1,241 @@
+"""
+Redirect fast path in front of the Django handler.
+
+GET/HEAD requests for /<code>/ (exactly the URLconf's redirect route)
+whose short code is in the redirect cache are answered with the link's
+redirect straight from the WSGI/ASGI callable, skipping the middleware
+stack and URL resolution; only GETs count as clicks. Codes known not to exist (cached
+NOT_FOUND or rejected by the Bloom filter) get the pre-rendered 404 when
+the visitor has no session. Everything else, including cache misses,
+falls through to Django unchanged and fills the cache. Answered requests
+are counted in the "redirect" metrics and the sampled access log, and
+get the headers SecurityMiddleware and XFrameOptionsMiddleware would add,
+as the middleware never sees them.
+"""
+import re
+import time
+from http import HTTPStatus
+
+from django.conf import settings
+from django.urls import URLResolver, get_resolver
+from django.utils.encoding import iri_to_uri
+
+from .bloom import short_code_filter
+from .cache import NOT_FOUND, redirect_cache
+from .click_buffer import click_buffer
+from .events import click_events
+from .hot_links import hot_links
+from .logs import access_log, valid_request_id
+from .metrics import metrics
+
+SHORT_CODE_PATH = re.compile(r"^/([^/]+)/$")
+
+_reserved = None
+
+
+def _literal_prefixes(patterns):
+    for pattern in patterns:
+        route = str(pattern.pattern).lstrip("^")
+        head = re.split(r"[/<(\\[?]", route, maxsplit=1)[0]
+        if head:
+            yield head
+        elif isinstance(pattern, URLResolver):
+            yield from _literal_prefixes(pattern.url_patterns)
+
+
+def reserved_paths():
+    """
+    First path segments owned by real routes (dashboard, admin, login...)
+
+    Short codes with these names can never be served by the fast path.
+    """
+    global _reserved
+    if _reserved is None:
+        reserved = set(_literal_prefixes(get_resolver().url_patterns))
+        for url in (settings.STATIC_URL, settings.MEDIA_URL):
+            if url:
+                reserved.add(url.strip("/").split("/")[0])
+        _reserved = frozenset(reserved)
+    return _reserved
+
+
+def is_secure(scheme, get_header):
+    """
+    HttpRequest.is_secure() from the raw request
+
+    Args:
+        scheme: URL scheme the server received the request on
+        get_header: callable mapping a META name (HTTP_X_FORWARDED_PROTO)
+            to the header's value, or None
+    """
+    if settings.SECURE_PROXY_SSL_HEADER:
+        header, secure_value = settings.SECURE_PROXY_SSL_HEADER
+        value = get_header(header)
+        if value is not None:
+            return value.split(",", 1)[0].strip() == secure_value
+    return scheme == "https"
+
+
+def security_headers(secure):
+    """The headers SecurityMiddleware and XFrameOptionsMiddleware would add"""
+    headers = []
+    if "django.middleware.security.SecurityMiddleware" in settings.MIDDLEWARE:
+        if settings.SECURE_HSTS_SECONDS and secure:
+            hsts = f"max-age={settings.SECURE_HSTS_SECONDS}"
+            if settings.SECURE_HSTS_INCLUDE_SUBDOMAINS:
+                hsts += "; includeSubDomains"
+            if settings.SECURE_HSTS_PRELOAD:
+                hsts += "; preload"
+            headers.append(("Strict-Transport-Security", hsts))
+        if settings.SECURE_CONTENT_TYPE_NOSNIFF:
+            headers.append(("X-Content-Type-Options", "nosniff"))
+        policy = settings.SECURE_REFERRER_POLICY
+        if policy:
+            if isinstance(policy, str):
+                policy = [value.strip() for value in policy.split(",")]
+            headers.append(("Referrer-Policy", ",".join(policy)))
+        if settings.SECURE_CROSS_ORIGIN_OPENER_POLICY:
+            headers.append(("Cross-Origin-Opener-Policy", settings.SECURE_CROSS_ORIGIN_OPENER_POLICY))
+    if "django.middleware.clickjacking.XFrameOptionsMiddleware" in settings.MIDDLEWARE:
+        headers.append(("X-Frame-Options", getattr(settings, "X_FRAME_OPTIONS", "DENY").upper()))
+    return headers
+
+
+def match_short_code(method, path, secure):
+    """Return the short code a request is for, or None if Django should handle it"""
+    if method not in ("GET", "HEAD"):
+        return None
+    if settings.SECURE_SSL_REDIRECT and not secure:
+        return None
+    match = SHORT_CODE_PATH.match(path)
+    if match is None or match.group(1) in reserved_paths():
+        return None
+    return match.group(1)
+
+
+def has_session_cookie(cookie_header):
+    return f"{settings.SESSION_COOKIE_NAME}=" in cookie_header
+
+
+def not_found_body():
+    from .views import anonymous_not_found_body
+
+    return anonymous_not_found_body()
+
+
+def observe(short_code, status, started, request_id):
+    elapsed = time.perf_counter() - started
+    if metrics.enabled:
+        metrics.observe_request("redirect", status, elapsed)
+    access_log(short_code, status, elapsed, valid_request_id(request_id))
+
+
+def _asgi_header(headers, meta_name):
+    """Value of the ASGI header a META name like HTTP_X_FORWARDED_PROTO refers to"""
+    name = meta_name.removeprefix("HTTP_").lower().replace("_", "-").encode("latin-1")
+    value = headers.get(name)
+    return None if value is None else value.decode("latin-1")
+
+
+class FastRedirectWSGI:
+    """WSGI wrapper that serves cached short codes before Django sees them"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD")
+        secure = is_secure(environ.get("wsgi.url_scheme"), environ.get)
+        short_code = match_short_code(method, environ.get("PATH_INFO", ""), secure)
+        if short_code is not None:
+            started = time.perf_counter()
+            target = redirect_cache.get(short_code)
+            if target is None and not short_code_filter.might_exist(short_code):
+                target = NOT_FOUND
+            if target is not None and target.is_live():
+                if method == "GET":
+                    click_buffer.record(short_code)
+                    hot_links.record(short_code)
+                    click_events.record(
+                        short_code,
+                        environ.get("HTTP_REFERER"),
+                        environ.get("HTTP_USER_AGENT"),
+                        environ.get("REMOTE_ADDR"),
+                    )
+                status = target.redirect_type
+                start_response(f"{status} {HTTPStatus(status).phrase}", [
+                    ("Location", iri_to_uri(target.original_url)),
+                    ("Cache-Control", target.cache_control()),
+                    ("Content-Type", "text/html; charset=utf-8"),
+                    ("Content-Length", "0"),
+                    *security_headers(secure),
+                ])
+                observe(short_code, status, started, environ.get("HTTP_X_REQUEST_ID"))
+                return [b""]
+            if target is not None and not has_session_cookie(environ.get("HTTP_COOKIE", "")):
+                body = not_found_body()
+                start_response("404 Not Found", [
+                    ("Content-Type", "text/html; charset=utf-8"),
+                    ("Content-Length", str(len(body))),
+                    *security_headers(secure),
+                ])
+                observe(short_code, 404, started, environ.get("HTTP_X_REQUEST_ID"))
+                return [body]
+        return self.application(environ, start_response)
+
+
+class FastRedirectASGI:
+    """ASGI wrapper that serves cached short codes before Django sees them"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        short_code = None
+        if scope["type"] == "http":
+            headers = dict(scope.get("headers", []))
+            secure = is_secure(scope.get("scheme"), lambda name: _asgi_header(headers, name))
+            short_code = match_short_code(scope["method"], scope["path"], secure)
+        if short_code is not None:
+            started = time.perf_counter()
+            request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+            target = await redirect_cache.aget(short_code)
+            if target is None and not await short_code_filter.amight_exist(short_code):
+                target = NOT_FOUND
+            if target is not None and target.is_live():
+                if scope["method"] == "GET":
+                    await click_buffer.arecord(short_code)
+                    hot_links.record(short_code)
+                    client = scope.get("client")
+                    click_events.record(
+                        short_code,
+                        headers.get(b"referer", b"").decode("latin-1"),
+                        headers.get(b"user-agent", b"").decode("latin-1"),
+                        client[0] if client else "",
+                    )
+                await self._respond(send, target.redirect_type, b"", secure, [
+                    (b"location", iri_to_uri(target.original_url).encode("ascii")),
+                    (b"cache-control", target.cache_control().encode("ascii")),
+                ])
+                observe(short_code, target.redirect_type, started, request_id)
+                return
+            cookies = b"".join(v for k, v in scope.get("headers", []) if k == b"cookie")
+            if target is not None and not has_session_cookie(cookies.decode("latin-1")):
+                await self._respond(send, 404, not_found_body(), secure)
+                observe(short_code, 404, started, request_id)
+                return
+        await self.application(scope, receive, send)
+
+    @staticmethod
+    async def _respond(send, status, body, secure, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                *headers,
+                (b"content-type", b"text/html; charset=utf-8"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                *((name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in security_headers(secure)),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
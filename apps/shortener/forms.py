@@ -1,7 +1,11 @@
 from django import forms
 from .models import ShortUrl
+from .fastpath import reserved_paths
 from django.utils import timezone
 
+# Longest Cache-Control max-age a link may ask for
+MAX_CACHE_MAX_AGE = 365 * 24 * 3600
+
 class ShortUrlForm(forms.ModelForm):
     use_custom_code = forms.BooleanField(
         required=False,
@@ -45,6 +49,8 @@ class ShortUrlForm(forms.ModelForm):
         if use_custom:
             if not code:
                 raise forms.ValidationError("You must enter a custom code if checked.")
+            if code in reserved_paths():
+                raise forms.ValidationError("This short code is reserved.")
             if ShortUrl.objects.filter(short_code=code).exists():
                 raise forms.ValidationError("This short code is already taken.")
         else:
@@ -94,8 +100,22 @@ class ShortUrlEditForm(forms.ModelForm):
 
     class Meta:
         model = ShortUrl
-        fields = ["original_url", "expires_at", "is_active"]
+        fields = ["original_url", "expires_at", "is_active", "redirect_type", "cache_max_age"]
         labels = {
             "original_url": "Original URL",
             "is_active": "Active",
+            "redirect_type": "Redirect type",
+            "cache_max_age": "Cache lifetime (seconds)",
+        }
+        help_texts = {
+            "redirect_type": (
+                "Permanent redirects (301/308) can be cached by browsers and CDNs, "
+                "so repeat clicks may not be counted or reach a changed URL until the cache expires"
+            ),
         }
+
+    def clean_cache_max_age(self):
+        max_age = self.cleaned_data.get("cache_max_age")
+        if max_age is not None and max_age > MAX_CACHE_MAX_AGE:
+            raise forms.ValidationError("The cache lifetime can be at most one year (31536000 seconds).")
+        return max_age
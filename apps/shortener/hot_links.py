@@ -0,0 +1,267 @@
+"""
+Streaming top-N of the most redirected short codes.
+
+Each window (1 minute, 1 hour, 24 hours) is a ring of slots, and every
+slot is a fixed-size Space-Saving summary, so memory stays bounded no
+matter how many distinct codes are clicked. Redirects only bump a local
+counter; a background thread folds the counters into the summaries once
+a second and periodically publishes this worker's top codes to the
+shared cache, where top() merges every live worker's list. That needs a
+cache shared between processes (REDIS_URL); with the per-process locmem
+default, nothing is published and top() covers this worker only.
+"""
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import is_process_local
+
+logger = logging.getLogger(__name__)
+
+# (name, slot length in seconds, number of slots)
+WINDOWS = (
+    ("1m", 5, 12),
+    ("1h", 300, 12),
+    ("24h", 3600, 24),
+)
+WINDOW_NAMES = tuple(name for name, _, _ in WINDOWS)
+
+WORKERS_KEY = "shortener:hot:workers"
+WORKER_KEY_PREFIX = "shortener:hot:worker:"
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy-hitters summary (Metwally et al.)
+
+    Tracks at most `capacity` items. A new item evicts the current
+    minimum and inherits its count as an error bound, so any item whose
+    true count exceeds total/capacity is guaranteed to be present and
+    counts are overestimated by at most `error`.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def offer(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            floor, victim = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self._heap, (counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, i) for i, c in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        # Heap entries go stale when counts grow; skip until one matches
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def top(self, n):
+        """
+        Returns:
+            list: (item, count, error) for the n largest counts
+        """
+        best = heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1])
+        return [(item, count, self.errors[item]) for item, count in best]
+
+
+class SlidingWindow:
+    """Space-Saving summaries over the last `slots` * `slot_seconds` seconds"""
+
+    def __init__(self, slot_seconds, slots, capacity):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self.capacity = capacity
+        self._ring = deque()
+
+    def _current(self, now):
+        index = int(now // self.slot_seconds)
+        ring = self._ring
+        while ring and ring[0][0] <= index - self.slots:
+            ring.popleft()
+        if not ring or ring[-1][0] != index:
+            ring.append((index, SpaceSaving(self.capacity)))
+        return ring[-1][1]
+
+    def offer_many(self, counts, now):
+        summary = self._current(now)
+        for item, count in counts.items():
+            summary.offer(item, count)
+
+    def top(self, n, now):
+        self._current(now)
+        counts = defaultdict(int)
+        errors = defaultdict(int)
+        for _, summary in self._ring:
+            for item, count in summary.counts.items():
+                counts[item] += count
+                errors[item] += summary.errors[item]
+        best = heapq.nlargest(n, counts.items(), key=lambda kv: kv[1])
+        return [(item, count, errors[item]) for item, count in best]
+
+
+class HotLinkTracker:
+    """
+    Per-process heavy-hitters tracker over every window in WINDOWS.
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._windows = None
+        self._thread = None
+        self._pid = None
+        self._last_publish = 0.0
+        self._warned_unshared = False
+
+    @property
+    def capacity(self):
+        return getattr(settings, "SHORTENER_HOT_LINKS_CAPACITY", 1000)
+
+    @property
+    def publish_interval(self):
+        return getattr(settings, "SHORTENER_HOT_LINKS_PUBLISH_INTERVAL", 10)
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "SHORTENER_REDIRECT_CACHE_ALIAS", "default")
+        return caches[alias]
+
+    @property
+    def cross_worker(self):
+        """True if workers can see each other's top codes through the cache"""
+        if not is_process_local(self.shared):
+            return True
+        if not self._warned_unshared:
+            self._warned_unshared = True
+            logger.warning("Hot links cover this worker only: the cache is not shared between processes; set REDIS_URL")
+        return False
+
+    @property
+    def worker_id(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def record(self, short_code):
+        with self._lock:
+            self._pending[short_code] += 1
+        self._ensure_thread()
+
+    def fold(self, now=None):
+        """Move pending clicks into the window summaries"""
+        now = time.time() if now is None else now
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            if self._windows is None:
+                self._windows = {
+                    name: SlidingWindow(slot_seconds, slots, self.capacity)
+                    for name, slot_seconds, slots in WINDOWS
+                }
+            if pending:
+                for window in self._windows.values():
+                    window.offer_many(pending, now)
+
+    def local_top(self, window, n, now=None):
+        """
+        Top n codes clicked in this process during `window`
+
+        Returns:
+            list: (short_code, count, error)
+        """
+        self.fold(now)
+        with self._lock:
+            return self._windows[window].top(n, time.time() if now is None else now)
+
+    def publish(self):
+        """Share this worker's top codes so top() can merge every worker"""
+        self._last_publish = time.monotonic()
+        if not self.cross_worker:
+            return
+        ttl = self.publish_interval * 3
+        worker_id = self.worker_id
+        self.shared.set(
+            f"{WORKER_KEY_PREFIX}{worker_id}",
+            {name: self.local_top(name, self.capacity) for name in WINDOW_NAMES},
+            ttl,
+        )
+        # Read-modify-write of the worker index can race; a worker lost
+        # here re-registers on its next publish
+        workers = self.shared.get(WORKERS_KEY) or {}
+        now = time.time()
+        workers = {w: seen for w, seen in workers.items() if now - seen < ttl}
+        workers[worker_id] = now
+        self.shared.set(WORKERS_KEY, workers, None)
+
+    def top(self, window, n=50):
+        """
+        Top n codes across every worker that published recently
+
+        Falls back to this process alone when nothing has been published,
+        or when the cache is not shared between processes.
+
+        Returns:
+            list: (short_code, count, error), count and error summed over workers
+        """
+        if not self.cross_worker:
+            return self.local_top(window, n)
+        workers = self.shared.get(WORKERS_KEY) or {}
+        published = self.shared.get_many([f"{WORKER_KEY_PREFIX}{w}" for w in workers]).values()
+        if not published:
+            return self.local_top(window, n)
+
+        counts = defaultdict(int)
+        errors = defaultdict(int)
+        for tops in published:
+            for short_code, count, error in tops.get(window, []):
+                counts[short_code] += count
+                errors[short_code] += error
+        best = heapq.nlargest(n, counts.items(), key=lambda kv: kv[1])
+        return [(short_code, count, errors[short_code]) for short_code, count in best]
+
+    def _ensure_thread(self):
+        # A forked worker inherits the attribute but not the thread itself
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._windows = None
+            self._thread = threading.Thread(
+                target=self._run, name="hot-links", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(1)
+            try:
+                self.fold()
+                if time.monotonic() - self._last_publish >= self.publish_interval:
+                    self.publish()
+            except Exception:
+                logger.exception("Hot link tracker loop failed")
+
+
+hot_links = HotLinkTracker()
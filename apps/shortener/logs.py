@@ -0,0 +1,205 @@
+"""
+Logging that stays off the request path.
+
+QueueLogHandler only puts records on a bounded in-memory queue; a
+QueueListener thread formats them and writes them out, so a slow stdout
+or log collector never blocks a worker. When the queue is full, records
+are dropped and counted instead of waited on.
+
+RequestIdMiddleware gives every request a correlation ID (the incoming
+X-Request-ID header if it looks sane, otherwise a new one), echoes it in
+the response and adds it to every record logged while handling the
+request. Redirects are logged to the "apps.shortener.access" logger for
+a sample (SHORTENER_ACCESS_LOG_SAMPLE_RATE) of requests only.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Incoming IDs are reused only if they cannot break a log line
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+access_logger = logging.getLogger("apps.shortener.access")
+
+_request_id = ContextVar("shortener_request_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+def valid_request_id(value):
+    """`value` if it can be used as a request ID, else None"""
+    if value and REQUEST_ID_PATTERN.match(value):
+        return value
+    return None
+
+
+class RequestIdFilter(logging.Filter):
+    """Add the current request's ID to records as `request_id` ("-" outside requests)"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            # django.request logs some responses after the middleware returned
+            request = getattr(record, "request", None)
+            record.request_id = _request_id.get() or getattr(request, "request_id", "-")
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including fields passed in `extra`"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Hand records to a background thread that writes them to `stream`
+
+    The formatter set on this handler (e.g. by dictConfig) is used by the
+    writing thread; filters run on the logging thread, so RequestIdFilter
+    still sees the request's context.
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Merge the arguments now, as they may change after this call;
+        # formatting is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def _start(self):
+        # After a fork the parent's listener thread is gone; start our own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            atexit.register(self.flush_queue)
+
+    def flush_queue(self):
+        """Write every queued record and stop the listener (at exit)"""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            try:
+                listener.stop()
+            except queue.Full:
+                # No room for the stop sentinel; the thread is a daemon
+                pass
+
+    def close(self):
+        self.flush_queue()
+        self.target.close()
+        super().close()
+
+
+def access_log(short_code, status, seconds, request_id=None):
+    """Log a sample of redirects to the access logger"""
+    rate = getattr(settings, "SHORTENER_ACCESS_LOG_SAMPLE_RATE", 0.01)
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    access_logger.info(
+        "redirect %s %d %.2fms", short_code, status, seconds * 1000,
+        extra={
+            "short_code": short_code,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "sample_rate": rate,
+            "request_id": request_id or _request_id.get() or "-",
+        },
+    )
+
+
+@sync_and_async_middleware
+def RequestIdMiddleware(get_response):
+    """Tag the request and its log records with a correlation ID"""
+
+    def start(request):
+        request_id = valid_request_id(request.headers.get(REQUEST_ID_HEADER)) or uuid.uuid4().hex
+        request.request_id = request_id
+        return _request_id.set(request_id), time.perf_counter()
+
+    def finish(request, response, started):
+        response[REQUEST_ID_HEADER] = request.request_id
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.url_name == "redirect":
+            access_log(match.kwargs.get("short_code"), response.status_code, time.perf_counter() - started)
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, started = start(request)
+            try:
+                response = await get_response(request)
+                return finish(request, response, started)
+            finally:
+                _request_id.reset(token)
+    else:
+        def middleware(request):
+            token, started = start(request)
+            try:
+                response = get_response(request)
+                return finish(request, response, started)
+            finally:
+                _request_id.reset(token)
+
+    return middleware
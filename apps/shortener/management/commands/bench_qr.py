@@ -0,0 +1,74 @@
+import json
+import os
+import random
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.shortener.qr_batch import QR_BATCH_CHUNK_SIZE, render_qr_batch, render_qr_pngs
+from apps.shortener.qr_service import render_qr_png
+
+MODES = ["per-call", "batch", "batch-pool"]
+
+
+class Command(BaseCommand):
+    help = "Compare QR rendering throughput of render_qr_png() and the batch engine"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--codes", type=int, default=2000, help="QR codes per mode")
+        parser.add_argument("--processes", type=int, help="Render processes for batch-pool (default: one per CPU)")
+        parser.add_argument("--chunk-size", type=int, default=QR_BATCH_CHUNK_SIZE, help="URLs per pool task")
+        parser.add_argument("--mode", choices=MODES, action="append", help="Repeatable; default all")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        alphabet = string.ascii_letters + string.digits
+        urls = [
+            f"https://example.com/{''.join(random.choices(alphabet, k=random.randint(6, 10)))}/"
+            for _ in range(options["codes"])
+        ]
+        processes = options["processes"] or os.cpu_count() or 1
+
+        results = {}
+        outputs = {}
+        for mode in options["mode"] or MODES:
+            if mode == "batch-pool":
+                with ProcessPoolExecutor(max_workers=processes) as executor:
+                    # Start the processes before timing
+                    render_qr_batch(urls[:processes], executor, chunk_size=1)
+                    started = time.perf_counter()
+                    pngs = render_qr_batch(urls, executor, chunk_size=options["chunk_size"])
+                    elapsed = time.perf_counter() - started
+            else:
+                render = render_qr_pngs if mode == "batch" else lambda urls: [render_qr_png(url) for url in urls]
+                started = time.perf_counter()
+                pngs = render(urls)
+                elapsed = time.perf_counter() - started
+            outputs[mode] = pngs
+            results[mode] = {
+                "codes": len(urls),
+                "seconds": round(elapsed, 3),
+                "codes_per_s": round(len(urls) / elapsed, 1),
+                "bytes": sum(map(len, pngs)),
+            }
+
+        # Every mode must produce the same images, or the speedup is meaningless
+        reference = next(iter(outputs.values()))
+        for mode, pngs in outputs.items():
+            if pngs != reference:
+                raise CommandError(f"{mode} rendered different images")
+
+        baseline = results.get("per-call")
+        for r in results.values():
+            r["speedup"] = round(r["codes_per_s"] / baseline["codes_per_s"], 2) if baseline else None
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'mode':<12}{'codes/s':>10}{'seconds':>10}{'speedup':>10}")
+        for mode, r in results.items():
+            speedup = f"{r['speedup']}x" if r["speedup"] is not None else "-"
+            self.stdout.write(f"{mode:<12}{r['codes_per_s']:>10}{r['seconds']:>10}{speedup:>10}")
@@ -0,0 +1,93 @@
+import importlib
+import json
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import clear_url_caches
+
+from apps.shortener.benchmarks import BENCH_HOST, run_asgi, run_wsgi
+from apps.shortener.bloom import short_code_filter
+from apps.shortener.click_buffer import click_buffer
+from apps.shortener.code_pool import code_pool
+from apps.shortener.fastpath import FastRedirectASGI, FastRedirectWSGI
+from apps.shortener.models import ShortUrl
+
+BENCH_USERNAME = "__bench__"
+
+MODES = ["wsgi", "wsgi-fast", "asgi-sync", "asgi-async", "asgi-fast"]
+
+
+def use_async_redirect(enabled):
+    """Re-import the URLconfs so the redirect route picks the matching view"""
+    import apps.shortener.urls
+    import config.urls
+
+    with override_settings(SHORTENER_ASYNC_REDIRECT=enabled):
+        importlib.reload(apps.shortener.urls)
+        importlib.reload(config.urls)
+    clear_url_caches()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare redirect throughput through the WSGI and ASGI entry points, "
+        "with and without the fast path"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--links", type=int, default=100, help="Short URLs to seed")
+        parser.add_argument("--requests", type=int, default=5000, help="Requests per mode")
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--mode", choices=MODES, action="append", help="Repeatable; default all")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded links")
+
+    def handle(self, *args, **options):
+        wsgi_app = get_wsgi_application()
+        asgi_app = get_asgi_application()
+        apps = {
+            "wsgi": wsgi_app,
+            "wsgi-fast": FastRedirectWSGI(wsgi_app),
+            "asgi-sync": asgi_app,
+            "asgi-async": asgi_app,
+            "asgi-fast": FastRedirectASGI(asgi_app),
+        }
+
+        user, _ = get_user_model().objects.get_or_create(username=BENCH_USERNAME)
+        links = ShortUrl.objects.bulk_create(
+            ShortUrl(user=user, original_url=f"https://example.com/{i}", short_code=code)
+            for i, code in enumerate(code_pool.take_many(options["links"]))
+        )
+        short_code_filter.add_many(link.short_code for link in links)
+        paths = [f"/{random.choice(links).short_code}/" for _ in range(options["requests"])]
+
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=[BENCH_HOST]):
+                for mode in options["mode"] or MODES:
+                    use_async_redirect(mode == "asgi-async")
+                    driver = run_wsgi if mode.startswith("wsgi") else run_asgi
+                    run = lambda p: driver(apps[mode], p, options["concurrency"])
+                    # Warm the redirect cache so every mode starts from the same state
+                    run(sorted({p for p in paths}))
+                    results[mode] = run(paths)
+        finally:
+            use_async_redirect(False)
+            click_buffer.flush()
+            if not options["keep"]:
+                ShortUrl.objects.filter(user=user).delete()
+                user.delete()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}  statuses")
+        for mode, r in results.items():
+            self.stdout.write(
+                f"{mode:<12}{r['rps']:>10}{r['p50_ms']:>10}{r['p90_ms']:>10}{r['p99_ms']:>10}  {r['statuses']}"
+            )
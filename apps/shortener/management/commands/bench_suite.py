@@ -0,0 +1,178 @@
+import importlib.util
+import json
+import platform
+import random
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.shortener.benchmarks import (
+    BENCH_HOST, SERVER_MODULES, compare_results, run_calls, run_http, seed_links, spawn_server,
+)
+from apps.shortener.cache import redirect_cache
+from apps.shortener.click_buffer import click_buffer
+from apps.shortener.models import ShortUrl, UserLinkStats
+from apps.shortener.qr_service import delete_qr_code_file, generate_qr_code, get_full_short_url, render_qr_png
+from apps.shortener.services import shorten_url
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+SCENARIOS = ["redirect-client", "redirect-wsgi", "redirect-asgi", "create", "dashboard", "qr"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark redirects (test client and real WSGI/ASGI servers), link creation, "
+        "the dashboard and QR generation against a seeded data set"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", choices=SIZES, default="1k", help="Seeded ShortUrl rows")
+        parser.add_argument("--users", type=int, help="Owners of the seeded rows (default: one per 1000 rows, at least 10)")
+        parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="Repeatable; default all")
+        parser.add_argument("--requests", type=int, default=2000, help="Redirects per pass")
+        parser.add_argument("--iterations", type=int, default=200, help="Calls for create, dashboard and qr")
+        parser.add_argument("--concurrency", type=int, default=8, help="Connections for the server scenarios")
+        parser.add_argument("--workers", type=int, default=2, help="Server processes for the server scenarios")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Baseline JSON from an earlier --output; exit 1 on regressions")
+        parser.add_argument("--max-p99-regression", type=float, default=0.10, help="Allowed p99 increase (0.10 = 10%%)")
+        parser.add_argument("--max-rps-regression", type=float, default=0.10, help="Allowed throughput drop")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data afterwards")
+
+    def handle(self, *args, **options):
+        rows = SIZES[options["size"]]
+        users = options["users"] or max(10, rows // 1000)
+        self.stderr.write(f"Seeding {rows} links over {users} users...")
+        owners = seed_links(rows, users)
+        links = ShortUrl.objects.filter(user__in=owners)
+
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=[BENCH_HOST, "testserver", "127.0.0.1"]):
+                for scenario in options["scenario"] or SCENARIOS:
+                    self.stderr.write(f"Running {scenario}...")
+                    results.update(getattr(self, "bench_" + scenario.replace("-", "_"))(links, owners, options))
+        finally:
+            click_buffer.flush()
+            if options["cleanup"]:
+                links.delete()
+                for owner in owners:
+                    owner.delete()
+
+        report = {
+            "meta": {
+                "size": options["size"],
+                "rows": rows,
+                "users": users,
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "created_at": timezone.now().isoformat(),
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        self.stderr.write(f"{'scenario':<26}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+        for scenario, r in results.items():
+            self.stderr.write(f"{scenario:<26}{r['rps']:>10}{r['p50_ms']:>10}{r['p90_ms']:>10}{r['p99_ms']:>10}")
+
+        if options["compare"]:
+            self.compare(options, results)
+
+    def sample_paths(self, links, count):
+        """Paths of `count` random seeded links (fewer if there are not that many)"""
+        pks = list(links.values_list("pk", flat=True))
+        picked = random.sample(pks, min(count, len(pks)))
+        codes = list(links.filter(pk__in=picked).values_list("short_code", flat=True))
+        return [f"/{code}/" for code in codes]
+
+    def redirect_passes(self, name, paths, run):
+        # The first pass misses the redirect cache, the second hits it
+        return {f"{name}:cold": run(paths), f"{name}:warm": run(paths)}
+
+    def bench_redirect_client(self, links, owners, options):
+        paths = self.sample_paths(links, options["requests"])
+        redirect_cache.invalidate_many([path.strip("/") for path in paths])
+        client = Client()
+
+        def run(paths):
+            calls = [(path,) for path in paths]
+            return run_calls(client.get, calls)
+
+        return self.redirect_passes("redirect-client", paths, run)
+
+    def bench_redirect_server(self, kind, links, options):
+        if importlib.util.find_spec(SERVER_MODULES[kind]) is None:
+            self.stderr.write(f"Skipping redirect-{kind}: {SERVER_MODULES[kind]} is not installed")
+            return {}
+        paths = self.sample_paths(links, options["requests"])
+        with spawn_server(kind, options["workers"]) as base_url:
+            return self.redirect_passes(
+                f"redirect-{kind}", paths, lambda paths: run_http(base_url, paths, options["concurrency"])
+            )
+
+    def bench_redirect_wsgi(self, links, owners, options):
+        return self.bench_redirect_server("wsgi", links, options)
+
+    def bench_redirect_asgi(self, links, owners, options):
+        return self.bench_redirect_server("asgi", links, options)
+
+    def bench_create(self, links, owners, options):
+        created = []
+
+        def create(i):
+            created.append(shorten_url(random.choice(owners), f"https://example.com/bench/new/{i}").pk)
+
+        try:
+            return {"create": run_calls(create, [(i,) for i in range(options["iterations"])])}
+        finally:
+            ShortUrl.objects.filter(pk__in=created).delete()
+            UserLinkStats.objects.rebuild([owner.pk for owner in owners])
+
+    def bench_dashboard(self, links, owners, options):
+        client = Client()
+        client.force_login(owners[0])
+        iterations = options["iterations"]
+        first = run_calls(client.get, [("/dashboard/",)] * iterations)
+        search = run_calls(client.get, [("/dashboard/?q=https://example.com/bench/1",)] * iterations)
+        return {"dashboard": first, "dashboard:search": search}
+
+    def bench_qr(self, links, owners, options):
+        sample = list(links.filter(qr_code_generated_at__isnull=True).order_by("?")[:options["iterations"]])
+        render = run_calls(render_qr_png, [(get_full_short_url(link),) for link in sample])
+        try:
+            # Render, store the PNG and update the row and stats, as the worker does
+            generate = run_calls(generate_qr_code, [(link,) for link in sample])
+        finally:
+            for link in sample:
+                delete_qr_code_file(link)
+        return {"qr:render": render, "qr:generate": generate}
+
+    def compare(self, options, results):
+        with open(options["compare"]) as f:
+            baseline = json.load(f)
+        rows = compare_results(
+            baseline["results"], results, options["max_p99_regression"], options["max_rps_regression"]
+        )
+        if baseline.get("meta", {}).get("rows") != SIZES[options["size"]]:
+            self.stderr.write("Warning: the baseline was recorded with a different data set size")
+
+        self.stderr.write(f"\n{'scenario':<26}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>10}")
+        failed = []
+        for scenario, metric, before, after, change, regressed in rows:
+            flag = "  REGRESSED" if regressed else ""
+            self.stderr.write(f"{scenario:<26}{metric:<8}{before:>12}{after:>12}{change:>+10.1%}{flag}")
+            if regressed:
+                failed.append(f"{scenario} {metric}")
+        if failed:
+            raise CommandError(f"Performance regressed: {', '.join(failed)}")
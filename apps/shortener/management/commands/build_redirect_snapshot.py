@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.shortener.cache import RedirectTarget
+from apps.shortener.models import ShortUrl
+from apps.shortener.snapshot import snapshot_path, write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write the most clicked live links to the redirect snapshot that starting workers warm from"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=getattr(settings, "SHORTENER_REDIRECT_SNAPSHOT_SIZE", 10000),
+            help="Links to include",
+        )
+        parser.add_argument("--output", help="Snapshot file (default: SHORTENER_REDIRECT_SNAPSHOT)")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rows = (
+            ShortUrl.objects
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now), is_active=True)
+            .order_by("-click_count")
+            .values_list("short_code", *RedirectTarget._fields, "click_count")[:options["size"]]
+        )
+        path = options["output"] or snapshot_path()
+        written = write_snapshot(
+            path,
+            ((short_code, RedirectTarget(*target), clicks) for short_code, *target, clicks in rows.iterator()),
+        )
+        self.stdout.write(f"Wrote {written} links to {path}")
@@ -0,0 +1,53 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.shortener.bulk import (
+    DEFAULT_CHUNK_SIZE, BulkStats, bulk_shorten, iter_csv_rows, iter_jsonl_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Create short URLs in bulk from a CSV or JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Input file, or - for stdin")
+        parser.add_argument("--user", required=True, help="Username that will own the links")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format (defaults to the file extension)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument("--output", help="Write JSON Lines results here instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["user"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['user']!r} does not exist")
+
+        path = options["input"]
+        fmt = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+
+        infile = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        outfile = open(options["output"], "w", encoding="utf-8") if options["output"] else self.stdout
+        try:
+            rows = iter_csv_rows(infile) if fmt == "csv" else iter_jsonl_rows(infile)
+            stats = BulkStats()
+            for result in stats.track(bulk_shorten(user, rows, options["chunk_size"])):
+                outfile.write(json.dumps(result) + "\n")
+        finally:
+            if infile is not sys.stdin:
+                infile.close()
+            if outfile is not self.stdout:
+                outfile.close()
+
+        summary = stats.summary()
+        self.stderr.write(self.style.SUCCESS(
+            f"{summary['created']} created, {summary['errors']} errors, "
+            f"{summary['rows']} rows in {summary['seconds']}s "
+            f"({summary['rows_per_second']} rows/s)"
+        ))
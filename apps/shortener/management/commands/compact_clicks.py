@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.shortener.analytics import COMPACT_BATCH_SIZE, compact_click_buckets
+
+
+class Command(BaseCommand):
+    help = "Merge old minute/hour click buckets into coarser ones and apply retention"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=COMPACT_BATCH_SIZE,
+            help="Buckets merged per transaction",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep compacting until interrupted")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=300.0,
+            help="Seconds between runs with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            result = compact_click_buckets(batch_size=options["batch_size"])
+            if any(result.values()) or options["verbosity"] > 1:
+                self.stdout.write(", ".join(f"{k}: {v}" for k, v in result.items()))
+            if not options["loop"]:
+                break
+            close_old_connections()
+            time.sleep(options["interval"])
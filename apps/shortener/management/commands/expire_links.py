@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.shortener.services import expire_due_links
+
+
+class Command(BaseCommand):
+    help = "Deactivate short URLs whose expiration time has passed, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per transaction")
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches to spread out the write load",
+        )
+        parser.add_argument("--loop", action="store_true", help="Keep sweeping until interrupted")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60.0,
+            help="Seconds between sweeps with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = self.sweep(options["batch_size"], options["pause"])
+            if expired or options["verbosity"] > 1:
+                self.stdout.write(f"Deactivated {expired} expired links")
+            if not options["loop"]:
+                break
+            close_old_connections()
+            time.sleep(options["interval"])
+
+    def sweep(self, batch_size, pause):
+        total = 0
+        while True:
+            expired = expire_due_links(batch_size)
+            total += expired
+            if expired < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.shortener.click_buffer import click_buffer
+
+
+class Command(BaseCommand):
+    help = "Force buffered click counts to be written to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--wait",
+            type=float,
+            default=2.0,
+            help="Seconds to wait for running workers to pick up the flush request",
+        )
+
+    def handle(self, *args, **options):
+        # Workers sharing the cache backend flush on their next tick
+        requested = click_buffer.request_flush()
+        flushed = click_buffer.flush()
+
+        if not requested:
+            self.stderr.write(self.style.WARNING(
+                f"Running workers were not asked to flush: set REDIS_URL to share the cache; "
+                f"{flushed} clicks flushed by this process"
+            ))
+            return
+
+        if options["wait"] > 0:
+            time.sleep(options["wait"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Flush requested; {flushed} clicks flushed by this process"
+        ))
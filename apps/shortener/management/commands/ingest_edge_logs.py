@@ -0,0 +1,82 @@
+import os
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from apps.shortener.click_buffer import click_buffer
+from apps.shortener.edge_logs import EDGE_HIT_STATUSES, FORMATS, JSON_FIELDS, count_edge_clicks, open_log
+from apps.shortener.models import EdgeLogFile
+
+INGESTED_SUFFIX = ".ingested"
+
+
+class Command(BaseCommand):
+    help = "Add the clicks a CDN served from its cache (cacheable redirects) from its access logs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("logs", nargs="+", help="Log files (*.gz are decompressed)")
+        parser.add_argument("--format", choices=FORMATS, default="w3c", help="w3c (CloudFront) or json (Cloudflare)")
+        for name, default in JSON_FIELDS.items():
+            parser.add_argument(f"--{name}-field", default=default, help=f"JSON field with the {name} (json only)")
+        parser.add_argument(
+            "--hit-status",
+            action="append",
+            help=f"Cache status counted as served by the edge; repeatable (default: {', '.join(sorted(EDGE_HIT_STATUSES))})",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Count and report, write nothing")
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help=f"Delete logs once ingested instead of renaming them to *{INGESTED_SUFFIX}",
+        )
+
+    def handle(self, *args, **options):
+        fields = {name: options[f"{name}_field"] for name in JSON_FIELDS}
+        hit_statuses = {status.lower() for status in options["hit_status"] or EDGE_HIT_STATUSES}
+        totals = defaultdict(int)
+        for path in options["logs"]:
+            with open_log(path) as lines:
+                counts, skipped = count_edge_clicks(lines, options["format"], fields, hit_statuses)
+            clicks = sum(counts.values())
+            if not options["dry_run"]:
+                if not self.ingest(path, counts, clicks):
+                    self.stderr.write(f"{path} was already ingested; not counting it again")
+                    counts = {}
+                if options["delete"]:
+                    os.remove(path)
+                else:
+                    os.replace(path, f"{path}{INGESTED_SUFFIX}")
+            for (short_code, _), count in counts.items():
+                totals[short_code] += count
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{path}: {clicks} edge clicks, {skipped} other requests")
+
+        if options["verbosity"] > 1 and options["dry_run"]:
+            for short_code, count in sorted(totals.items(), key=lambda item: -item[1])[:20]:
+                self.stdout.write(f"  {short_code}: {count}")
+        action = "Counted" if options["dry_run"] else "Added"
+        self.stdout.write(
+            f"{action} {sum(totals.values())} edge clicks for {len(totals)} links from {len(options['logs'])} logs"
+        )
+
+    def ingest(self, path, counts, clicks):
+        """
+        Add one log's clicks in one transaction, recording the log with them
+
+        A log whose clicks committed but which was not renamed yet (a crash
+        in between) is recognised by name and skipped by the next run.
+
+        Returns:
+            bool: False if the log was ingested before
+        """
+        name = os.path.basename(path)
+        try:
+            with transaction.atomic():
+                EdgeLogFile.objects.create(name=name, clicks=clicks)
+                click_buffer.write_counts(counts)
+        except IntegrityError:
+            if EdgeLogFile.objects.filter(name=name).exists():
+                return False
+            raise
+        return True
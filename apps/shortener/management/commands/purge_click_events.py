@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.shortener.events import PURGE_BATCH_SIZE, purge_click_events
+
+
+class Command(BaseCommand):
+    help = "Delete click events older than SHORTENER_CLICK_EVENT_RETENTION_DAYS, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE, help="Rows per DELETE")
+        parser.add_argument("--loop", action="store_true", help="Keep purging until interrupted")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=3600.0,
+            help="Seconds between runs with --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            purged = self.purge(options["batch_size"])
+            if purged or options["verbosity"] > 1:
+                self.stdout.write(f"Deleted {purged} click events")
+            if not options["loop"]:
+                break
+            close_old_connections()
+            time.sleep(options["interval"])
+
+    def purge(self, batch_size):
+        total = 0
+        while True:
+            purged = purge_click_events(batch_size)
+            total += purged
+            if purged < batch_size:
+                return total
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.shortener.qr_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Render queued QR codes in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, help="Render processes (default: one per CPU)")
+        parser.add_argument("--batch-size", type=int, help="Jobs claimed at a time (default: 200 per process)")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty",
+        )
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        processed = run_worker(
+            processes=options["processes"],
+            batch_size=options["batch_size"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
+        self.stdout.write(f"Processed {processed} QR jobs")
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from apps.shortener.models import UserLinkStats
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized per-user dashboard stats from the short URLs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            action="append",
+            help="Username to rebuild; repeatable, default every user",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Users per transaction")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("pk")
+        if options["user"]:
+            users = users.filter(username__in=options["user"])
+        user_ids = list(users.values_list("pk", flat=True))
+
+        batch_size = options["batch_size"]
+        drifted = 0
+        for i in range(0, len(user_ids), batch_size):
+            drifted += UserLinkStats.objects.rebuild(user_ids[i:i + batch_size])
+
+        self.stdout.write(f"Rebuilt stats for {len(user_ids)} users ({drifted} out of date)")
@@ -0,0 +1,75 @@
+import json
+import os
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from apps.shortener.events import INSERT_BATCH_SIZE, click_events, load_rows
+from apps.shortener.models import ClickEventSegment
+
+LOADED_SUFFIX = ".loaded"
+
+
+def read_segment(path):
+    with open(path, encoding="utf-8") as segment:
+        for line in segment:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = "Load closed click event log segments into the ClickEvent table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "segments",
+            nargs="*",
+            help="Segment files to load; default every closed segment in SHORTENER_CLICK_EVENT_DIR",
+        )
+        parser.add_argument("--batch-size", type=int, default=INSERT_BATCH_SIZE, help="Rows per INSERT")
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help=f"Delete segments once loaded instead of renaming them to *{LOADED_SUFFIX}",
+        )
+
+    def handle(self, *args, **options):
+        segments = [Path(p) for p in options["segments"]] or click_events.closed_segments()
+        total = 0
+        for path in segments:
+            loaded = self.load_segment(path, options["batch_size"])
+            if options["delete"]:
+                os.remove(path)
+            else:
+                os.replace(path, f"{path}{LOADED_SUFFIX}")
+            if loaded is None:
+                self.stderr.write(f"{path.name} was already loaded; not loading it again")
+                continue
+            total += loaded
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{path.name}: {loaded} events")
+        self.stdout.write(f"Loaded {total} click events from {len(segments)} segments")
+
+    def load_segment(self, path, batch_size):
+        """
+        Load one segment in one transaction, so it is never half loaded
+
+        The segment is recorded in the same transaction, so a segment whose
+        load committed but was not renamed yet (a crash in between) is
+        skipped by the next run.
+
+        Returns:
+            int: events loaded, or None if the segment was loaded before
+        """
+        try:
+            with transaction.atomic():
+                segment = ClickEventSegment.objects.create(name=path.name)
+                segment.events = load_rows(read_segment(path), batch_size)
+                segment.save(update_fields=["events"])
+        except IntegrityError:
+            if ClickEventSegment.objects.filter(name=path.name).exists():
+                return None
+            raise
+        return segment.events
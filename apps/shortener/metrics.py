@@ -0,0 +1,491 @@
+"""
+Process metrics, aggregated across workers and exposed for Prometheus.
+
+Hot-path updates are plain list increments on a per-thread shard, so
+recording takes no lock; when a thread ends, its shard is folded into a
+base array, so thread-per-request servers do not pile up shards. A
+background thread (and every scrape) sums the shards, adds the values
+collected from other modules (redirect cache counters, click buffer
+depth...) and copies the result into this process's file in
+SHORTENER_METRICS_DIR through mmap. /metrics reads
+every worker's file and sums them: counters and histograms over every
+file, so a restarted worker's counts are kept; gauges only over live
+processes.
+
+MetricsMiddleware times every request by view group and counts its DB
+queries. With SHORTENER_METRICS_SLOW_REQUEST_MS set it also keeps the SQL
+of each request and logs requests slower than that, with their queries,
+for a sample (SHORTENER_METRICS_SLOW_SAMPLE_RATE) of them.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import deque, namedtuple
+from itertools import count
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+VIEWS = ("redirect", "dashboard", "create", "qr", "other")
+STATUS_CLASSES = ("2xx", "3xx", "4xx", "5xx")
+
+# url_name -> view group; unlisted names are "other"
+VIEW_GROUPS = {
+    "redirect": "redirect",
+    "home": "dashboard",
+    "dashboard": "dashboard",
+    "create_short_url": "create",
+    "bulk_create_short_urls": "create",
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# SQL kept per request for slow-request dumps
+SLOW_QUERY_LIMIT = 50
+
+FILE_PATTERN = re.compile(r"^metrics-([0-9a-f]+)-(\d+)\.bin$")
+
+Family = namedtuple("Family", ["name", "kind", "help", "labelnames", "slots", "buckets", "collect"])
+
+
+class Registry:
+    """Fixed layout of metric slots, identical in every worker"""
+
+    def __init__(self):
+        self.families = []
+        self.size = 0
+
+    def _add(self, name, kind, help, labelnames, labelvalues, width, buckets=None, collect=None):
+        slots = {}
+        for values in labelvalues:
+            slots[values] = self.size
+            self.size += width
+        self.families.append(Family(name, kind, help, labelnames, slots, buckets, collect))
+        return slots
+
+    def counter(self, name, help, labelnames=(), labelvalues=((),), collect=None):
+        return self._add(name, "counter", help, labelnames, labelvalues, 1, collect=collect)
+
+    def gauge(self, name, help, labelnames=(), labelvalues=((),), collect=None):
+        return self._add(name, "gauge", help, labelnames, labelvalues, 1, collect=collect)
+
+    def histogram(self, name, help, buckets, labelnames=(), labelvalues=((),)):
+        # One count per bucket plus +Inf, then sum and count
+        return self._add(name, "histogram", help, labelnames, labelvalues, len(buckets) + 3, buckets)
+
+    @property
+    def key(self):
+        """Changes whenever the layout does, so old files are never misread"""
+        layout = repr([(f.name, f.kind, f.labelnames, list(f.slots), f.buckets) for f in self.families])
+        return hashlib.sha1(layout.encode()).hexdigest()[:12]
+
+
+CACHES = ("redirect_local", "redirect_shared", "qr_image")
+
+
+def _cache_counters():
+    from .cache import redirect_cache
+    from .qr_service import qr_image_cache_stats
+
+    stats = redirect_cache.stats()
+    qr = qr_image_cache_stats()
+    return {
+        ("redirect_local", "hit"): stats["local_hits"],
+        ("redirect_local", "miss"): stats["local_misses"],
+        ("redirect_shared", "hit"): stats["shared_hits"],
+        ("redirect_shared", "miss"): stats["shared_misses"],
+        ("qr_image", "hit"): qr["hits"],
+        ("qr_image", "miss"): qr["misses"],
+    }
+
+
+def _buffer_depths():
+    from .click_buffer import click_buffer
+    from .events import click_events
+
+    return {("click_buffer",): click_buffer.depth, ("click_events",): click_events.depth}
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "shortener_requests_total", "Requests by view group and status class",
+    ("view", "status"), [(v, s) for v in VIEWS for s in STATUS_CLASSES],
+)
+LATENCY = registry.histogram(
+    "shortener_request_duration_seconds", "Request latency by view group",
+    LATENCY_BUCKETS, ("view",), [(v,) for v in VIEWS],
+)
+QUERIES = registry.histogram(
+    "shortener_db_queries_per_request", "DB queries per request by view group",
+    QUERY_COUNT_BUCKETS, ("view",), [(v,) for v in VIEWS],
+)
+QUERY_SECONDS = registry.counter(
+    "shortener_db_query_seconds_total", "Time spent in DB queries by view group",
+    ("view",), [(v,) for v in VIEWS],
+)
+CACHE_LOOKUPS = registry.counter(
+    "shortener_cache_lookups_total", "Cache lookups by cache and result",
+    ("cache", "result"), [(cache, result) for cache in CACHES for result in ("hit", "miss")],
+    collect=_cache_counters,
+)
+BUFFER_DEPTH = registry.gauge(
+    "shortener_buffer_depth", "Clicks and click events waiting to be written",
+    ("buffer",), [("click_buffer",), ("click_events",)],
+    collect=_buffer_depths,
+)
+
+
+class _ShardOwner:
+    """Lives in one thread's local storage; collected when the thread ends"""
+
+    __slots__ = ("__weakref__",)
+
+
+class Metrics:
+    """Per-process metric values, published to a shared directory"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._local = threading.local()
+        self._shards = {}
+        self._shard_ids = count()
+        # Shards of finished threads, folded into _base on the next read;
+        # appended to by finalizers, so without taking the lock
+        self._retired = deque()
+        self._base = [0.0] * registry.size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._map = None
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return getattr(settings, "SHORTENER_METRICS", True)
+
+    @property
+    def directory(self):
+        default = Path(tempfile.gettempdir()) / "shortener-metrics"
+        return Path(getattr(settings, "SHORTENER_METRICS_DIR", None) or default)
+
+    @property
+    def interval(self):
+        return getattr(settings, "SHORTENER_METRICS_PUBLISH_INTERVAL", 1.0)
+
+    def _shard(self):
+        if self._pid != os.getpid():
+            self._start()
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = [0.0] * self.registry.size
+            owner = _ShardOwner()
+            with self._lock:
+                shard_id = next(self._shard_ids)
+                self._shards[shard_id] = shard
+            weakref.finalize(owner, self._retired.append, shard_id)
+            self._local.values = shard
+            self._local.owner = owner
+        return shard
+
+    def _fold_retired(self):
+        """Add the shards of finished threads to _base and forget them; hold the lock"""
+        base = self._base
+        while self._retired:
+            shard = self._shards.pop(self._retired.popleft(), None)
+            if shard is not None:
+                for i, value in enumerate(shard):
+                    base[i] += value
+
+    def inc(self, index, amount=1):
+        self._shard()[index] += amount
+
+    def observe(self, base, buckets, value):
+        shard = self._shard()
+        shard[base + bisect_left(buckets, value)] += 1
+        shard[base + len(buckets) + 1] += value
+        shard[base + len(buckets) + 2] += 1
+
+    def observe_request(self, view, status, seconds, queries=None, query_seconds=0.0):
+        """Record one finished request; `queries` is None when they were not counted"""
+        status_class = f"{min(max(status // 100, 2), 5)}xx"
+        self.inc(REQUESTS[view, status_class])
+        self.observe(LATENCY[view,], LATENCY_BUCKETS, seconds)
+        if queries is not None:
+            self.observe(QUERIES[view,], QUERY_COUNT_BUCKETS, queries)
+            self.inc(QUERY_SECONDS[view,], query_seconds)
+
+    def totals(self):
+        """This process's current values, shards summed and collectors applied"""
+        with self._lock:
+            self._fold_retired()
+            values = [sum(column) for column in zip(self._base, *self._shards.values())]
+        for family in self.registry.families:
+            if family.collect is None:
+                continue
+            try:
+                for labels, value in family.collect().items():
+                    values[family.slots[labels]] = float(value)
+            except Exception:
+                logger.exception("Collecting %s failed", family.name)
+        return values
+
+    def publish(self):
+        """Copy this process's values into its metrics file"""
+        if self._pid != os.getpid():
+            self._start()
+        values = self.totals()
+        with self._lock:
+            if self._map is not None:
+                struct.pack_into(f"{len(values)}d", self._map, 0, *values)
+
+    def close(self, zero_gauges=True):
+        """Final publish at worker exit; gauges of a gone worker read 0"""
+        if self._pid != os.getpid():
+            return
+        values = self.totals()
+        if zero_gauges:
+            for family in self.registry.families:
+                if family.kind == "gauge":
+                    for index in family.slots.values():
+                        values[index] = 0.0
+        with self._lock:
+            if self._map is not None:
+                struct.pack_into(f"{len(values)}d", self._map, 0, *values)
+                self._map.flush()
+
+    def _start(self):
+        # A forked worker starts from zero with its own file and thread
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._shards = {}
+            self._retired = deque()
+            self._base = [0.0] * self.registry.size
+            self._local = threading.local()
+            self._map = None
+            try:
+                directory = self.directory
+                directory.mkdir(parents=True, exist_ok=True)
+                path = directory / f"metrics-{self.registry.key}-{self._pid}.bin"
+                size = self.registry.size * 8
+                with open(path, "w+b") as f:
+                    f.truncate(size)
+                    self._map = mmap.mmap(f.fileno(), size)
+            except OSError:
+                logger.exception("Cannot create the metrics file; /metrics will miss this process")
+            self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("Publishing metrics failed")
+
+    def collect(self):
+        """
+        Values summed over every worker's file
+
+        Returns:
+            list: one value per slot
+        """
+        self.publish()
+        size = self.registry.size
+        key = self.registry.key
+        counters = [0.0] * size
+        gauges = [0.0] * size
+        directory = self.directory
+        paths = directory.iterdir() if directory.is_dir() else []
+        for path in paths:
+            match = FILE_PATTERN.match(path.name)
+            if match is None or match.group(1) != key:
+                continue
+            try:
+                values = struct.unpack(f"{size}d", path.read_bytes()[:size * 8])
+            except (OSError, struct.error):
+                continue
+            alive = _alive(int(match.group(2)))
+            for i, value in enumerate(values):
+                counters[i] += value
+                if alive:
+                    gauges[i] += value
+        for family in self.registry.families:
+            if family.kind == "gauge":
+                for index in family.slots.values():
+                    counters[index] = gauges[index]
+        return counters
+
+    def render(self):
+        """Prometheus text exposition of collect()"""
+        values = self.collect()
+        lines = []
+        for family in self.registry.families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for labels, index in family.slots.items():
+                pairs = [f'{name}="{value}"' for name, value in zip(family.labelnames, labels)]
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{_labels(pairs)} {_number(values[index])}")
+                    continue
+                cumulative = 0.0
+                for i, bound in enumerate((*family.buckets, "+Inf")):
+                    cumulative += values[index + i]
+                    le = f'le="{bound}"'
+                    lines.append(f"{family.name}_bucket{_labels(pairs + [le])} {_number(cumulative)}")
+                width = len(family.buckets)
+                lines.append(f"{family.name}_sum{_labels(pairs)} {_number(values[index + width + 1])}")
+                lines.append(f"{family.name}_count{_labels(pairs)} {_number(values[index + width + 2])}")
+
+        # Hit ratio per cache, for dashboards that do not derive it
+        lines.append("# HELP shortener_cache_hit_ratio Cache hits / lookups since the workers started")
+        lines.append("# TYPE shortener_cache_hit_ratio gauge")
+        for cache in CACHES:
+            hits = values[CACHE_LOOKUPS[cache, "hit"]]
+            total = hits + values[CACHE_LOOKUPS[cache, "miss"]]
+            lines.append(f'shortener_cache_hit_ratio{{cache="{cache}"}} {_number(hits / total if total else 0.0)}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clear_metrics_dir():
+    """Remove every worker's file; call when the server (re)starts"""
+    directory = metrics.directory
+    if directory.is_dir():
+        for path in directory.glob("metrics-*.bin"):
+            path.unlink(missing_ok=True)
+
+
+metrics = Metrics(registry)
+
+
+def view_group(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "other"
+    name = match.url_name or ""
+    if name in VIEW_GROUPS:
+        return VIEW_GROUPS[name]
+    return "qr" if "qr" in name else "other"
+
+
+class _QueryRecorder:
+    """execute_wrapper counting (and optionally keeping) the queries of a request"""
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_sql and len(self.queries) < SLOW_QUERY_LIMIT:
+                self.queries.append((elapsed, context["connection"].alias, sql))
+
+
+def _log_slow(request, view, status, elapsed, recorder):
+    if random.random() >= getattr(settings, "SHORTENER_METRICS_SLOW_SAMPLE_RATE", 0.1):
+        return
+    dump = "\n".join(
+        f"  {seconds * 1000:8.2f} ms [{alias}] {sql}"
+        for seconds, alias, sql in sorted(recorder.queries, key=lambda query: query[0], reverse=True)
+    )
+    logger.warning(
+        "Slow request %s %s (%s, %d) %.1f ms, %d queries in %.1f ms\n%s",
+        request.method, request.path, view, status, elapsed * 1000,
+        recorder.count, recorder.seconds * 1000, dump,
+    )
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """
+    Time every request and count its DB queries
+
+    Queries are only counted for sync requests: under ASGI they run on
+    another thread's connection, so async views record latency only.
+    """
+
+    def finish(request, status, started, recorder):
+        elapsed = time.perf_counter() - started
+        view = view_group(request)
+        if recorder is None:
+            metrics.observe_request(view, status, elapsed)
+            return
+        metrics.observe_request(view, status, elapsed, recorder.count, recorder.seconds)
+        slow_ms = getattr(settings, "SHORTENER_METRICS_SLOW_REQUEST_MS", 0)
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            _log_slow(request, view, status, elapsed, recorder)
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not metrics.enabled:
+                return await get_response(request)
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await get_response(request)
+                status = response.status_code
+                return response
+            finally:
+                finish(request, status, started, None)
+    else:
+        def middleware(request):
+            if not metrics.enabled:
+                return get_response(request)
+            recorder = _QueryRecorder(keep_sql=bool(getattr(settings, "SHORTENER_METRICS_SLOW_REQUEST_MS", 0)))
+            started = time.perf_counter()
+            status = 500
+            try:
+                with ExitStack() as stack:
+                    for alias in connections:
+                        stack.enter_context(connections[alias].execute_wrapper(recorder))
+                    response = get_response(request)
+                status = response.status_code
+                return response
+            finally:
+                finish(request, status, started, recorder)
+
+    return middleware
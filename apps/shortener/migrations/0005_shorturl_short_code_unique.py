@@ -0,0 +1,90 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:09
+
+import string
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# Frozen copy of the code_pool mapping at the time of this migration, so
+# later changes to the app code cannot change what it does
+BASE62 = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+CODE_SPACE = len(BASE62) ** CODE_LENGTH
+CODE_MULTIPLIER = 2654435761
+CODE_OFFSET = 19731208471
+
+
+def encode_base62(number, length=0):
+    chars = []
+    while number:
+        number, rem = divmod(number, len(BASE62))
+        chars.append(BASE62[rem])
+    return ''.join(reversed(chars)).rjust(length, BASE62[0])
+
+
+def sequence_to_short_code(value):
+    if value < CODE_SPACE:
+        return encode_base62((value * CODE_MULTIPLIER + CODE_OFFSET) % CODE_SPACE, CODE_LENGTH)
+    return encode_base62(value)
+
+
+def create_short_code_sequence(apps, schema_editor):
+    ShortCodeSequence = apps.get_model('shortener', 'ShortCodeSequence')
+    ShortCodeSequence.objects.get_or_create(name='short_code')
+
+
+def dedupe_short_codes(apps, schema_editor):
+    """Keep each duplicated short code on its oldest link; give the others fresh codes"""
+    ShortUrl = apps.get_model('shortener', 'ShortUrl')
+    ShortCodeSequence = apps.get_model('shortener', 'ShortCodeSequence')
+    duplicated = list(
+        ShortUrl.objects.values('short_code')
+        .annotate(links=Count('id'))
+        .filter(links__gt=1)
+        .values_list('short_code', flat=True)
+    )
+    if not duplicated:
+        return
+
+    sequence, _ = ShortCodeSequence.objects.get_or_create(name='short_code')
+    for short_code in duplicated:
+        for link in ShortUrl.objects.filter(short_code=short_code).order_by('created_at', 'id')[1:]:
+            while True:
+                new_code = sequence_to_short_code(sequence.next_value)
+                sequence.next_value += 1
+                if not ShortUrl.objects.filter(short_code=new_code).exists():
+                    break
+            link.short_code = new_code
+            link.save(update_fields=['short_code'])
+    sequence.save(update_fields=['next_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0004_shorturl_qr_code_generated_at_shorturl_qr_code_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortCodeSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(dedupe_short_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shorturl',
+            name='short_code',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='shorturl',
+            index=models.Index(fields=['short_code', 'is_active'], name='shorturl_code_active_idx'),
+        ),
+        migrations.RunPython(create_short_code_sequence, migrations.RunPython.noop),
+    ]
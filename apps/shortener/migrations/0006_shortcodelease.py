@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0005_shorturl_short_code_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShortCodeLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.BigIntegerField()),
+                ('stop', models.BigIntegerField()),
+                ('owner', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('heartbeat_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
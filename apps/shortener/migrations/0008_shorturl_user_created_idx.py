@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0007_shorturl_active_expiry_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shorturl',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='shorturl_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0009_user_link_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket_start', models.DateTimeField()),
+                ('clicks', models.BigIntegerField(default=0)),
+                ('short_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='click_buckets', to='shortener.shorturl')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['granularity', 'bucket_start'], name='clickbucket_compact_idx')],
+                'constraints': [models.UniqueConstraint(fields=('short_url', 'granularity', 'bucket_start'), name='unique_click_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0010_clickbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clicked_at', models.DateTimeField()),
+                ('short_code', models.CharField(max_length=10)),
+                ('referrer', models.TextField(blank=True, default='')),
+                ('user_agent', models.CharField(blank=True, default='', max_length=512)),
+                ('ip_hash', models.CharField(blank=True, default='', max_length=32)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['short_code', 'clicked_at'], name='clickevent_code_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0012_qrjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shorturl',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds browsers and CDNs may cache the redirect; empty uses the default for the redirect type', null=True),
+        ),
+        migrations.AddField(
+            model_name='shorturl',
+            name='redirect_type',
+            field=models.PositiveSmallIntegerField(choices=[(302, '302 Found (temporary)'), (307, '307 Temporary Redirect'), (301, '301 Moved Permanently'), (308, '308 Permanent Redirect')], default=302),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0013_shorturl_redirect_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickEventSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('events', models.IntegerField(default=0)),
+                ('loaded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='clickevent',
+            index=models.Index(fields=['clicked_at'], name='clickevent_time_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0014_clickevent_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EdgeLogFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('clicks', models.BigIntegerField(default=0)),
+                ('ingested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
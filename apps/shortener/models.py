@@ -1,8 +1,80 @@
-from django.db import models
+from collections import Counter
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .bloom import short_code_filter
+from .cache import redirect_cache
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+# Fields copied into the redirect cache; saving any of them invalidates it
+REDIRECT_FIELDS = {"short_code", "original_url", "is_active", "expires_at", "redirect_type", "cache_max_age"}
+
+
+def invalidate_redirect_cache(short_codes):
+    """Drop links from the redirect cache now and once the transaction commits"""
+    short_codes = list(short_codes)
+    if not short_codes:
+        return
+    redirect_cache.invalidate_many(short_codes)
+    transaction.on_commit(lambda: redirect_cache.invalidate_many(short_codes))
+
+
+class ShortUrlQuerySet(models.QuerySet):
+    """
+    Bulk update() and delete() that keep the redirect cache and
+    UserLinkStats in sync, as ShortUrl.save() and delete() do for one link
+    (the admin's "delete selected", "activate" and "deactivate" actions go
+    through these)
+
+    Unlike the instance method, delete() does not remove QR files.
+    """
+
+    def update(self, **kwargs):
+        owner_changed = "user" in kwargs or "user_id" in kwargs
+        if not owner_changed and not REDIRECT_FIELDS.intersection(kwargs):
+            # Stats don't depend on the remaining fields; click counts are
+            # added to them by the click buffer itself
+            return super().update(**kwargs)
+        # Read the codes and owners first: the update may take rows out of the filter
+        links = list(self.values_list("short_code", "user_id"))
+        short_codes = [short_code for short_code, _ in links]
+        if isinstance(kwargs.get("short_code"), str):
+            # A negatively cached new code must start resolving too
+            short_codes.append(kwargs["short_code"])
+        rows = super().update(**kwargs)
+        invalidate_redirect_cache(short_codes)
+        if owner_changed and links:
+            new_owner = kwargs.get("user_id", getattr(kwargs.get("user"), "pk", None))
+            owners = {user_id for _, user_id in links}
+            if new_owner is not None:
+                owners.add(new_owner)
+            UserLinkStats.objects.rebuild(owners)
+        return rows
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            # Lock the rows so a click flush cannot slip in between reading
+            # their totals and deleting them
+            short_codes = list(self.select_for_update().values_list("short_code", flat=True))
+            UserLinkStats.objects.record_links_deleted(self)
+            result = super().delete()
+        invalidate_redirect_cache(short_codes)
+        return result
+
+
 class ShortUrl(models.Model):
+    REDIRECT_CHOICES = [
+        (302, "302 Found (temporary)"),
+        (307, "307 Temporary Redirect"),
+        (301, "301 Moved Permanently"),
+        (308, "308 Permanent Redirect"),
+    ]
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -10,11 +82,19 @@ class ShortUrl(models.Model):
     )
 
     original_url = models.URLField()
-    short_code = models.CharField(max_length=10)
+    short_code = models.CharField(max_length=10, unique=True)
     click_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(blank=True, null = True)
     is_active = models.BooleanField(default=True)
+
+    # HTTP policy of the redirect response (see RedirectTarget.cache_seconds)
+    redirect_type = models.PositiveSmallIntegerField(choices=REDIRECT_CHOICES, default=302)
+    cache_max_age = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Seconds browsers and CDNs may cache the redirect; empty uses the default for the redirect type"
+    )
     
     # QR Code related fields
     qr_code_image = models.ImageField(
@@ -29,6 +109,22 @@ class ShortUrl(models.Model):
         help_text="Timestamp when QR code was generated"
     )
 
+    objects = ShortUrlQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the redirect lookup on (short_code, is_active)
+            models.Index(fields=["short_code", "is_active"], name="shorturl_code_active_idx"),
+            # Serves the dashboard's keyset pagination on (created_at, id) per user
+            models.Index(fields=["user", "created_at", "id"], name="shorturl_user_created_idx"),
+            # Lets the expiry sweeper find due links without scanning the table
+            models.Index(
+                fields=["expires_at"],
+                name="shorturl_active_expiry_idx",
+                condition=models.Q(is_active=True, expires_at__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.short_code} -> {self.original_url}"
 
@@ -37,13 +133,364 @@ class ShortUrl(models.Model):
         """Check if QR code has been generated for this URL"""
         return bool(self.qr_code_image and self.qr_code_generated_at)
     
+    def save(self, *args, **kwargs):
+        """Override save to keep the redirect cache in sync"""
+        update_fields = kwargs.get("update_fields")
+        creating = self._state.adding
+        super().save(*args, **kwargs)
+        if creating:
+            short_code_filter.add(self.short_code)
+            UserLinkStats.objects.record_links_created([self])
+        if update_fields is None or REDIRECT_FIELDS.intersection(update_fields):
+            self.invalidate_redirect_cache()
+
     def delete(self, *args, **kwargs):
         """Override delete to clean up QR code file"""
         if self.qr_code_image:
             try:
                 if os.path.isfile(self.qr_code_image.path):
                     os.remove(self.qr_code_image.path)
-            except Exception as e:
-                print(f"Error deleting QR code file: {e}")
-        super().delete(*args, **kwargs)
+            except Exception:
+                logger.exception("Error deleting QR code file of %s", self.short_code)
+        with transaction.atomic(using=self._state.db):
+            # Flushed clicks may not be in this instance's click_count yet
+            click_count = (
+                ShortUrl.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("click_count", flat=True)
+                .first()
+            )
+            if click_count is not None:
+                self.click_count = click_count
+            result = super().delete(*args, **kwargs)
+            self.invalidate_redirect_cache()
+            UserLinkStats.objects.record_link_deleted(self)
+        return result
+
+    def invalidate_redirect_cache(self):
+        """Drop this link from the redirect cache now and once the transaction commits"""
+        invalidate_redirect_cache([self.short_code])
+
+
+
+class ShortCodeSequence(models.Model):
+    """Counter that short codes are allocated from in reserved blocks"""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class ShortCodeLease(models.Model):
+    """
+    Range of sequence values [start, stop) held by one process's code pool.
+
+    An empty owner means the range was released and can be recycled.
+    """
+    start = models.BigIntegerField()
+    stop = models.BigIntegerField()
+    owner = models.CharField(max_length=100, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"[{self.start}, {self.stop}) owned by {self.owner or 'nobody'}"
+
+
+class UserLinkStatsManager(models.Manager):
+    """
+    Incremental upkeep of UserLinkStats/UserDailyLinkStats.
+
+    Increments on a user without a stats row are dropped; the row is built
+    from scratch the first time it is read, and rebuild() reconciles drift.
+    """
+
+    def record_links_created(self, links):
+        links = list(links)
+        per_user = Counter(link.user_id for link in links)
+        per_day = Counter(
+            (link.user_id, timezone.localdate(link.created_at)) for link in links
+        )
+        for user_id, count in per_user.items():
+            self.filter(user_id=user_id).update(total_links=F("total_links") + count)
+
+        UserDailyLinkStats.objects.bulk_create(
+            [UserDailyLinkStats(user_id=u, date=d) for u, d in per_day],
+            ignore_conflicts=True,
+        )
+        for (user_id, date), count in per_day.items():
+            UserDailyLinkStats.objects.filter(user_id=user_id, date=date).update(
+                links_created=F("links_created") + count
+            )
+
+    def record_link_deleted(self, link):
+        self.filter(user_id=link.user_id).update(
+            total_links=F("total_links") - 1,
+            total_clicks=F("total_clicks") - link.click_count,
+            links_with_qr=F("links_with_qr") - (1 if link.has_qr_code else 0),
+        )
+        UserDailyLinkStats.objects.filter(
+            user_id=link.user_id, date=timezone.localdate(link.created_at)
+        ).update(links_created=F("links_created") - 1)
+
+    def record_links_deleted(self, links):
+        """Bulk counterpart of record_link_deleted() for a ShortUrl queryset about to be deleted"""
+        links = links.order_by()
+        for row in links.values("user_id").annotate(
+            count=Count("id"),
+            clicks=Sum("click_count"),
+            with_qr=Count("id", filter=Q(qr_code_generated_at__isnull=False)),
+        ):
+            self.filter(user_id=row["user_id"]).update(
+                total_links=F("total_links") - row["count"],
+                total_clicks=F("total_clicks") - (row["clicks"] or 0),
+                links_with_qr=F("links_with_qr") - row["with_qr"],
+            )
+        for row in links.annotate(day=TruncDate("created_at")).values("user_id", "day").annotate(count=Count("id")):
+            UserDailyLinkStats.objects.filter(user_id=row["user_id"], date=row["day"]).update(
+                links_created=F("links_created") - row["count"]
+            )
+
+    def record_clicks(self, clicks_by_user):
+        for user_id, count in clicks_by_user.items():
+            self.filter(user_id=user_id).update(total_clicks=F("total_clicks") + count)
+
+    def record_qr_change(self, user_id, delta):
+        self.filter(user_id=user_id).update(links_with_qr=F("links_with_qr") + delta)
+
+    def for_user(self, user):
+        """The user's stats row, building it on first access"""
+        try:
+            return self.get(user=user)
+        except self.model.DoesNotExist:
+            self.rebuild([user.pk])
+            return self.get(user=user)
+
+    def rebuild(self, user_ids):
+        """
+        Recompute stats and daily buckets for `user_ids` from ShortUrl
+
+        Returns:
+            int: number of stats rows that were missing or out of date
+        """
+        user_ids = list(user_ids)
+        totals = {
+            row["user_id"]: row
+            for row in ShortUrl.objects.filter(user_id__in=user_ids)
+            .values("user_id")
+            .annotate(
+                total_links=Count("id"),
+                total_clicks=Sum("click_count"),
+                links_with_qr=Count("id", filter=Q(qr_code_generated_at__isnull=False)),
+            )
+        }
+        existing = {stats.user_id: stats for stats in self.filter(user_id__in=user_ids)}
+
+        rows = []
+        drifted = 0
+        for user_id in user_ids:
+            row = totals.get(user_id, {})
+            stats = self.model(
+                user_id=user_id,
+                total_links=row.get("total_links", 0),
+                total_clicks=row.get("total_clicks") or 0,
+                links_with_qr=row.get("links_with_qr", 0),
+            )
+            old = existing.get(user_id)
+            if old is None or (old.total_links, old.total_clicks, old.links_with_qr) != (
+                stats.total_links, stats.total_clicks, stats.links_with_qr
+            ):
+                drifted += 1
+            rows.append(stats)
+
+        with transaction.atomic():
+            self.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["user"],
+                update_fields=["total_links", "total_clicks", "links_with_qr"],
+            )
+            UserDailyLinkStats.objects.filter(user_id__in=user_ids).delete()
+            UserDailyLinkStats.objects.bulk_create(
+                UserDailyLinkStats(user_id=row["user_id"], date=row["day"], links_created=row["count"])
+                for row in ShortUrl.objects.filter(user_id__in=user_ids)
+                .annotate(day=TruncDate("created_at"))
+                .values("user_id", "day")
+                .annotate(count=Count("id"))
+            )
+        return drifted
+
+
+class UserLinkStats(models.Model):
+    """Per-user dashboard totals, kept up to date as links change"""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="link_stats"
+    )
+    total_links = models.IntegerField(default=0)
+    total_clicks = models.BigIntegerField(default=0)
+    links_with_qr = models.IntegerField(default=0)
+
+    objects = UserLinkStatsManager()
+
+    def __str__(self):
+        return f"{self.user} stats"
+
+
+class UserDailyLinkStats(models.Model):
+    """Links a user created on one day (in the current time zone)"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="daily_link_stats"
+    )
+    date = models.DateField()
+    links_created = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "date"], name="unique_user_daily_link_stats"),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.date}: {self.links_created}"
+
+
+class ClickBucket(models.Model):
+    """Clicks on one link during one minute, hour or day (see analytics.py)"""
+    GRANULARITY_CHOICES = [
+        ("minute", "Minute"),
+        ("hour", "Hour"),
+        ("day", "Day"),
+    ]
+
+    short_url = models.ForeignKey(
+        ShortUrl,
+        on_delete=models.CASCADE,
+        related_name="click_buckets"
+    )
+    granularity = models.CharField(max_length=6, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    clicks = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["short_url", "granularity", "bucket_start"],
+                name="unique_click_bucket",
+            ),
+        ]
+        indexes = [
+            # The compactor scans old buckets of one granularity
+            models.Index(fields=["granularity", "bucket_start"], name="clickbucket_compact_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.short_url_id} {self.granularity} {self.bucket_start}: {self.clicks}"
+
+
+class ClickEvent(models.Model):
+    """
+    One redirect, appended by the click event log (see events.py)
+
+    Keyed by short code rather than a foreign key so the audit trail
+    outlives deleted links.
+    """
+    clicked_at = models.DateTimeField()
+    short_code = models.CharField(max_length=10)
+    referrer = models.TextField(blank=True, default="")
+    user_agent = models.CharField(max_length=512, blank=True, default="")
+    ip_hash = models.CharField(max_length=32, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["short_code", "clicked_at"], name="clickevent_code_time_idx"),
+            # Retention purges (purge_click_events) scan by time alone
+            models.Index(fields=["clicked_at"], name="clickevent_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.short_code} at {self.clicked_at}"
+
+
+class ClickEventSegment(models.Model):
+    """
+    A click event log segment loaded by `manage.py replay_click_events`
+
+    Written in the same transaction as the segment's events, so a rerun
+    after a crash between the commit and the rename skips the segment
+    instead of loading it twice.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    events = models.IntegerField(default=0)
+    loaded_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class EdgeLogFile(models.Model):
+    """
+    A CDN access log whose clicks `manage.py ingest_edge_logs` added
+
+    Written in the same transaction as the clicks, so a log is never
+    counted twice, even if the command dies before renaming it.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    clicks = models.BigIntegerField(default=0)
+    ingested_at = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        return self.name
+
+
+class QrJob(models.Model):
+    """A queued QR code render for one link, served by `manage.py qr_worker`"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    OPEN_STATUSES = (PENDING, RUNNING)
+
+    short_url = models.ForeignKey(
+        ShortUrl,
+        on_delete=models.CASCADE,
+        related_name="qr_jobs"
+    )
+    # Full short URL to encode, built from the request that queued the job
+    target_url = models.URLField(max_length=2048)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # At most one queued or running job per link
+            models.UniqueConstraint(
+                fields=["short_url"],
+                condition=Q(status__in=["pending", "running"]),
+                name="unique_open_qr_job",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="qrjob_status_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"QR job {self.pk} for {self.short_url_id} ({self.status})"
+
+    @property
+    def is_open(self):
+        return self.status in self.OPEN_STATUSES
@@ -0,0 +1,77 @@
+import base64
+import json
+from collections import namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+KeysetPage = namedtuple("KeysetPage", ["items", "next_cursor", "prev_cursor"])
+
+
+def encode_cursor(created_at, pk):
+    raw = json.dumps([created_at.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Returns:
+        tuple: (created_at, pk), or None for a malformed token
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, pk = json.loads(raw)
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            return None
+        return created_at, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_page(queryset, page_size, newest_first=True, after=None, before=None):
+    """
+    One page of `queryset` ordered by (created_at, id)
+
+    Instead of OFFSET, the page starts right after (or, going backwards,
+    right before) the row a cursor points at, so the query reads only
+    page_size + 1 index entries no matter how deep the page is.
+
+    Args:
+        queryset: rows to page through
+        page_size: rows per page
+        newest_first: sort by created_at descending
+        after: cursor of the last row of the previous page
+        before: cursor of the first row of the next page
+
+    Returns:
+        KeysetPage: items plus cursors for the neighbouring pages (or None)
+    """
+    cursor = decode_cursor(before) if before else decode_cursor(after) if after else None
+    backwards = bool(before) and cursor is not None
+
+    # Walking backwards flips the sort order; the page is reversed afterwards
+    descending = newest_first != backwards
+    if cursor is not None:
+        created_at, pk = cursor
+        op = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"created_at__{op}": created_at})
+            | Q(created_at=created_at, **{f"pk__{op}": pk})
+        )
+    order = ("-created_at", "-pk") if descending else ("created_at", "pk")
+    rows = list(queryset.order_by(*order)[:page_size + 1])
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows, None, None)
+
+    first = encode_cursor(rows[0].created_at, rows[0].pk)
+    last = encode_cursor(rows[-1].created_at, rows[-1].pk)
+    if backwards:
+        return KeysetPage(rows, last, first if has_more else None)
+    return KeysetPage(rows, last if has_more else None, first if cursor else None)
@@ -0,0 +1,244 @@
+"""
+Batch QR rendering for large numbers of links.
+
+render_qr_png() builds a fresh qrcode.QRCode per link: it lays out the
+function patterns, walks the data placement zigzag and calls a mask
+lambda per module for each of the eight candidate masks, then draws the
+image rectangle by rectangle. Everything except the data bits depends
+only on the QR version, so here it is computed once per version in a
+_VersionPlan and reused for every code of that version:
+
+- the blank matrices (with and without format bits) and the placement
+  order of the data modules
+- the mask bit of every data module under each of the eight masks
+- a 1-bit PIL image of the final size, filled row by row with frombytes()
+  instead of being drawn, and encoded as a 1-bit PNG
+
+Mask selection still scores all eight masks, with a bytes/regex version
+of qrcode's penalty function (util.lost_point) that returns the same
+scores, so the PNGs are byte-for-byte identical to render_qr_png().
+render_qr_batch() sorts the URLs by length (URLs of similar length share
+a version), cuts them into chunks and renders the chunks in a process
+pool.
+"""
+import re
+from io import BytesIO
+
+from PIL import Image
+from qrcode import util
+from qrcode.main import QRCode
+
+from .qr_service import ERROR_CORRECTION_LEVELS, QR_BORDER, QR_BOX_SIZE, QR_ERROR_CORRECTION
+
+# URLs per task sent to a render process; plans stay cached in each
+# process, so small tasks only cost pickling
+QR_BATCH_CHUNK_SIZE = 50
+
+# Penalty rule 1: runs of five or more modules of one colour
+_RUN = re.compile(rb"0{5,}|1{5,}")
+# Penalty rule 3: finder-like 1:1:3:1:1 patterns with four light modules
+# on one side; the lookahead counts overlapping matches
+_FINDER_LIKE = re.compile(rb"(?=10111010000|00001011101)")
+
+_BITS = bytes.maketrans(b"\x00\x01", b"01")
+
+# Per-process plans, keyed by (version, error correction, box size, border)
+_plans = {}
+
+
+def _penalty(modules):
+    """Same score as qrcode.util.lost_point(modules), computed a row at a time"""
+    size = len(modules)
+    rows = [bytes(row).translate(_BITS) for row in modules]
+    # Rows and columns in one string; the separator ends every run and pattern
+    lines = b"|".join(rows + [bytes(col).translate(_BITS) for col in zip(*modules)])
+
+    score = 40 * len(_FINDER_LIKE.findall(lines))
+    for run in _RUN.finditer(lines):
+        score += run.end() - run.start() - 2
+
+    # Rule 2: 2x2 blocks of one colour
+    values = [int(row, 2) for row in rows]
+    pairs = (1 << (size - 1)) - 1
+    for upper, lower in zip(values, values[1:]):
+        same = ~(upper ^ lower)
+        score += 3 * (same & (same >> 1) & ~(upper ^ (upper >> 1)) & pairs).bit_count()
+
+    # Rule 4: every 5% the dark share departs from 50%
+    dark = sum(value.bit_count() for value in values)
+    score += int(abs(float(dark) / size ** 2 * 100 - 50) / 5) * 10
+    return score
+
+
+class _VersionPlan:
+    """Everything about a QR code that depends only on its version"""
+
+    def __init__(self, version, error_correction, box_size, border):
+        self.version = version
+        self.error_correction = error_correction
+        qr = QRCode(version=version, error_correction=error_correction, box_size=box_size, border=border)
+        qr.modules_count = size = version * 4 + 17
+        qr.modules = [[None] * size for _ in range(size)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(size - 7, 0)
+        qr.setup_position_probe_pattern(0, size - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+        blank = qr.modules
+
+        # Candidate masks are scored with the format bits cleared
+        # (`test`), the winner is drawn with them set
+        self.scoring = []
+        self.final = []
+        for mask in range(8):
+            for test, templates in ((True, self.scoring), (False, self.final)):
+                qr.modules = [row[:] for row in blank]
+                qr.setup_type_info(test, mask)
+                if version >= 7:
+                    qr.setup_type_number(test)
+                templates.append(qr.modules)
+
+        self.positions = self._placement_order(self.final[0])
+        self.masks = [
+            [bool(mask_func(r, c)) for r, c in self.positions]
+            for mask_func in map(util.mask_func, range(8))
+        ]
+
+        self.border = border
+        self.box_size = box_size
+        self.pixels = (size + 2 * border) * box_size
+        self.row_bytes = (self.pixels + 7) // 8
+        self.padding = self.row_bytes * 8 - self.pixels
+        # Mode "1" stores white as 1; one character per module becomes box_size bits
+        self.widen = str.maketrans({"0": "0" * box_size, "1": "1" * box_size})
+        self.quiet_row = self._row_bytes([False] * (size + 2 * border))
+        self.image = Image.new("1", (self.pixels, self.pixels))
+        self.buffer = BytesIO()
+
+    @staticmethod
+    def _placement_order(modules):
+        """Data module coordinates in the order QRCode.map_data() fills them"""
+        size = len(modules)
+        positions = []
+        inc = -1
+        row = size - 1
+        for col in range(size - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while True:
+                for c in (col, col - 1):
+                    if modules[row][c] is None:
+                        positions.append((row, c))
+                row += inc
+                if row < 0 or size <= row:
+                    row -= inc
+                    inc = -inc
+                    break
+        return positions
+
+    def _row_bytes(self, row):
+        bits = "".join("0" if dark else "1" for dark in row).translate(self.widen)
+        return (int(bits, 2) << self.padding).to_bytes(self.row_bytes, "big")
+
+    def matrix(self, data_list):
+        """Module matrix for already segmented data, masked like QRCode.make()"""
+        data = util.create_data(self.version, self.error_correction, data_list)
+        bits = [False] * len(self.positions)
+        for i in range(min(len(bits), len(data) * 8)):
+            bits[i] = (data[i >> 3] >> (7 - (i & 7))) & 1 == 1
+
+        best_mask = 0
+        best_score = None
+        for mask in range(8):
+            modules = [row[:] for row in self.scoring[mask]]
+            for (r, c), bit, flip in zip(self.positions, bits, self.masks[mask]):
+                modules[r][c] = bit != flip
+            score = _penalty(modules)
+            if best_score is None or score < best_score:
+                best_mask, best_score = mask, score
+
+        modules = [row[:] for row in self.final[best_mask]]
+        for (r, c), bit, flip in zip(self.positions, bits, self.masks[best_mask]):
+            modules[r][c] = bit != flip
+        return modules
+
+    def png(self, modules):
+        quiet = [self.quiet_row * self.box_size] * self.border
+        edge = [False] * self.border
+        rows = [self._row_bytes(edge + row + edge) * self.box_size for row in modules]
+        self.image.frombytes(b"".join(quiet + rows + quiet))
+        buffer = self.buffer
+        buffer.seek(0)
+        buffer.truncate()
+        self.image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def _plan(version, error_correction, box_size, border):
+    key = (version, error_correction, box_size, border)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = _VersionPlan(version, error_correction, box_size, border)
+    return plan
+
+
+def render_qr_pngs(urls, error_correction=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """
+    Render many QR code PNGs in this process
+
+    Same output as calling render_qr_png() for each URL. Pure function of
+    its input, so it can run in a worker process.
+
+    Args:
+        urls: texts to encode, normally full short URLs
+        error_correction: "L", "M", "Q" or "H"
+        box_size: pixels per module
+        border: quiet zone width in modules
+
+    Returns:
+        list: PNG bytes, in the order of `urls`
+    """
+    level = ERROR_CORRECTION_LEVELS[error_correction]
+    groups = {}
+    for index, url in enumerate(urls):
+        qr = QRCode(error_correction=level)
+        qr.add_data(url)
+        groups.setdefault(qr.best_fit(), []).append((index, qr.data_list))
+
+    pngs = [None] * len(urls)
+    for version, items in groups.items():
+        plan = _plan(version, level, box_size, border)
+        for index, data_list in items:
+            pngs[index] = plan.png(plan.matrix(data_list))
+    return pngs
+
+
+def render_qr_batch(urls, executor=None, chunk_size=QR_BATCH_CHUNK_SIZE, error_correction=QR_ERROR_CORRECTION):
+    """
+    Render many QR code PNGs, spread over `executor` when given
+
+    Args:
+        urls: texts to encode
+        executor: concurrent.futures executor (normally a process pool),
+            or None to render inline
+        chunk_size: URLs per task
+        error_correction: "L", "M", "Q" or "H"
+
+    Returns:
+        list: PNG bytes, in the order of `urls`
+    """
+    urls = list(urls)
+    if executor is None:
+        return render_qr_pngs(urls, error_correction)
+
+    order = sorted(range(len(urls)), key=lambda i: len(urls[i]))
+    chunks = [order[i:i + chunk_size] for i in range(0, len(order), chunk_size)]
+    futures = [
+        (chunk, executor.submit(render_qr_pngs, [urls[i] for i in chunk], error_correction))
+        for chunk in chunks
+    ]
+    pngs = [None] * len(urls)
+    for chunk, future in futures:
+        for index, png in zip(chunk, future.result()):
+            pngs[index] = png
+    return pngs
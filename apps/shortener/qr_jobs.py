@@ -0,0 +1,230 @@
+"""
+DB-backed queue of QR code renders.
+
+Views only insert a QrJob row and return. `manage.py qr_worker` claims
+pending jobs in batches, renders the PNGs with the batch engine in a
+process pool (the CPU-heavy part: matrix construction and PNG encoding)
+and stores them from the parent process, so no broker is needed and
+every core is used.
+"""
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import QrJob
+from .qr_batch import QR_BATCH_CHUNK_SIZE, render_qr_batch
+from .qr_service import is_qr_current, link_qr_code, render_qr_png, save_qr_code, save_qr_codes
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT when fanning out a bulk request
+ENQUEUE_BATCH_SIZE = 1000
+
+
+def enqueue_qr_job(short_url, target_url):
+    """
+    Queue a QR render for `short_url` unless one is already queued
+
+    Args:
+        short_url: ShortUrl to render a QR code for
+        target_url: full short URL to encode
+
+    Returns:
+        QrJob: the new job, or the one already open for this link
+    """
+    try:
+        with transaction.atomic():
+            job = QrJob.objects.create(short_url=short_url, target_url=target_url)
+    except IntegrityError:
+        return QrJob.objects.get(short_url=short_url, status__in=QrJob.OPEN_STATUSES)
+    if not getattr(settings, "SHORTENER_QR_ASYNC", True):
+        run_jobs([job])
+        job.refresh_from_db()
+    return job
+
+
+def enqueue_qr_jobs(short_urls, build_url):
+    """
+    Queue QR renders for many links at once (links with an open job are skipped)
+
+    Args:
+        short_urls: ShortUrl queryset
+        build_url: callable mapping a short code to the full short URL
+
+    Returns:
+        int: number of links queued
+    """
+    short_urls = short_urls.exclude(qr_jobs__status__in=QrJob.OPEN_STATUSES)
+    queued = 0
+    batch = []
+    for pk, short_code in short_urls.values_list("pk", "short_code").iterator(chunk_size=ENQUEUE_BATCH_SIZE):
+        batch.append(QrJob(short_url_id=pk, target_url=build_url(short_code)))
+        if len(batch) >= ENQUEUE_BATCH_SIZE:
+            # A job queued concurrently for the same link wins the conflict
+            QrJob.objects.bulk_create(batch, ignore_conflicts=True)
+            queued += len(batch)
+            batch = []
+    if batch:
+        QrJob.objects.bulk_create(batch, ignore_conflicts=True)
+        queued += len(batch)
+    if not getattr(settings, "SHORTENER_QR_ASYNC", True):
+        while run_jobs(claim_jobs(ENQUEUE_BATCH_SIZE)):
+            pass
+    return queued
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_jobs(limit):
+    """
+    Mark up to `limit` pending jobs as running for this worker
+
+    Uses SKIP LOCKED where the database supports it so several workers
+    can poll the same queue; the status check on UPDATE keeps two workers
+    from claiming the same job either way.
+    """
+    now = timezone.now()
+    name = worker_name()
+    with transaction.atomic():
+        pending = QrJob.objects.filter(status=QrJob.PENDING).order_by("created_at", "pk")
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        ids = list(pending.values_list("pk", flat=True)[:limit])
+        QrJob.objects.filter(pk__in=ids, status=QrJob.PENDING).update(
+            status=QrJob.RUNNING, started_at=now, worker=name
+        )
+    return list(
+        QrJob.objects.filter(pk__in=ids, status=QrJob.RUNNING, worker=name)
+        .select_related("short_url")
+    )
+
+
+def reap_stale_jobs(now=None):
+    """
+    Requeue jobs whose worker died mid-render, or fail them after
+    SHORTENER_QR_JOB_MAX_ATTEMPTS
+
+    The lost render counts as an attempt, so a job that keeps killing or
+    stalling its worker is eventually failed instead of requeued forever.
+
+    Returns:
+        int: number of jobs reaped
+    """
+    now = now or timezone.now()
+    timeout = timedelta(seconds=getattr(settings, "SHORTENER_QR_JOB_TIMEOUT", 300))
+    max_attempts = getattr(settings, "SHORTENER_QR_JOB_MAX_ATTEMPTS", 3)
+    stale = QrJob.objects.filter(status=QrJob.RUNNING, started_at__lt=now - timeout)
+    failed = stale.filter(attempts__gte=max_attempts - 1).update(
+        status=QrJob.FAILED, attempts=F("attempts") + 1, finished_at=now, error="Timed out"
+    )
+    return failed + stale.update(
+        status=QrJob.PENDING, attempts=F("attempts") + 1, worker="", error="Timed out"
+    )
+
+
+def _finish(job, png=None, error=None):
+    job.attempts += 1
+    job.finished_at = timezone.now()
+    if error is None:
+        try:
+            if png is not None:
+                save_qr_code(job.short_url, job.target_url, png)
+            job.status = QrJob.DONE
+        except Exception as e:
+            error = e
+    if error is not None:
+        logger.warning("QR job %s failed: %s", job.pk, error)
+        job.error = str(error)
+        max_attempts = getattr(settings, "SHORTENER_QR_JOB_MAX_ATTEMPTS", 3)
+        job.status = QrJob.PENDING if job.attempts < max_attempts else QrJob.FAILED
+    job.save(update_fields=["status", "attempts", "error", "finished_at"])
+
+
+def run_jobs(jobs, executor=None):
+    """
+    Render claimed jobs and store the results
+
+    Jobs whose image is already stored are finished without rendering.
+    The rest are rendered as one batch (see qr_batch), in `executor` when
+    given (a process pool), inline otherwise, and stored in bulk from the
+    calling process.
+
+    Returns:
+        int: number of jobs processed
+    """
+    to_render = []
+    for job in jobs:
+        try:
+            stored = is_qr_current(job.short_url, job.target_url) or link_qr_code(job.short_url, job.target_url)
+        except Exception as e:
+            _finish(job, error=e)
+            continue
+        if stored:
+            _finish(job)
+        else:
+            to_render.append(job)
+
+    if not to_render:
+        return len(jobs)
+    try:
+        pngs = render_qr_batch([job.target_url for job in to_render], executor)
+    except Exception as e:
+        # A URL that cannot be encoded fails its whole chunk; find it
+        logger.warning("Batch QR render failed, rendering one by one: %s", e)
+        for job in to_render:
+            try:
+                png = render_qr_png(job.target_url)
+            except Exception as e:
+                _finish(job, error=e)
+            else:
+                _finish(job, png)
+        return len(jobs)
+
+    try:
+        with transaction.atomic():
+            save_qr_codes((job.short_url, job.target_url, png) for job, png in zip(to_render, pngs))
+    except Exception as e:
+        logger.warning("Bulk QR save failed, saving one by one: %s", e)
+        for job, png in zip(to_render, pngs):
+            _finish(job, png)
+        return len(jobs)
+
+    now = timezone.now()
+    for job in to_render:
+        job.attempts += 1
+        job.finished_at = now
+        job.status = QrJob.DONE
+    QrJob.objects.bulk_update(to_render, ["status", "attempts", "finished_at"])
+    return len(jobs)
+
+
+def run_worker(processes=None, batch_size=None, poll_interval=1.0, once=False):
+    """
+    Serve the queue until interrupted (or until it is empty with `once`)
+
+    Returns:
+        int: number of jobs processed
+    """
+    processes = processes or os.cpu_count() or 1
+    batch_size = batch_size or processes * 4 * QR_BATCH_CHUNK_SIZE
+    processed = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            reap_stale_jobs()
+            jobs = claim_jobs(batch_size)
+            processed += run_jobs(jobs, executor)
+            close_old_connections()
+            if not jobs:
+                if once:
+                    return processed
+                time.sleep(poll_interval)
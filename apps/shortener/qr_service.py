@@ -1,15 +1,277 @@
 import qrcode
+import hashlib
+from collections import Counter
 from io import BytesIO
 from django.core.files.base import ContentFile
 from django.utils import timezone
 from django.conf import settings
+import logging
 import os
 
+from .cache import LocalLRUCache
+from .models import ShortUrl, UserLinkStats
+
+logger = logging.getLogger(__name__)
+
+# Rendering parameters; every stored image is keyed by a hash of these
+# together with the encoded URL
+QR_ERROR_CORRECTION = "L"  # About 7% or less errors can be corrected
+QR_BOX_SIZE = 10  # Controls how many pixels each "box" of the QR code is
+QR_BORDER = 4  # Controls how many boxes thick the border should be
+QR_FORMAT = "png"
+
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+_image_cache = None
+
+
+def build_qr(data, error_correction=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """QRCode for `data`, grown to the smallest version that fits"""
+    # Create QR code instance
+    qr = qrcode.QRCode(
+        version=1,  # Grown to fit the data by make(fit=True)
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        box_size=box_size,
+        border=border,
+    )
+    
+    # Add data to QR code
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def _png_bytes(qr):
+    # Create QR code image
+    qr_image = qr.make_image(fill_color="black", back_color="white")
+    
+    # Save image to BytesIO
+    buffer = BytesIO()
+    qr_image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_qr_png(data, error_correction=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """
+    Render `data` as a QR code PNG
+
+    Pure function of its input (no DB, no storage), so it can run in a
+    worker process.
+
+    Args:
+        data: text to encode, normally the full short URL
+        error_correction: "L", "M", "Q" or "H"
+        box_size: pixels per module
+        border: quiet zone width in modules
+
+    Returns:
+        bytes: PNG image
+    """
+    return _png_bytes(build_qr(data, error_correction, box_size, border))
+
+
+def render_qr_svg(data, error_correction=QR_ERROR_CORRECTION, size=None, border=QR_BORDER):
+    """
+    Render `data` as an SVG QR code
+
+    Dark modules are drawn as one <path> with a subpath per horizontal run,
+    which is much cheaper than rasterising and encoding a PNG.
+
+    Args:
+        data: text to encode
+        error_correction: "L", "M", "Q" or "H"
+        size: width and height in pixels (default QR_BOX_SIZE per module)
+        border: quiet zone width in modules
+
+    Returns:
+        bytes: SVG document
+    """
+    matrix = build_qr(data, error_correction, border=border).get_matrix()
+    width = len(matrix)
+    size = size or width * QR_BOX_SIZE
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < width:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < width and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {width}" '
+        f'width="{size}" height="{size}" shape-rendering="crispEdges">'
+        f'<rect width="{width}" height="{width}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(runs)}"/></svg>'
+    ).encode("ascii")
+
+
+def render_qr(data, fmt=QR_FORMAT, error_correction=QR_ERROR_CORRECTION, size=None):
+    """
+    Render `data` as "png" or "svg", about `size` pixels wide
+
+    PNGs use a whole number of pixels per module, so they come out at most
+    `size` wide (and at least one pixel per module).
+
+    Returns:
+        bytes: image content
+    """
+    if fmt == "svg":
+        return render_qr_svg(data, error_correction, size)
+    qr = build_qr(data, error_correction)
+    if size:
+        qr.box_size = max(1, size // (qr.modules_count + 2 * QR_BORDER))
+    return _png_bytes(qr)
+
+
+def qr_content_key(data, error_correction=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER, fmt=QR_FORMAT):
+    """
+    Hash identifying the image rendered from `data` with these parameters
+
+    `box_size` is the requested pixel size for images from render_qr().
+    """
+    raw = "\0".join([data, error_correction, str(box_size), str(border), fmt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def qr_blob_name(data):
+    """
+    Storage name of the QR image for `data` with the default parameters
+
+    Images are content addressed, so the same URL always maps to the same
+    file and an existing file never needs to be rendered again.
+    """
+    key = qr_content_key(data)
+    return f"qr_codes/{key[:2]}/{key}.{QR_FORMAT}"
+
+
+def qr_storage():
+    return ShortUrl._meta.get_field("qr_code_image").storage
+
+
+def is_qr_current(short_url_instance, data):
+    """True if the link already shows the image for `data`"""
+    name = qr_blob_name(data)
+    return (
+        short_url_instance.has_qr_code
+        and short_url_instance.qr_code_image.name == name
+        and qr_storage().exists(name)
+    )
+
+
+def _attach_qr_blob(short_url_instance, name):
+    """Point a ShortUrl at a stored QR image, dropping the file it replaces"""
+    had_qr = short_url_instance.has_qr_code
+    old_name = short_url_instance.qr_code_image.name if short_url_instance.qr_code_image else None
+    
+    short_url_instance.qr_code_image.name = name
+    short_url_instance.qr_code_generated_at = timezone.now()
+    short_url_instance.save(update_fields=['qr_code_image', 'qr_code_generated_at'])
+    
+    # Blob names embed the full short URL, so no other link can share the
+    # old file
+    if old_name and old_name != name:
+        qr_storage().delete(old_name)
+    if not had_qr:
+        UserLinkStats.objects.record_qr_change(short_url_instance.user_id, 1)
+
+
+def link_qr_code(short_url_instance, data):
+    """
+    Reuse an already stored image for `data`, if there is one
+
+    Returns:
+        bool: True if the link now points at a stored image
+    """
+    name = qr_blob_name(data)
+    if not qr_storage().exists(name):
+        return False
+    if short_url_instance.qr_code_image.name != name or not short_url_instance.has_qr_code:
+        _attach_qr_blob(short_url_instance, name)
+    return True
+
+
+def _store_blob(storage, name, png):
+    """
+    Write `png` under its content-addressed `name` unless it is already stored
+
+    When a concurrent writer wins the race the storage saves our copy
+    under an alternate name; that copy is dropped, since the blob already
+    stored under `name` has the same content.
+    """
+    if storage.exists(name):
+        return name
+    saved = storage.save(name, ContentFile(png))
+    if saved != name:
+        storage.delete(saved)
+    return name
+
+
+def save_qr_code(short_url_instance, data, png):
+    """
+    Store a rendered QR code PNG on a ShortUrl, replacing any previous one
+    
+    Args:
+        short_url_instance: ShortUrl model instance
+        data: the text the PNG encodes
+        png: PNG bytes from render_qr_png()
+    """
+    name = _store_blob(qr_storage(), qr_blob_name(data), png)
+    _attach_qr_blob(short_url_instance, name)
+    # A fresh QR code is usually viewed or downloaded right away
+    _image_lru().set(name, png)
+
+
+def save_qr_codes(rendered):
+    """
+    Store many rendered QR codes at once
+
+    Like save_qr_code() for each item, but the links are updated with one
+    bulk_update and the stats with one increment per user.
+
+    Args:
+        rendered: iterable of (short_url_instance, data, png)
+    """
+    storage = qr_storage()
+    cache = _image_lru()
+    now = timezone.now()
+    links = []
+    replaced = []
+    new_qr = Counter()
+    for short_url_instance, data, png in rendered:
+        name = _store_blob(storage, qr_blob_name(data), png)
+        cache.set(name, png)
+        old_name = short_url_instance.qr_code_image.name if short_url_instance.qr_code_image else None
+        if old_name and old_name != name:
+            replaced.append(old_name)
+        if not short_url_instance.has_qr_code:
+            new_qr[short_url_instance.user_id] += 1
+        short_url_instance.qr_code_image.name = name
+        short_url_instance.qr_code_generated_at = now
+        links.append(short_url_instance)
+
+    ShortUrl.objects.bulk_update(links, ["qr_code_image", "qr_code_generated_at"], batch_size=500)
+    for name in replaced:
+        storage.delete(name)
+    for user_id, count in new_qr.items():
+        UserLinkStats.objects.record_qr_change(user_id, count)
+
 
 def generate_qr_code(short_url_instance, request=None):
     """
     Generate QR code for a ShortUrl instance
     
+    Renders only when no image for the link's full URL is stored yet;
+    otherwise the stored image is reused, and a link that already shows
+    it is left untouched.
+    
     Args:
         short_url_instance: ShortUrl model instance
         request: Django request object to build full URL
@@ -18,56 +280,56 @@ def generate_qr_code(short_url_instance, request=None):
         bool: True if successful, False otherwise
     """
     try:
-        # Build the full short URL
-        if request:
-            full_url = request.build_absolute_uri(f'/{short_url_instance.short_code}/')
-        else:
-            # Fallback if no request object
-            domain = getattr(settings, 'SITE_DOMAIN', 'localhost:8000')
-            protocol = 'https' if getattr(settings, 'USE_HTTPS', False) else 'http'
-            full_url = f"{protocol}://{domain}/{short_url_instance.short_code}/"
-        
-        # Create QR code instance
-        qr = qrcode.QRCode(
-            version=1,  # Controls the size of the QR Code
-            error_correction=qrcode.constants.ERROR_CORRECT_L,  # About 7% or less errors can be corrected
-            box_size=10,  # Controls how many pixels each "box" of the QR code is
-            border=4,  # Controls how many boxes thick the border should be
-        )
-        
-        # Add data to QR code
-        qr.add_data(full_url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save image to BytesIO
-        buffer = BytesIO()
-        qr_image.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        # Generate filename
-        filename = f"qr_{short_url_instance.short_code}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.png"
-        
-        # Save to model
-        short_url_instance.qr_code_image.save(
-            filename,
-            ContentFile(buffer.getvalue()),
-            save=False
-        )
-        
-        # Update generation timestamp
-        short_url_instance.qr_code_generated_at = timezone.now()
-        short_url_instance.save(update_fields=['qr_code_image', 'qr_code_generated_at'])
-        
+        data = get_full_short_url(short_url_instance, request)
+        if is_qr_current(short_url_instance, data) or link_qr_code(short_url_instance, data):
+            return True
+        save_qr_code(short_url_instance, data, render_qr_png(data))
         return True
         
-    except Exception as e:
-        print(f"Error generating QR code: {e}")
+    except Exception:
+        logger.exception("Error generating QR code for %s", short_url_instance.short_code)
         return False
 
 
+def _image_lru():
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = LocalLRUCache(
+            maxsize=getattr(settings, "SHORTENER_QR_IMAGE_CACHE_SIZE", 1000),
+            ttl=getattr(settings, "SHORTENER_QR_IMAGE_CACHE_TTL", 3600),
+        )
+    return _image_cache
+
+
+def cached_qr_image(name):
+    """
+    Bytes of a stored QR image if it was generated recently
+
+    Stored images never change (a new image gets a new name), so cached
+    bytes never go stale.
+
+    Returns:
+        bytes, or None on a miss
+    """
+    return _image_lru().get(name)
+
+
+def qr_image_cache_stats():
+    """Hit/miss counters of this process's QR image LRU"""
+    cache = _image_lru()
+    return {"hits": cache.hits, "misses": cache.misses, "size": len(cache)}
+
+
+def rendered_qr_bytes(key, data, fmt, error_correction, size):
+    """render_qr() through the same LRU, keyed by qr_content_key()"""
+    cache = _image_lru()
+    content = cache.get(key)
+    if content is None:
+        content = render_qr(data, fmt, error_correction, size)
+        cache.set(key, content)
+    return content
+
+
 def get_full_short_url(short_url_instance, request=None):
     """
     Get the full URL for a short code
@@ -97,6 +359,7 @@ def delete_qr_code_file(short_url_instance):
     """
     try:
         if short_url_instance.qr_code_image:
+            had_qr = short_url_instance.has_qr_code
             # Delete the file from storage
             if os.path.isfile(short_url_instance.qr_code_image.path):
                 os.remove(short_url_instance.qr_code_image.path)
@@ -105,16 +368,21 @@ def delete_qr_code_file(short_url_instance):
             short_url_instance.qr_code_image = None
             short_url_instance.qr_code_generated_at = None
             short_url_instance.save(update_fields=['qr_code_image', 'qr_code_generated_at'])
+            if had_qr:
+                UserLinkStats.objects.record_qr_change(short_url_instance.user_id, -1)
             
         return True
-    except Exception as e:
-        print(f"Error deleting QR code file: {e}")
+    except Exception:
+        logger.exception("Error deleting QR code file of %s", short_url_instance.short_code)
         return False
 
 
 def regenerate_qr_code(short_url_instance, request=None):
     """
-    Regenerate QR code for a ShortUrl instance (delete old one and create new)
+    Regenerate QR code for a ShortUrl instance
+    
+    A no-op when the stored image already matches the link's full URL and
+    rendering parameters.
     
     Args:
         short_url_instance: ShortUrl model instance
@@ -123,8 +391,4 @@ def regenerate_qr_code(short_url_instance, request=None):
     Returns:
         bool: True if successful, False otherwise
     """
-    # Delete existing QR code
-    delete_qr_code_file(short_url_instance)
-    
-    # Generate new QR code
-    return generate_qr_code(short_url_instance, request)
\ No newline at end of file
+    return generate_qr_code(short_url_instance, request)
@@ -0,0 +1,129 @@
+"""
+Read replica routing.
+
+Writes always go to the primary ("default"). Reads go to a random alias
+in SHORTENER_READ_REPLICAS only inside replica_reads() (or a view wrapped
+in read_from_replicas), which the redirect lookup and the dashboard use;
+every other read stays on the primary. Reads fall back to the primary:
+
+- inside a transaction on the primary
+- once the current request has written anything
+- for SHORTENER_REPLICA_PIN_SECONDS after a request that wrote, via a
+  cookie set by ReplicaPinMiddleware, so users see their own changes
+  while the replicas catch up
+"""
+import functools
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = "shortener_primary"
+
+_replica_reads = ContextVar("shortener_replica_reads", default=False)
+# {"pinned": bool, "wrote": bool} for the current request
+_request_state = ContextVar("shortener_replica_state", default=None)
+
+
+def replica_aliases():
+    return getattr(settings, "SHORTENER_READ_REPLICAS", ())
+
+
+@contextmanager
+def replica_reads():
+    """Let reads in this block go to a replica"""
+    reads = _replica_reads.set(True)
+    state = None
+    if _request_state.get() is None:
+        # Outside a request, still stop using replicas after a write
+        state = _request_state.set({"pinned": False, "wrote": False})
+    try:
+        yield
+    finally:
+        if state is not None:
+            _request_state.reset(state)
+        _replica_reads.reset(reads)
+
+
+def read_from_replicas(view):
+    """Run a view inside replica_reads()"""
+    if iscoroutinefunction(view):
+        async def wrapper(request, *args, **kwargs):
+            with replica_reads():
+                return await view(request, *args, **kwargs)
+    else:
+        def wrapper(request, *args, **kwargs):
+            with replica_reads():
+                return view(request, *args, **kwargs)
+    return functools.wraps(view)(wrapper)
+
+
+def using_replica():
+    """True if reads issued now would be routed to a replica"""
+    return ReplicaRouter().db_for_read(None) is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        aliases = replica_aliases()
+        if not aliases:
+            return None
+        state = _request_state.get()
+        if state is not None and (state["pinned"] or state["wrote"]):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state["wrote"] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
+
+
+@sync_and_async_middleware
+def ReplicaPinMiddleware(get_response):
+    """Keep a client on the primary for a while after it wrote"""
+
+    def pin(request, response, state):
+        if state["wrote"] and replica_aliases():
+            seconds = getattr(settings, "SHORTENER_REPLICA_PIN_SECONDS", 15)
+            response.set_cookie(PIN_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax")
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = {"pinned": PIN_COOKIE in request.COOKIES, "wrote": False}
+            token = _request_state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _request_state.reset(token)
+            return pin(request, response, state)
+    else:
+        def middleware(request):
+            state = {"pinned": PIN_COOKIE in request.COOKIES, "wrote": False}
+            token = _request_state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _request_state.reset(token)
+            return pin(request, response, state)
+
+    return middleware
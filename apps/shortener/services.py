@@ -1,15 +1,271 @@
-import random
-import string
-from .models import ShortUrl
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .bloom import short_code_filter
+from .cache import NOT_FOUND, RedirectTarget, redirect_cache
+from .code_pool import code_pool
+from .hot_links import hot_links
+from .models import ClickBucket, ShortUrl
+from .replicas import replica_reads, using_replica
+from .snapshot import load_snapshot
 
+# Retries when a generated code clashes with an existing custom code
+MAX_CREATE_ATTEMPTS = 5
 
-def generate_short_code(length=6):
-    characters = string.ascii_letters + string.digits
-    return "".join(random.choices(characters, k=length))
+# Keep IN (...) lists well below SQLite's parameter limit
+WARM_CHUNK_SIZE = 500
 
+# Process warmed by warm_redirect_cache_on_start()
+_warmed_pid = None
 
-def generate_unique_short_code(length=6):
-    while True:
-        code = generate_short_code(length)
-        if not ShortUrl.objects.filter(short_code=code).exists():
-            return code
+
+def allocate_short_code():
+    return code_pool.take()
+
+
+def shorten_url(user, original_url, expires_at=None, custom_code=None):
+    """
+    Create a ShortUrl, allocating a short code unless a custom one is given
+
+    Args:
+        user: owner of the link
+        original_url: destination URL
+        expires_at: optional expiry datetime
+        custom_code: user-chosen short code
+
+    Returns:
+        ShortUrl: the created instance
+
+    Raises:
+        IntegrityError: if `custom_code` is already taken
+    """
+    attempts = 1 if custom_code else MAX_CREATE_ATTEMPTS
+    for attempt in range(attempts):
+        short_code = custom_code or allocate_short_code()
+        try:
+            with transaction.atomic():
+                return ShortUrl.objects.create(
+                    user=user,
+                    original_url=original_url,
+                    short_code=short_code,
+                    expires_at=expires_at,
+                )
+        except IntegrityError:
+            # A generated code can only clash with an earlier custom code
+            if attempt == attempts - 1:
+                raise
+
+
+def expire_due_links(batch_size=1000, now=None):
+    """
+    Deactivate up to `batch_size` links whose expires_at has passed
+
+    Each call is one short transaction touching at most `batch_size` rows,
+    found through the partial (is_active, expires_at) index.
+
+    Returns:
+        int: number of links deactivated
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = list(
+            ShortUrl.objects
+            .filter(is_active=True, expires_at__isnull=False, expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not due:
+            return 0
+        # Invalidates the redirect cache (ShortUrlQuerySet.update)
+        ShortUrl.objects.filter(pk__in=due).update(is_active=False)
+    return len(due)
+
+
+def get_redirect_target(short_code):
+    """
+    Resolve a short code through the redirect cache, falling back to the DB
+
+    Codes the Bloom filter has never seen are rejected without a query, and
+    DB misses are cached briefly as NOT_FOUND. Concurrent misses on the
+    same code in this process share one query.
+
+    Args:
+        short_code: the code taken from the request path
+
+    Returns:
+        RedirectTarget, or NOT_FOUND if the code does not exist
+    """
+    target = redirect_cache.get(short_code)
+    if target is not None:
+        return target
+
+    if not short_code_filter.might_exist(short_code):
+        return NOT_FOUND
+
+    return redirect_cache.loads.do(short_code, lambda: load_redirect_target(short_code))
+
+
+def load_redirect_target(short_code):
+    """Read a short code's RedirectTarget from the DB and cache it"""
+    lookup = ShortUrl.objects.filter(short_code=short_code).values_list(
+        *RedirectTarget._fields
+    )
+    with replica_reads():
+        row = lookup.first()
+        # A replica may not have a just-created link yet; confirm misses on
+        # the primary before caching NOT_FOUND
+        if row is None and using_replica():
+            row = lookup.using(DEFAULT_DB_ALIAS).first()
+    target = RedirectTarget(*row) if row is not None else NOT_FOUND
+    redirect_cache.set(short_code, target)
+    return target
+
+
+async def aget_redirect_target(short_code):
+    """Async version of get_redirect_target() for the ASGI redirect view"""
+    target = await redirect_cache.aget(short_code)
+    if target is not None:
+        return target
+
+    if not await short_code_filter.amight_exist(short_code):
+        return NOT_FOUND
+
+    return await redirect_cache.aloads.do(short_code, lambda: aload_redirect_target(short_code))
+
+
+async def aload_redirect_target(short_code):
+    """Async version of load_redirect_target()"""
+    lookup = ShortUrl.objects.filter(short_code=short_code).values_list(
+        *RedirectTarget._fields
+    )
+    with replica_reads():
+        row = await lookup.afirst()
+        if row is None and using_replica():
+            row = await lookup.using(DEFAULT_DB_ALIAS).afirst()
+    target = RedirectTarget(*row) if row is not None else NOT_FOUND
+
+    await redirect_cache.aset(short_code, target)
+    return target
+
+
+def warm_redirect_cache(short_codes):
+    """
+    Load the redirect targets of `short_codes` into the redirect cache
+
+    Returns:
+        int: number of targets cached
+    """
+    short_codes = list(short_codes)
+    warmed = 0
+    for i in range(0, len(short_codes), WARM_CHUNK_SIZE):
+        rows = (
+            ShortUrl.objects
+            .filter(short_code__in=short_codes[i:i + WARM_CHUNK_SIZE])
+            .values_list("short_code", *RedirectTarget._fields)
+        )
+        for short_code, *target in rows:
+            redirect_cache.set(short_code, RedirectTarget(*target))
+            warmed += 1
+    return warmed
+
+
+def hot_short_codes(limit):
+    """
+    The most clicked short codes of the last hour
+
+    Uses the heavy-hitters tracker when workers have published to it, and
+    the minute click buckets after a restart, when nobody has yet.
+    """
+    codes = [short_code for short_code, _, _ in hot_links.top("1h", limit)]
+    if codes:
+        return codes
+    since = timezone.now() - timedelta(hours=1)
+    return list(
+        ClickBucket.objects
+        .filter(granularity="minute", bucket_start__gte=since)
+        .values("short_url__short_code")
+        .annotate(total=Sum("clicks"))
+        .order_by("-total")
+        .values_list("short_url__short_code", flat=True)[:limit]
+    )
+
+
+def warm_hot_links(limit=None, snapshot=None):
+    """
+    Pre-warm the redirect cache with the currently hot links
+
+    Codes found in `snapshot` go to the local tier without a query; the
+    rest are read from the DB.
+    """
+    if limit is None:
+        limit = getattr(settings, "SHORTENER_HOT_LINKS_WARM_COUNT", 500)
+    if limit <= 0:
+        return 0
+    codes = hot_short_codes(limit)
+    if snapshot is None:
+        return warm_redirect_cache(codes)
+
+    ttl = snapshot_local_ttl()
+    missing = []
+    for short_code in codes:
+        target = snapshot.get(short_code)
+        if target is None:
+            missing.append(short_code)
+        else:
+            redirect_cache.set_local(short_code, target, ttl)
+    return len(codes) - len(missing) + warm_redirect_cache(missing)
+
+
+def snapshot_local_ttl():
+    """
+    Local TTL of entries loaded from the snapshot
+
+    Longer than the usual local TTL, so a freshly started worker is not
+    back to querying every popular code after a few seconds.
+    """
+    return getattr(settings, "SHORTENER_REDIRECT_SNAPSHOT_LOCAL_TTL", 300)
+
+
+def warm_from_snapshot(snapshot):
+    """
+    Load a snapshot's most clicked links into the local redirect cache
+
+    Fills at most the local tier's capacity, leaving room for the hot
+    links, which are loaded last.
+
+    Returns:
+        int: number of targets cached
+    """
+    limit = max(0, redirect_cache.local.maxsize - getattr(settings, "SHORTENER_HOT_LINKS_WARM_COUNT", 500))
+    ttl = snapshot_local_ttl()
+    # Least clicked first, so the most clicked are evicted last
+    entries = snapshot.top(limit)
+    for short_code, target in reversed(entries):
+        redirect_cache.set_local(short_code, target, ttl)
+    return len(entries)
+
+
+def warm_redirect_cache_on_start():
+    """
+    Warm a starting worker: the snapshot first, then the hot links
+
+    Runs once per process, from gunicorn's post_worker_init or from
+    config.asgi for ASGI servers without that hook (uvicorn).
+
+    Returns:
+        int: number of targets cached
+    """
+    global _warmed_pid
+    if _warmed_pid == os.getpid():
+        return 0
+    _warmed_pid = os.getpid()
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return warm_hot_links()
+    try:
+        return warm_from_snapshot(snapshot) + warm_hot_links(snapshot=snapshot)
+    finally:
+        snapshot.close()
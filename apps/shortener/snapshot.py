@@ -0,0 +1,172 @@
+"""
+On-disk snapshot of the most clicked live links, for warming workers.
+
+`manage.py build_redirect_snapshot` (run periodically, e.g. from cron)
+writes the redirect targets of the top SHORTENER_REDIRECT_SNAPSHOT_SIZE
+links by click count to one file:
+
+    header   magic, version, record count, build time, code width
+    records  fixed-size, sorted by short code: code, redirect type,
+             cache max-age, expiry, click count, URL offset and length
+    urls     UTF-8 destination URLs
+
+A starting worker maps the file read-only and loads it into its local
+redirect cache without a query. Lookups of single codes (the hot codes a
+worker warms first) binary-search the records in place, and ranking by
+clicks reads only the click counts.
+"""
+import heapq
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from .cache import RedirectTarget
+from .models import ShortUrl
+
+MAGIC = b"SHRTSNAP"
+VERSION = 2
+HEADER = struct.Struct("<8sIIdI")
+# Bytes per code: room for any ShortUrl.short_code in UTF-8
+CODE_SIZE = ShortUrl._meta.get_field("short_code").max_length * 4
+# code, redirect type, cache max-age (-1: none), expires_at (NaN: none),
+# click count, URL offset, URL length
+RECORD = struct.Struct(f"<{CODE_SIZE}sHidIQI")
+CLICKS = struct.Struct("<I")
+CLICKS_OFFSET = struct.calcsize(f"<{CODE_SIZE}sHid")
+
+
+def snapshot_path():
+    return Path(getattr(settings, "SHORTENER_REDIRECT_SNAPSHOT", "") or settings.BASE_DIR / "redirect_snapshot.bin")
+
+
+def write_snapshot(path, rows):
+    """
+    Write a snapshot atomically (readers see the old or the new file)
+
+    Args:
+        path: destination file
+        rows: (short_code, RedirectTarget, click count) of live links
+
+    Returns:
+        int: number of links written
+    """
+    entries = sorted(
+        ((short_code.encode("utf-8"), target, clicks) for short_code, target, clicks in rows),
+        key=lambda entry: entry[0],
+    )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(entries), time.time(), CODE_SIZE))
+            offset = HEADER.size + RECORD.size * len(entries)
+            urls = []
+            for code, target, clicks in entries:
+                url = target.original_url.encode("utf-8")
+                expires = target.expires_at.timestamp() if target.expires_at else math.nan
+                max_age = -1 if target.cache_max_age is None else target.cache_max_age
+                f.write(RECORD.pack(code, target.redirect_type, max_age, expires, clicks, offset, len(url)))
+                urls.append(url)
+                offset += len(url)
+            for url in urls:
+                f.write(url)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(entries)
+
+
+class Snapshot:
+    """Read-only view of a snapshot file"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.created, code_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or code_size != CODE_SIZE:
+            # Also rebuilt when short_code's max_length changes
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} redirect snapshot with {CODE_SIZE}-byte codes")
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def age(self):
+        return time.time() - self.created
+
+    def _code(self, index):
+        start = HEADER.size + index * RECORD.size
+        return self._map[start:start + CODE_SIZE]
+
+    def _entry(self, index):
+        code, redirect_type, max_age, expires, clicks, offset, length = RECORD.unpack_from(
+            self._map, HEADER.size + index * RECORD.size
+        )
+        target = RedirectTarget(
+            self._map[offset:offset + length].decode("utf-8"),
+            True,
+            None if math.isnan(expires) else datetime.fromtimestamp(expires, timezone.utc),
+            redirect_type,
+            None if max_age < 0 else max_age,
+        )
+        return code.rstrip(b"\0").decode("utf-8"), target, clicks
+
+    def get(self, short_code):
+        """
+        Binary-search the records for one short code
+
+        Returns:
+            RedirectTarget, or None if the code is not in the snapshot
+        """
+        key = short_code.encode("utf-8").ljust(CODE_SIZE, b"\0")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._code(lo) == key:
+            return self._entry(lo)[1]
+        return None
+
+    def _clicks(self, index):
+        return CLICKS.unpack_from(self._map, HEADER.size + index * RECORD.size + CLICKS_OFFSET)[0]
+
+    def top(self, limit):
+        """The `limit` most clicked (short_code, RedirectTarget), most clicked first"""
+        indexes = heapq.nlargest(limit, range(self.count), key=self._clicks)
+        return [self._entry(i)[:2] for i in indexes]
+
+    def close(self):
+        self._map.close()
+
+
+def load_snapshot(path=None):
+    """
+    The current snapshot, or None if there is none or it is too old
+
+    Links edited after the snapshot was built keep their old target in a
+    warmed worker for at most SHORTENER_REDIRECT_SNAPSHOT_LOCAL_TTL;
+    SHORTENER_REDIRECT_SNAPSHOT_MAX_AGE bounds how stale a snapshot may be
+    at all.
+    """
+    try:
+        snapshot = Snapshot(path or snapshot_path())
+    except (OSError, ValueError, struct.error):
+        return None
+    if snapshot.age > getattr(settings, "SHORTENER_REDIRECT_SNAPSHOT_MAX_AGE", 3600):
+        snapshot.close()
+        return None
+    return snapshot
@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import gc
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import services
+from .analytics import DAY, HOUR, MINUTE, bucket_start, compact_click_buckets
+from .benchmarks import compare_results, percentile, summarize
+from .bloom import BloomFilter, ShortCodeFilter
+from .bulk import bulk_shorten
+from .cache import NOT_FOUND, RedirectTarget, redirect_cache
+from .click_buffer import ClickBuffer
+from .edge_logs import count_edge_clicks
+from .code_pool import CODE_SPACE, CodePool, sequence_to_short_code
+from .downloads import parse_byte_range
+from .events import ClickEventLog, hash_ip, purge_click_events
+from .fastpath import FastRedirectASGI, FastRedirectWSGI
+from .hot_links import HotLinkTracker, SpaceSaving
+from .logs import JsonFormatter, QueueLogHandler, RequestIdFilter, RequestIdMiddleware
+from .metrics import LATENCY, LATENCY_BUCKETS, REQUESTS, Metrics, registry
+from .models import ClickBucket, ClickEvent, QrJob, ShortCodeLease, ShortUrl, UserLinkStats
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .qr_batch import render_qr_batch
+from .qr_jobs import claim_jobs, enqueue_qr_job, enqueue_qr_jobs, reap_stale_jobs, run_jobs
+from .qr_service import (
+    delete_qr_code_file, generate_qr_code, get_full_short_url, is_qr_current, qr_blob_name, qr_storage,
+    render_qr_png, save_qr_code,
+)
+from .replicas import PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, read_from_replicas, replica_reads, using_replica
+from .snapshot import Snapshot, load_snapshot, write_snapshot
+
+
+def use_shared_cache(testcase):
+    """Switch the default cache to a backend shared between processes for one test"""
+    directory = testcase.enterContext(tempfile.TemporaryDirectory())
+    testcase.enterContext(override_settings(CACHES={"default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": directory,
+    }}))
+
+
+def use_temp_media(testcase):
+    """Store uploaded and generated files in a temporary MEDIA_ROOT for one test"""
+    testcase.enterContext(override_settings(MEDIA_ROOT=testcase.enterContext(tempfile.TemporaryDirectory())))
+
+
+def use_empty_redirect_cache(testcase):
+    """Start one test with an empty in-process redirect cache and leave it empty"""
+    redirect_cache.clear_local()
+    testcase.addCleanup(redirect_cache.clear_local)
+
+
+def without_background_refill(testcase):
+    """Keep the code pool from refilling in a thread, which SQLite test DBs cannot take"""
+    testcase.enterContext(mock.patch.object(services.code_pool, "_ensure_thread"))
+
+
+class QrServiceTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.user = User.objects.create_user("qr", password="pw")
+        self.short_url = ShortUrl.objects.create(
+            user=self.user, original_url="https://example.com/", short_code="qrtest1"
+        )
+
+    def test_generate_failure_returns_false(self):
+        with mock.patch("apps.shortener.qr_service.render_qr_png", side_effect=RuntimeError("boom")):
+            with self.assertLogs("apps.shortener.qr_service", "ERROR"):
+                self.assertFalse(generate_qr_code(self.short_url))
+        self.short_url.refresh_from_db()
+        self.assertFalse(self.short_url.qr_code_image)
+
+    def test_delete_failure_returns_false(self):
+        self.assertTrue(generate_qr_code(self.short_url))
+        with mock.patch("apps.shortener.qr_service.os.remove", side_effect=OSError("busy")):
+            with self.assertLogs("apps.shortener.qr_service", "ERROR"):
+                self.assertFalse(delete_qr_code_file(self.short_url))
+
+    def test_lost_write_race_keeps_content_name(self):
+        data = get_full_short_url(self.short_url)
+        png = render_qr_png(data)
+        name = qr_blob_name(data)
+        storage = qr_storage()
+        storage.save(name, ContentFile(png))
+        # Another worker stored the blob between our exists() check and save()
+        real_exists = FileSystemStorage.exists
+        stale_checks = [False]
+
+        def exists(storage, name):
+            return stale_checks.pop() if stale_checks else real_exists(storage, name)
+
+        with mock.patch.object(FileSystemStorage, "exists", autospec=True, side_effect=exists):
+            save_qr_code(self.short_url, data, png)
+        self.short_url.refresh_from_db()
+        self.assertEqual(self.short_url.qr_code_image.name, name)
+        self.assertTrue(is_qr_current(self.short_url, data))
+        self.assertEqual(storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+
+
+@override_settings(SHORTENER_QR_JOB_TIMEOUT=60, SHORTENER_QR_JOB_MAX_ATTEMPTS=2)
+class QrJobQueueTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.user = User.objects.create_user("qrjobs", password="pw")
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="qrjob1")
+        self.target_url = "http://localhost:8000/qrjob1/"
+
+    def _claim_and_crash(self, now):
+        """Claim the job and let its worker die without finishing it"""
+        (job,) = claim_jobs(10)
+        QrJob.objects.filter(pk=job.pk).update(started_at=now - timedelta(seconds=61))
+        return reap_stale_jobs(now)
+
+    def test_enqueue_claim_and_run(self):
+        job = enqueue_qr_job(self.short_url, self.target_url)
+        self.assertEqual(enqueue_qr_job(self.short_url, self.target_url).pk, job.pk)
+        (claimed,) = claim_jobs(10)
+        self.assertEqual((claimed.pk, claimed.status), (job.pk, QrJob.RUNNING))
+        self.assertEqual(claim_jobs(10), [])
+
+        self.assertEqual(run_jobs([claimed]), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (QrJob.DONE, 1))
+        self.short_url.refresh_from_db()
+        self.assertTrue(is_qr_current(self.short_url, self.target_url))
+
+    @override_settings(SHORTENER_QR_ASYNC=False)
+    def test_synchronous_bulk_enqueue(self):
+        queued = enqueue_qr_jobs(ShortUrl.objects.filter(user=self.user), lambda code: f"http://localhost:8000/{code}/")
+        self.assertEqual(queued, 1)
+        self.assertEqual(QrJob.objects.get().status, QrJob.DONE)
+
+    def test_crashed_job_is_requeued_as_an_attempt(self):
+        job = enqueue_qr_job(self.short_url, self.target_url)
+        now = timezone.now()
+        # Still within the timeout: left alone
+        claim_jobs(10)
+        self.assertEqual(reap_stale_jobs(now), 0)
+        QrJob.objects.filter(pk=job.pk).update(status=QrJob.PENDING)
+
+        self.assertEqual(self._claim_and_crash(now), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.worker), (QrJob.PENDING, 1, ""))
+
+    def test_job_that_keeps_crashing_fails_at_the_limit(self):
+        job = enqueue_qr_job(self.short_url, self.target_url)
+        now = timezone.now()
+        self._claim_and_crash(now)
+        self._claim_and_crash(now)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (QrJob.FAILED, 2))
+        self.assertEqual(claim_jobs(10), [])
+
+
+class BloomFilterTests(TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        codes = [f"code{i}" for i in range(1000)]
+        for code in codes:
+            bloom.add(code)
+        self.assertTrue(all(code in bloom for code in codes))
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class ShortCodeFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("bloom", password="pw")
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="exists1")
+
+    def _started(self):
+        """A filter built synchronously, as the background thread would"""
+        short_code_filter = ShortCodeFilter()
+        short_code_filter._pid = os.getpid()
+        short_code_filter.build()
+        return short_code_filter
+
+    @override_settings(SHORTENER_BLOOM_ENABLED=True)
+    def test_disabled_without_shared_cache(self):
+        short_code_filter = ShortCodeFilter()
+        with self.assertLogs("apps.shortener.bloom", "WARNING"):
+            self.assertTrue(short_code_filter.might_exist("unknown"))
+        self.assertIsNone(short_code_filter._thread)
+        self.assertEqual(short_code_filter.rejected, 0)
+
+    @override_settings(SHORTENER_BLOOM_ENABLED=True)
+    def test_new_codes_pass_other_workers(self):
+        use_shared_cache(self)
+        worker_a, worker_b = self._started(), self._started()
+        self.assertTrue(worker_b.might_exist("exists1"))
+        self.assertFalse(worker_b.might_exist("created1"))
+
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="created1")
+        worker_a.add("created1")
+        self.assertTrue(worker_b.might_exist("created1"))
+
+
+class DedupeShortCodesMigrationTests(TransactionTestCase):
+    before = [("shortener", "0004_shorturl_qr_code_generated_at_shorturl_qr_code_image")]
+    after = [("shortener", "0005_shorturl_short_code_unique")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_get_fresh_codes(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        OldShortUrl = old_apps.get_model("shortener", "ShortUrl")
+        user = old_apps.get_model("auth", "User").objects.create(username="dupes")
+        oldest = OldShortUrl.objects.create(user=user, original_url="https://a.example/", short_code="dup123")
+        for url in ("https://b.example/", "https://c.example/"):
+            OldShortUrl.objects.create(user=user, original_url=url, short_code="dup123")
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        new_apps = executor.loader.project_state(self.after).apps
+        links = new_apps.get_model("shortener", "ShortUrl").objects.order_by("id")
+        codes = [link.short_code for link in links]
+        self.assertEqual(len(set(codes)), 3)
+        self.assertEqual(links.get(short_code="dup123").pk, oldest.pk)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "snapshot.bin")
+        self.rows = [
+            (f"c{i:04d}", RedirectTarget(f"https://example.com/{i}", True, None, 301 if i % 2 else 302, i), i)
+            for i in range(200)
+        ]
+        # Written out of order; the file is sorted by code
+        self.assertEqual(write_snapshot(self.path, reversed(self.rows)), 200)
+        use_empty_redirect_cache(self)
+
+    def test_get_binary_searches_every_code(self):
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(len(snapshot), 200)
+        for short_code, target, _ in self.rows:
+            self.assertEqual(snapshot.get(short_code), target)
+        for missing in ("", "c", "c00000", "c9999", "zzzz"):
+            self.assertIsNone(snapshot.get(missing))
+
+    def test_top_orders_by_clicks(self):
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual([code for code, _ in snapshot.top(3)], ["c0199", "c0198", "c0197"])
+
+    def test_longest_codes_fit(self):
+        short_code = "ñ" * ShortUrl._meta.get_field("short_code").max_length
+        target = RedirectTarget("https://example.com/ñ", True, None, 302, None)
+        self.assertEqual(write_snapshot(self.path, [(short_code, target, 1)]), 1)
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(snapshot.get(short_code), target)
+
+    @override_settings(SHORTENER_REDIRECT_SNAPSHOT_MAX_AGE=-1)
+    def test_stale_snapshot_ignored(self):
+        self.assertIsNone(load_snapshot(self.path))
+
+    @override_settings(SHORTENER_REDIRECT_SNAPSHOT_LOCAL_TTL=300, SHORTENER_HOT_LINKS_WARM_COUNT=0)
+    def test_warmed_entries_outlive_local_ttl(self):
+        snapshot = load_snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        self.assertEqual(services.warm_from_snapshot(snapshot), 200)
+        with mock.patch("apps.shortener.cache.time.monotonic", return_value=time.monotonic() + 60):
+            self.assertEqual(redirect_cache.get("c0199"), self.rows[199][1])
+
+    @override_settings(SHORTENER_HOT_LINKS_WARM_COUNT=0)
+    def test_warm_on_start_once_per_process(self):
+        with override_settings(SHORTENER_REDIRECT_SNAPSHOT=self.path), \
+                mock.patch.object(services, "_warmed_pid", None):
+            self.assertEqual(services.warm_redirect_cache_on_start(), 200)
+            self.assertEqual(services.warm_redirect_cache_on_start(), 0)
+
+
+class BenchmarkHelperTests(TestCase):
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summarize(self):
+        summary = summarize([0.002, 0.001, 0.003, 0.004], 2.0)
+        self.assertEqual(summary["requests"], 4)
+        self.assertEqual(summary["rps"], 2.0)
+        self.assertEqual(summary["p50_ms"], 2.0)
+        self.assertEqual(summary["p99_ms"], 4.0)
+
+    def test_compare_results_flags_regressions(self):
+        baseline = {"redirect": {"p99_ms": 10.0, "rps": 1000.0}, "dashboard": {"p99_ms": 50.0, "rps": 100.0}}
+        current = {"redirect": {"p99_ms": 12.0, "rps": 950.0}, "dashboard": {"p99_ms": 40.0, "rps": 100.0}}
+        rows = {(scenario, metric): regressed for scenario, metric, *_, regressed in compare_results(baseline, current, 0.1, 0.1)}
+        self.assertEqual(rows, {
+            ("dashboard", "p99_ms"): False,
+            ("dashboard", "rps"): False,
+            ("redirect", "p99_ms"): True,
+            ("redirect", "rps"): False,
+        })
+
+
+class ShortCodeAllocatorTests(TestCase):
+    def test_sequence_mapping_is_a_bijection(self):
+        codes = [sequence_to_short_code(value) for value in range(50000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == 6 for code in codes))
+        self.assertEqual(len(sequence_to_short_code(CODE_SPACE)), 7)
+
+    def test_shorten_url_allocates_distinct_codes(self):
+        without_background_refill(self)
+        user = User.objects.create_user("alloc", password="pw")
+        links = [services.shorten_url(user, f"https://example.com/{i}") for i in range(50)]
+        self.assertEqual(len({link.short_code for link in links}), 50)
+
+
+@override_settings(SHORTENER_CODE_POOL_SIZE=10, SHORTENER_CODE_LEASE_TTL=60)
+class CodePoolLeaseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("leases", password="pw")
+
+    def _pool(self):
+        pool = CodePool()
+        self.enterContext(mock.patch.object(pool, "_ensure_thread"))
+        return pool
+
+    def test_released_tail_is_recycled_without_used_codes(self):
+        first = self._pool()
+        taken = first.take_many(3)
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code=taken[0])
+        first.release()
+        lease = ShortCodeLease.objects.get()
+        self.assertEqual((lease.start, lease.stop, lease.owner), (3, 10, ""))
+
+        # One released code got used by someone else in the meantime
+        used = sequence_to_short_code(3)
+        ShortUrl.objects.create(user=self.user, original_url="https://example.org/", short_code=used)
+        second = self._pool()
+        codes = second.take_many(6)
+        self.assertEqual(codes, [sequence_to_short_code(value) for value in range(4, 10)])
+        self.assertEqual(second.recycled_codes, 6)
+        self.assertFalse(set(codes) & set(taken))
+
+    def test_stale_lease_is_taken_over(self):
+        crashed = self._pool()
+        crashed.take()
+        ShortCodeLease.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=30))
+        self.assertEqual(self._pool().take_many(9)[0], sequence_to_short_code(10))
+
+        ShortCodeLease.objects.filter(owner=crashed.owner).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        survivor = self._pool()
+        self.assertEqual(survivor.take(), sequence_to_short_code(0))
+        # The crashed worker's heartbeat no longer touches a lease it lost
+        crashed.heartbeat()
+        self.assertEqual(ShortCodeLease.objects.get(start=0).owner, survivor.owner)
+
+    def test_heartbeat_refreshes_live_leases_and_drops_used_up_ones(self):
+        pool = self._pool()
+        pool.take_many(10)
+        pool.take()
+        ShortCodeLease.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=30))
+        pool.heartbeat()
+        (lease,) = ShortCodeLease.objects.all()
+        self.assertEqual((lease.start, lease.owner), (10, pool.owner))
+        self.assertGreater(lease.heartbeat_at, timezone.now() - timedelta(seconds=5))
+
+
+class LinkExpiryTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        self.user = User.objects.create_user("expiry", password="pw")
+        now = timezone.now()
+        ShortUrl.objects.bulk_create([
+            ShortUrl(user=self.user, original_url="https://example.com/", short_code=f"due{i:03d}",
+                     expires_at=now - timedelta(minutes=i + 1))
+            for i in range(5)
+        ] + [
+            ShortUrl(user=self.user, original_url="https://example.com/", short_code="later1",
+                     expires_at=now + timedelta(minutes=5)),
+            ShortUrl(user=self.user, original_url="https://example.com/", short_code="never1"),
+        ])
+
+    def test_sweeper_deactivates_due_links_in_batches(self):
+        self.assertEqual(services.expire_due_links(batch_size=3), 3)
+        self.assertEqual(services.expire_due_links(batch_size=3), 2)
+        self.assertEqual(services.expire_due_links(batch_size=3), 0)
+        self.assertEqual(
+            set(ShortUrl.objects.filter(is_active=True).values_list("short_code", flat=True)),
+            {"later1", "never1"},
+        )
+
+    def test_command_sweeps_everything_due(self):
+        stdout = StringIO()
+        call_command("expire_links", "--batch-size", "2", stdout=stdout)
+        self.assertIn("Deactivated 5 expired links", stdout.getvalue())
+
+    def test_redirect_stops_at_expiry_even_when_cached(self):
+        self.assertEqual(self.client.get("/later1/").status_code, 302)
+        self.assertEqual(self.client.get("/due000/").status_code, 404)
+        later = timezone.now() + timedelta(minutes=10)
+        with mock.patch("apps.shortener.cache.timezone.now", return_value=later):
+            self.assertEqual(self.client.get("/later1/").status_code, 404)
+
+    def test_sweep_invalidates_cached_targets(self):
+        services.get_redirect_target("due000")
+        services.expire_due_links()
+        self.assertIsNone(redirect_cache.get("due000"))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pages", password="pw")
+        ShortUrl.objects.bulk_create([
+            ShortUrl(user=self.user, original_url=f"https://example.com/{i}", short_code=f"page{i:02d}")
+            for i in range(25)
+        ])
+        # Identical timestamps in groups of five, so the pk breaks the ties
+        base = timezone.now()
+        for link in ShortUrl.objects.all():
+            ShortUrl.objects.filter(pk=link.pk).update(created_at=base - timedelta(minutes=link.pk // 5))
+        self.queryset = ShortUrl.objects.filter(user=self.user)
+        self.expected = list(self.queryset.order_by("-created_at", "-pk"))
+
+    def test_pages_forward_and_back(self):
+        pages, after = [], None
+        while True:
+            page = keyset_page(self.queryset, 10, after=after)
+            pages.append(page)
+            if page.next_cursor is None:
+                break
+            after = page.next_cursor
+        self.assertEqual([link for page in pages for link in page.items], self.expected)
+        self.assertEqual([len(page.items) for page in pages], [10, 10, 5])
+
+        back = keyset_page(self.queryset, 10, before=pages[2].prev_cursor)
+        self.assertEqual(back.items, pages[1].items)
+        back = keyset_page(self.queryset, 10, before=back.prev_cursor)
+        self.assertEqual(back.items, pages[0].items)
+        self.assertIsNone(back.prev_cursor)
+
+    def test_malformed_cursor(self):
+        self.assertIsNone(decode_cursor("not-a-cursor"))
+        self.assertEqual(keyset_page(self.queryset, 10, after="garbage").items, self.expected[:10])
+        link = self.expected[3]
+        self.assertEqual(decode_cursor(encode_cursor(link.created_at, link.pk)), (link.created_at, link.pk))
+
+
+@override_settings(SHORTENER_DASHBOARD_PAGE_SIZE=2)
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("dash", password="pw")
+        now = timezone.now()
+        for short_code, fields in [
+            ("dash01", {}),
+            ("dash02", {"is_active": False}),
+            ("dash03", {"expires_at": now - timedelta(minutes=1)}),
+            ("dash04", {"qr_code_generated_at": now}),
+            ("other1", {"original_url": "https://other.example/"}),
+        ]:
+            fields.setdefault("original_url", "https://example.com/")
+            ShortUrl.objects.create(user=self.user, short_code=short_code, **fields)
+        ShortUrl.objects.create(
+            user=User.objects.create_user("someone", password="pw"),
+            original_url="https://example.com/", short_code="dash99",
+        )
+        self.client.force_login(self.user)
+
+    def codes(self, query=""):
+        response = self.client.get(f"/dashboard/{query}")
+        self.assertEqual(response.status_code, 200)
+        return [url.short_code for url in response.context["urls"]], response.context
+
+    def test_filters(self):
+        self.assertEqual(self.codes("?status=inactive")[0], ["dash02"])
+        self.assertEqual(self.codes("?status=expired")[0], ["dash03"])
+        self.assertEqual(self.codes("?qr=yes")[0], ["dash04"])
+        self.assertEqual(self.codes("?q=https://other")[0], ["other1"])
+        self.assertEqual(self.codes("?status=active&sort=oldest")[0], ["dash01", "dash04"])
+        codes, context = self.codes("?q=dash&qr=no")
+        self.assertEqual(codes, ["dash03", "dash02"])
+        self.assertTrue(context["is_filtered"])
+
+    def test_pages_keep_filters_and_owner(self):
+        seen = []
+        codes, context = self.codes("?sort=oldest")
+        seen += codes
+        while context["next_url"]:
+            self.assertIn("sort=oldest", context["next_url"])
+            codes, context = self.codes(context["next_url"])
+            seen += codes
+        self.assertEqual(seen, ["dash01", "dash02", "dash03", "dash04", "other1"])
+        self.assertEqual(context["total_urls"], 5)
+        _, previous = self.codes(context["prev_url"])
+        self.assertIsNotNone(previous["next_url"])
+
+
+class ClickCountingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("clicks", password="pw")
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="click1")
+
+    def test_flush_writes_counts_and_minute_buckets(self):
+        buffer = ClickBuffer()
+        with mock.patch.object(buffer, "_ensure_thread"):
+            for _ in range(3):
+                buffer.record("click1")
+            buffer.record("unknown", 5)
+        self.assertEqual(buffer.depth, 8)
+        self.assertEqual(buffer.flush(), 8)
+        self.assertEqual(buffer.depth, 0)
+        self.short_url.refresh_from_db()
+        self.assertEqual(self.short_url.click_count, 3)
+        self.assertEqual(
+            list(ClickBucket.objects.filter(short_url=self.short_url).values_list("granularity", "clicks")),
+            [(MINUTE, 3)],
+        )
+
+    def test_flush_request_needs_shared_cache(self):
+        buffer = ClickBuffer()
+        with self.assertLogs("apps.shortener.click_buffer", "WARNING"):
+            self.assertFalse(buffer.request_flush())
+        use_shared_cache(self)
+        other_worker = ClickBuffer()
+        self.assertTrue(buffer.request_flush())
+        self.assertTrue(other_worker._flush_requested())
+        self.assertFalse(other_worker._flush_requested())
+
+    def test_compaction_keeps_every_click(self):
+        now = timezone.now()
+        old = bucket_start(now - timedelta(days=3), HOUR)
+        ClickBucket.objects.bulk_create([
+            ClickBucket(short_url=self.short_url, granularity=MINUTE, bucket_start=old + timedelta(minutes=i), clicks=2)
+            for i in range(30)
+        ] + [
+            ClickBucket(short_url=self.short_url, granularity=MINUTE, bucket_start=bucket_start(now, MINUTE), clicks=1),
+            ClickBucket(short_url=self.short_url, granularity=HOUR, bucket_start=old, clicks=10),
+        ])
+        with self.settings(SHORTENER_CLICK_MINUTE_RETENTION_HOURS=48, SHORTENER_CLICK_HOUR_RETENTION_DAYS=90):
+            result = compact_click_buckets(now)
+        self.assertEqual(result["minute_buckets_merged"], 30)
+        rows = {
+            granularity: clicks
+            for granularity, clicks in ClickBucket.objects.values_list("granularity", "clicks")
+        }
+        self.assertEqual(rows, {MINUTE: 1, HOUR: 70})
+        self.assertFalse(ClickBucket.objects.filter(granularity=DAY).exists())
+
+
+class ClickEventLogTests(TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+
+    def _log(self, count):
+        log = ClickEventLog()
+        with mock.patch.object(log, "_ensure_thread"):
+            for i in range(count):
+                log.record(f"code{i % 3}", "https://ref.example/", "agent", "10.0.0.1")
+        return log
+
+    @override_settings(SHORTENER_CLICK_EVENT_SINK="db", SHORTENER_CLICK_EVENT_BUFFER_SIZE=10, SHORTENER_CLICK_EVENT_SAMPLE_EVERY=2)
+    def test_sheds_load_instead_of_blocking(self):
+        log = self._log(30)
+        # 5 kept, then every other one up to the capacity, then dropped
+        self.assertEqual((log.recorded, log.sampled_out, log.dropped), (10, 5, 15))
+        self.assertEqual(log.drain(), 10)
+        self.assertEqual(ClickEvent.objects.count(), 10)
+        event = ClickEvent.objects.first()
+        self.assertEqual(event.ip_hash, hash_ip("10.0.0.1"))
+        self.assertNotIn("10.0.0.1", event.ip_hash)
+
+    def test_segments_rotate_by_size_and_on_close(self):
+        with self.settings(SHORTENER_CLICK_EVENT_SINK="file", SHORTENER_CLICK_EVENT_DIR=self.directory,
+                           SHORTENER_CLICK_EVENT_SEGMENT_BYTES=1):
+            log = self._log(3)
+            log.drain()
+            self.assertEqual(len(log.closed_segments()), 1)
+        with self.settings(SHORTENER_CLICK_EVENT_SINK="file", SHORTENER_CLICK_EVENT_DIR=self.directory):
+            log = self._log(2)
+            log.drain()
+            # Still open, so replay must not see it yet
+            self.assertEqual(len(log.closed_segments()), 1)
+            log.close()
+            self.assertEqual(len(log.closed_segments()), 2)
+            self.assertEqual(log.segments_closed, 1)
+
+    def test_replay_never_loads_a_segment_twice(self):
+        with self.settings(SHORTENER_CLICK_EVENT_SINK="file", SHORTENER_CLICK_EVENT_DIR=self.directory):
+            log = self._log(4)
+            log.close()
+            (segment,) = log.closed_segments()
+            # Crash after the load committed, before the rename
+            with mock.patch(
+                "apps.shortener.management.commands.replay_click_events.os.replace",
+                side_effect=OSError("killed"),
+            ):
+                with self.assertRaises(OSError):
+                    call_command("replay_click_events", stdout=StringIO())
+            self.assertEqual(ClickEvent.objects.count(), 4)
+
+            stderr = StringIO()
+            call_command("replay_click_events", stdout=StringIO(), stderr=stderr)
+            self.assertIn("already loaded", stderr.getvalue())
+            self.assertEqual(ClickEvent.objects.count(), 4)
+            self.assertEqual(log.closed_segments(), [])
+            self.assertTrue(os.path.exists(f"{segment}.loaded"))
+
+    @override_settings(SHORTENER_CLICK_EVENT_RETENTION_DAYS=30)
+    def test_purge_keeps_the_retention_window(self):
+        now = timezone.now()
+        ClickEvent.objects.bulk_create([
+            ClickEvent(short_code="old", clicked_at=now - timedelta(days=31)) for _ in range(5)
+        ] + [ClickEvent(short_code="new", clicked_at=now - timedelta(days=29))])
+        self.assertEqual(purge_click_events(batch_size=2, now=now), 2)
+        call_command("purge_click_events", stdout=StringIO())
+        self.assertEqual(list(ClickEvent.objects.values_list("short_code", flat=True)), ["new"])
+        with self.settings(SHORTENER_CLICK_EVENT_RETENTION_DAYS=0):
+            self.assertEqual(purge_click_events(now=now + timedelta(days=365)), 0)
+
+
+class FastPathTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        user = User.objects.create_user("fast", password="pw")
+        ShortUrl.objects.create(user=user, original_url="https://example.com/fast", short_code="fast01")
+        ShortUrl.objects.create(user=user, original_url="https://example.com/cold", short_code="cold01")
+        ShortUrl.objects.create(
+            user=user, original_url="https://example.com/soon", short_code="soon01",
+            expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        services.get_redirect_target("fast01")
+        services.get_redirect_target("soon01")
+        self.clicks = []
+        for name in ("click_buffer", "hot_links", "click_events"):
+            recorder = self.enterContext(mock.patch(f"apps.shortener.fastpath.{name}"))
+            recorder.record.side_effect = lambda short_code, *args: self.clicks.append(short_code)
+            recorder.arecord = mock.AsyncMock(side_effect=lambda short_code: self.clicks.append(short_code))
+
+    def wsgi(self, path, method="GET", **environ):
+        """(status, headers) from the fast path, or None if it fell through to Django"""
+        response = {}
+
+        def django_app(environ, start_response):
+            start_response("200 OK", [])
+            return [b""]
+
+        def start_response(status, headers):
+            response.update(status=status, headers=dict(headers))
+
+        app = FastRedirectWSGI(django_app)
+        app({"REQUEST_METHOD": method, "PATH_INFO": path, "wsgi.url_scheme": "http", **environ}, start_response)
+        if response["status"] == "200 OK":
+            return None
+        return response["status"], response["headers"]
+
+    async def asgi(self, path, method="GET"):
+        """(status, headers) from the fast path, or None if it fell through to Django"""
+        messages = []
+
+        async def django_app(scope, receive, send):
+            messages.append(None)
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "scheme": "http", "headers": []}
+        await FastRedirectASGI(django_app)(scope, None, send)
+        if messages == [None]:
+            return None
+        start = messages[0]
+        return start["status"], {name.decode(): value.decode() for name, value in start["headers"]}
+
+    def test_wsgi_hit(self):
+        status, headers = self.wsgi("/fast01/")
+        self.assertEqual(status, "302 Found")
+        self.assertEqual(headers["Location"], "https://example.com/fast")
+        self.assertEqual(headers["X-Content-Type-Options"], "nosniff")
+        self.assertEqual(headers["Referrer-Policy"], "same-origin")
+        self.assertEqual(headers["X-Frame-Options"], "DENY")
+        self.assertNotIn("Strict-Transport-Security", headers)
+        self.assertEqual(self.clicks, ["fast01"] * 3)
+
+    def test_wsgi_head_is_not_a_click(self):
+        status, _ = self.wsgi("/fast01/", method="HEAD")
+        self.assertEqual(status, "302 Found")
+        self.assertEqual(self.clicks, [])
+
+    def test_wsgi_falls_through(self):
+        self.assertIsNone(self.wsgi("/cold01/"))
+        self.assertIsNone(self.wsgi("/fast01"))
+        self.assertIsNone(self.wsgi("/fast01/", method="POST"))
+        self.assertIsNone(self.wsgi("/dashboard/"))
+        self.assertEqual(self.clicks, [])
+
+    def test_wsgi_expired_link(self):
+        later = timezone.now() + timedelta(minutes=10)
+        with mock.patch("apps.shortener.cache.timezone.now", return_value=later):
+            status, headers = self.wsgi("/soon01/")
+        self.assertEqual(status, "404 Not Found")
+        self.assertEqual(headers["X-Content-Type-Options"], "nosniff")
+        self.assertEqual(self.clicks, [])
+
+    @override_settings(SECURE_HSTS_SECONDS=3600, SECURE_PROXY_SSL_HEADER=("HTTP_X_FORWARDED_PROTO", "https"))
+    def test_hsts_behind_tls_proxy(self):
+        _, headers = self.wsgi("/fast01/", HTTP_X_FORWARDED_PROTO="https")
+        self.assertEqual(headers["Strict-Transport-Security"], "max-age=3600")
+
+    async def test_asgi(self):
+        status, headers = await self.asgi("/fast01/")
+        self.assertEqual(status, 302)
+        self.assertEqual(headers["location"], "https://example.com/fast")
+        self.assertEqual(headers["x-frame-options"], "DENY")
+        self.assertEqual(self.clicks, ["fast01"] * 3)
+
+        self.assertIsNone(await self.asgi("/cold01/"))
+        self.assertIsNone(await self.asgi("/fast01"))
+        self.assertIsNone(await self.asgi("/admin/"))
+        status, _ = await self.asgi("/fast01/", method="HEAD")
+        self.assertEqual(status, 302)
+        with mock.patch("apps.shortener.cache.timezone.now", return_value=timezone.now() + timedelta(minutes=10)):
+            status, _ = await self.asgi("/soon01/")
+        self.assertEqual(status, 404)
+        self.assertEqual(self.clicks, ["fast01"] * 3)
+
+
+class RedirectPolicyTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        self.user = User.objects.create_user("policy", password="pw")
+
+    def _get(self, short_code, **fields):
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code=short_code, **fields)
+        return self.client.get(f"/{short_code}/")
+
+    @override_settings(SHORTENER_PERMANENT_REDIRECT_MAX_AGE=86400, SHORTENER_TEMPORARY_REDIRECT_MAX_AGE=0)
+    def test_status_and_cache_control_per_link(self):
+        response = self._get("temp01")
+        self.assertEqual((response.status_code, response["Cache-Control"]), (302, "no-cache"))
+        response = self._get("perm01", redirect_type=301)
+        self.assertEqual((response.status_code, response["Cache-Control"]), (301, "public, max-age=86400"))
+        response = self._get("temp02", redirect_type=307, cache_max_age=60)
+        self.assertEqual((response.status_code, response["Cache-Control"]), (307, "public, max-age=60"))
+        self.assertEqual(response["Location"], "https://example.com/")
+
+    def test_max_age_stops_at_expiry(self):
+        response = self._get(
+            "soon02", redirect_type=308, cache_max_age=3600,
+            expires_at=timezone.now() + timedelta(seconds=90),
+        )
+        self.assertEqual(response.status_code, 308)
+        max_age = int(response["Cache-Control"].rsplit("=", 1)[1])
+        self.assertTrue(80 <= max_age <= 90, max_age)
+
+
+class RequestLoggingTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        # Keep the click event writer thread off the test database
+        self.enterContext(mock.patch("apps.shortener.views.click_events"))
+        self.user = User.objects.create_user("logging", password="pw")
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="logs01")
+
+    def test_request_id_is_echoed_or_generated(self):
+        response = self.client.get("/logs01/", HTTP_X_REQUEST_ID="edge-42.a")
+        self.assertEqual(response["X-Request-ID"], "edge-42.a")
+        response = self.client.get("/logs01/", HTTP_X_REQUEST_ID="bad id\nforged")
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+    def test_records_carry_the_request_id(self):
+        request_filter = RequestIdFilter()
+        seen = []
+
+        def view(request):
+            record = logging.makeLogRecord({"msg": "inside"})
+            request_filter.filter(record)
+            seen.append(record.request_id)
+            return HttpResponse()
+
+        RequestIdMiddleware(view)(RequestFactory().get("/", HTTP_X_REQUEST_ID="abc123"))
+        outside = logging.makeLogRecord({"msg": "outside"})
+        request_filter.filter(outside)
+        self.assertEqual(seen, ["abc123"])
+        self.assertEqual(outside.request_id, "-")
+
+    def test_access_log_is_sampled(self):
+        with override_settings(SHORTENER_ACCESS_LOG_SAMPLE_RATE=1), self.assertLogs("apps.shortener.access") as logs:
+            self.client.get("/logs01/", HTTP_X_REQUEST_ID="sampled1")
+        (record,) = logs.records
+        self.assertEqual((record.short_code, record.status, record.request_id), ("logs01", 302, "sampled1"))
+        with override_settings(SHORTENER_ACCESS_LOG_SAMPLE_RATE=0), self.assertNoLogs("apps.shortener.access"):
+            self.client.get("/logs01/")
+
+    def test_queue_handler_writes_json_in_the_background(self):
+        stream = StringIO()
+        handler = QueueLogHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        self.addCleanup(handler.close)
+        handler.handle(logging.makeLogRecord({
+            "name": "test", "levelno": logging.INFO, "levelname": "INFO", "msg": "hello %s", "args": ("world",),
+            "request_id": "req1", "short_code": "logs01",
+        }))
+        handler.flush_queue()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(
+            (entry["message"], entry["request_id"], entry["short_code"]), ("hello world", "req1", "logs01")
+        )
+
+    def test_full_queue_drops_records(self):
+        handler = QueueLogHandler(StringIO(), queue_size=1)
+        self.addCleanup(handler.close)
+        handler.enqueue(logging.makeLogRecord({"msg": "kept"}))
+        handler.enqueue(logging.makeLogRecord({"msg": "dropped"}))
+        self.assertEqual(handler.dropped, 1)
+
+
+class EdgeLogTests(TestCase):
+    W3C = (
+        "#Version: 1.0\n"
+        "#Fields: date time x-edge-location cs-uri-stem sc-status x-edge-result-type\n"
+        "2026-01-01\t12:00:05\tIAD\t/edge01/\t301\tHit\n"
+        "2026-01-01\t12:00:59\tIAD\t/edge01/\t301\tRefreshHit\n"
+        "2026-01-01\t12:01:00\tIAD\t/edge01/\t301\tHit\n"
+        "2026-01-01\t12:01:00\tIAD\t/edge01/\t301\tMiss\n"
+        "2026-01-01\t12:01:00\tIAD\t/edge01\t301\tHit\n"
+        "2026-01-01\t12:01:00\tIAD\t/dashboard/\t302\tHit\n"
+        "2026-01-01\t12:01:00\tIAD\t/edge02/\t200\tHit\n"
+        "garbage\n"
+    )
+
+    def test_w3c_counts_edge_hits_per_minute(self):
+        counts, skipped = count_edge_clicks(self.W3C.splitlines(keepends=True))
+        minute = int(datetime(2026, 1, 1, 12, tzinfo=dt_timezone.utc).timestamp() // 60)
+        self.assertEqual(dict(counts), {("edge01", minute): 1, ("edge01", minute + 1): 1})
+        self.assertEqual(skipped, 5)
+
+    def test_json_with_custom_fields(self):
+        lines = [
+            json.dumps({"ts": 1767268800000000000, "uri": "/edge01/", "code": 302, "cache": "HIT"}),
+            json.dumps({"ts": "2026-01-01T12:00:30Z", "uri": "/edge01/", "code": 302, "cache": "stale"}),
+            json.dumps({"ts": 1767268800, "uri": "/edge01/", "code": 302, "cache": "miss"}),
+            "{not json",
+        ]
+        counts, skipped = count_edge_clicks(
+            lines, "json", {"time": "ts", "path": "uri", "status": "code", "cache": "cache"}
+        )
+        self.assertEqual(list(counts.values()), [2])
+        self.assertEqual(skipped, 1)
+
+    def test_rerun_after_crash_never_counts_a_log_twice(self):
+        user = User.objects.create_user("edge", password="pw")
+        link = ShortUrl.objects.create(user=user, original_url="https://example.com/", short_code="edge01")
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, "E2ABC.2026-01-01-12.log")
+        with open(path, "w", encoding="utf-8") as log:
+            log.write(self.W3C)
+
+        with mock.patch(
+            "apps.shortener.management.commands.ingest_edge_logs.os.replace",
+            side_effect=OSError("killed"),
+        ):
+            with self.assertRaises(OSError):
+                call_command("ingest_edge_logs", path, stdout=StringIO())
+        stderr = StringIO()
+        call_command("ingest_edge_logs", path, stdout=StringIO(), stderr=stderr)
+        self.assertIn("already ingested", stderr.getvalue())
+        link.refresh_from_db()
+        self.assertEqual(link.click_count, 2)
+        self.assertTrue(os.path.exists(f"{path}.ingested"))
+
+
+class BatchQrRenderingTests(TestCase):
+    urls = [f"http://localhost:8000/{code}/" for code in ("a1b2c3", "zz", "x" * 60, "Q9q9Q9")]
+
+    def test_matches_single_renderer(self):
+        self.assertEqual(render_qr_batch(self.urls), [render_qr_png(url) for url in self.urls])
+
+    def test_process_pool_keeps_order(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(2) as executor:
+            pngs = render_qr_batch(self.urls, executor=executor, chunk_size=1)
+        self.assertEqual(pngs, render_qr_batch(self.urls))
+
+
+@override_settings(SHORTENER_READ_REPLICAS=("replica_1",), SHORTENER_REPLICA_PIN_SECONDS=15)
+class ReplicaRoutingTests(SimpleTestCase):
+    # SimpleTestCase so the primary is not inside a test transaction
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_use_replicas_only_when_asked(self):
+        self.assertIsNone(self.router.db_for_read(ShortUrl))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(ShortUrl), "replica_1")
+            self.assertEqual(self.router.db_for_write(ShortUrl), "default")
+            # Read-your-writes after the block wrote
+            self.assertIsNone(self.router.db_for_read(ShortUrl))
+        with override_settings(SHORTENER_READ_REPLICAS=()), replica_reads():
+            self.assertIsNone(self.router.db_for_read(ShortUrl))
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica_1", "shortener"))
+        self.assertIsNone(self.router.allow_migrate("default", "shortener"))
+
+    def test_pin_cookie_after_a_write(self):
+        seen = []
+
+        @read_from_replicas
+        def view(request):
+            seen.append(using_replica())
+            if request.method == "POST":
+                self.router.db_for_write(ShortUrl)
+            return HttpResponse()
+
+        middleware = ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+        self.assertNotIn(PIN_COOKIE, middleware(factory.get("/")).cookies)
+        response = middleware(factory.post("/"))
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], 15)
+
+        pinned = factory.get("/")
+        pinned.COOKIES[PIN_COOKIE] = "1"
+        middleware(pinned)
+        self.assertEqual(seen, [True, True, False])
+
+    def test_pin_cookie_async(self):
+        @read_from_replicas
+        async def view(request):
+            self.router.db_for_write(ShortUrl)
+            return HttpResponse()
+
+        middleware = ReplicaPinMiddleware(view)
+        response = async_to_sync(middleware)(RequestFactory().post("/"))
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+
+class RedirectCacheInvalidationTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        self.user = User.objects.create_user("cache", password="pw")
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/a", short_code="cache1")
+
+    def test_save_invalidates(self):
+        self.assertEqual(services.get_redirect_target("cache1").original_url, "https://example.com/a")
+        self.short_url.original_url = "https://example.com/b"
+        self.short_url.save()
+        self.assertIsNone(redirect_cache.get("cache1"))
+        self.assertEqual(services.get_redirect_target("cache1").original_url, "https://example.com/b")
+
+    def test_unrelated_update_fields_keep_entry(self):
+        services.get_redirect_target("cache1")
+        self.short_url.save(update_fields=["click_count"])
+        self.assertIsNotNone(redirect_cache.get("cache1"))
+
+    def test_delete_invalidates(self):
+        services.get_redirect_target("cache1")
+        self.short_url.delete()
+        self.assertIsNone(redirect_cache.get("cache1"))
+        self.assertIs(services.get_redirect_target("cache1"), NOT_FOUND)
+
+    def test_queryset_update_invalidates(self):
+        services.get_redirect_target("cache1")
+        ShortUrl.objects.filter(is_active=True, short_code="cache1").update(is_active=False)
+        self.assertIsNone(redirect_cache.get("cache1"))
+        self.assertFalse(services.get_redirect_target("cache1").is_active)
+
+    def test_queryset_delete_invalidates(self):
+        services.get_redirect_target("cache1")
+        ShortUrl.objects.filter(user=self.user).delete()
+        self.assertIs(services.get_redirect_target("cache1"), NOT_FOUND)
+
+    def test_admin_delete_selected_invalidates(self):
+        admin_user = User.objects.create_superuser("admin", password="pw")
+        self.client.force_login(admin_user)
+        services.get_redirect_target("cache1")
+        response = self.client.post("/admin/shortener/shorturl/", {
+            "action": "delete_selected",
+            "_selected_action": [self.short_url.pk],
+            "post": "yes",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIs(services.get_redirect_target("cache1"), NOT_FOUND)
+
+    def test_unknown_codes_are_negatively_cached(self):
+        self.assertIs(services.get_redirect_target("nope99"), NOT_FOUND)
+        self.assertIs(redirect_cache.get("nope99"), NOT_FOUND)
+
+
+class MetricsAggregationTests(TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(SHORTENER_METRICS_DIR=self.directory, SHORTENER_METRICS_PUBLISH_INTERVAL=3600))
+
+    def _worker_file(self, pid, values):
+        path = os.path.join(self.directory, f"metrics-{registry.key}-{pid}.bin")
+        with open(path, "wb") as f:
+            f.write(struct.pack(f"{registry.size}d", *values))
+
+    def test_sums_workers_and_threads(self):
+        metrics = Metrics(registry)
+        metrics.inc(REQUESTS["redirect", "3xx"])
+        thread = threading.Thread(target=metrics.inc, args=(REQUESTS["redirect", "3xx"], 2))
+        thread.start()
+        thread.join()
+        metrics.observe(LATENCY["redirect",], LATENCY_BUCKETS, 0.003)
+
+        other = [0.0] * registry.size
+        other[REQUESTS["redirect", "3xx"]] = 10
+        self._worker_file(os.getpid() + 1000000, other)
+
+        values = metrics.collect()
+        self.assertEqual(values[REQUESTS["redirect", "3xx"]], 13)
+        base = LATENCY["redirect",]
+        self.assertEqual(values[base + len(LATENCY_BUCKETS) + 2], 1)
+        text = metrics.render()
+        self.assertIn('shortener_requests_total{view="redirect",status="3xx"} 13', text)
+        self.assertIn('shortener_request_duration_seconds_bucket{view="redirect",le="0.005"} 1', text)
+
+    def test_finished_threads_fold_their_shards(self):
+        metrics = Metrics(registry)
+        index = REQUESTS["other", "2xx"]
+        metrics.inc(index)
+        for _ in range(50):
+            thread = threading.Thread(target=metrics.inc, args=(index,))
+            thread.start()
+            thread.join()
+        del thread
+        gc.collect()
+        self.assertEqual(metrics.totals()[index], 51)
+        self.assertEqual(len(metrics._shards), 1)
+
+    def test_gauges_only_from_live_workers(self):
+        from .metrics import BUFFER_DEPTH
+
+        metrics = Metrics(registry)
+        dead = [0.0] * registry.size
+        dead[BUFFER_DEPTH["click_buffer",]] = 50
+        self._worker_file(2 ** 22 + 12345, dead)
+        with mock.patch("apps.shortener.metrics._alive", return_value=False):
+            values = metrics.collect()
+        self.assertEqual(values[BUFFER_DEPTH["click_buffer",]], 0)
+
+
+class HotLinksTests(TestCase):
+    def test_space_saving_keeps_heavy_hitters(self):
+        summary = SpaceSaving(10)
+        for i in range(1000):
+            summary.offer(f"rare{i}")
+            if i % 4 == 0:
+                summary.offer("hot")
+        (item, count, error), = summary.top(1)
+        self.assertEqual(item, "hot")
+        self.assertGreaterEqual(count, 250)
+        self.assertLessEqual(count - error, 250)
+
+    def _tracker(self, clicks):
+        tracker = HotLinkTracker()
+        with mock.patch.object(tracker, "_ensure_thread"):
+            for short_code, count in clicks.items():
+                for _ in range(count):
+                    tracker.record(short_code)
+        return tracker
+
+    def test_local_only_without_shared_cache(self):
+        tracker = self._tracker({"a": 3})
+        with self.assertLogs("apps.shortener.hot_links", "WARNING"):
+            tracker.publish()
+        self.assertEqual([code for code, _, _ in tracker.top("1h")], ["a"])
+        self.assertIsNone(tracker.shared.get("shortener:hot:workers"))
+
+    def test_merges_workers_through_shared_cache(self):
+        use_shared_cache(self)
+        worker_a, worker_b = self._tracker({"a": 3, "b": 1}), self._tracker({"b": 5})
+        with mock.patch.object(HotLinkTracker, "worker_id", "host:1"):
+            worker_a.publish()
+        with mock.patch.object(HotLinkTracker, "worker_id", "host:2"):
+            worker_b.publish()
+        self.assertEqual([(code, count) for code, count, _ in worker_a.top("1h")], [("b", 6), ("a", 3)])
+
+
+class BulkShortenTests(TestCase):
+    def setUp(self):
+        without_background_refill(self)
+        self.user = User.objects.create_user("bulk", password="pw")
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="taken1")
+
+    def test_generated_code_clash_retries(self):
+        rows = [{"original_url": "https://example.com/a"}, {"original_url": "https://example.com/b"}]
+        real_take_many = services.code_pool.take_many
+        clashing = iter([["taken1", real_take_many(1)[0]]])
+        with mock.patch(
+            "apps.shortener.bulk.code_pool.take_many",
+            side_effect=lambda count: next(clashing, None) or real_take_many(count),
+        ):
+            results = list(bulk_shorten(self.user, rows))
+        self.assertTrue(all("short_code" in result for result in results), results)
+        self.assertNotEqual(results[0]["short_code"], "taken1")
+        self.assertEqual(ShortUrl.objects.filter(user=self.user).count(), 3)
+
+    def test_custom_code_clash_fails_row(self):
+        rows = [{"original_url": "https://example.com/a", "custom_code": "custom1"}] * 2
+        results = list(bulk_shorten(self.user, rows))
+        self.assertEqual(results[0]["short_code"], "custom1")
+        self.assertEqual(results[1]["error"], "This short code is already taken.")
+
+    def _post(self, body, content_type):
+        self.client.force_login(self.user)
+        response = self.client.post("/api/bulk-create/", body, content_type=content_type)
+        if response.streaming:
+            return response, [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return response, None
+
+    def test_endpoint_streams_json_lines(self):
+        body = "\n".join(json.dumps({"original_url": f"https://example.com/{i}"}) for i in range(3))
+        response, lines = self._post(body, "application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[-1]["summary"]["created"], 3)
+
+    @override_settings(SHORTENER_BULK_JSON_MAX_BYTES=100)
+    def test_endpoint_limits_json_object_bodies(self):
+        response, lines = self._post({"urls": ["https://example.com/a"]}, "application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("short_code", lines[0])
+        urls = [f"https://example.com/{i}" for i in range(10)]
+        response, _ = self._post({"urls": urls}, "application/json")
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("application/x-ndjson", response.json()["error"])
+
+
+class QrImageViewTests(TestCase):
+    def setUp(self):
+        use_empty_redirect_cache(self)
+        self.user = User.objects.create_user("qrimage", password="pw")
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="qrimg1")
+
+    def test_renders_with_etag_and_304(self):
+        with mock.patch("apps.shortener.views.get_redirect_target", wraps=services.get_redirect_target) as lookup:
+            response = self.client.get("/qr/qrimg1/image/?format=svg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertEqual(lookup.call_count, 1)
+        response = self.client.get("/qr/qrimg1/image/?format=svg", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get("/qr/qrimg1/image/?size=5").status_code, 400)
+        self.assertEqual(self.client.get("/qr/qrimg1/image/?format=gif").status_code, 400)
+
+    def test_only_listed_sizes(self):
+        self.assertEqual(self.client.get("/qr/qrimg1/image/?size=256").status_code, 200)
+        with mock.patch("apps.shortener.views.rendered_qr_bytes") as render:
+            self.assertEqual(self.client.get("/qr/qrimg1/image/?size=257").status_code, 400)
+        render.assert_not_called()
+
+    def test_dead_links_are_404(self):
+        self.assertEqual(self.client.get("/qr/nope12/image/").status_code, 404)
+        self.short_url.is_active = False
+        self.short_url.save()
+        self.assertEqual(self.client.get("/qr/qrimg1/image/").status_code, 404)
+        ShortUrl.objects.filter(pk=self.short_url.pk).update(
+            is_active=True, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(self.client.get("/qr/qrimg1/image/").status_code, 404)
+
+
+class QrDownloadTests(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        self.user = User.objects.create_user("qrdownload", password="pw")
+        self.client.force_login(self.user)
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="qrdl1")
+        self.assertTrue(generate_qr_code(self.short_url))
+        self.short_url.refresh_from_db()
+        with qr_storage().open(self.short_url.qr_code_image.name, "rb") as image:
+            self.png = image.read()
+        self.url = f"/qr/{self.short_url.pk}/download/"
+
+    def test_parse_byte_range(self):
+        self.assertEqual(parse_byte_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(parse_byte_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(parse_byte_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(parse_byte_range("bytes=50-500", 100), (50, 99))
+        self.assertIsNone(parse_byte_range("bytes=0-1,5-9", 100))
+        self.assertIsNone(parse_byte_range(None, 100))
+        self.assertFalse(parse_byte_range("bytes=100-", 100))
+        self.assertFalse(parse_byte_range("bytes=-0", 100))
+
+    def test_full_download_and_304(self):
+        for cached in (True, False):
+            with self.subTest(cached=cached), mock.patch(
+                "apps.shortener.downloads.cached_qr_image", return_value=self.png if cached else None
+            ):
+                response = self.client.get(self.url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response), self.png)
+                self.assertEqual(response["Accept-Ranges"], "bytes")
+                not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(not_modified.status_code, 304)
+
+    def test_ranges(self):
+        for cached in (True, False):
+            with self.subTest(cached=cached), mock.patch(
+                "apps.shortener.downloads.cached_qr_image", return_value=self.png if cached else None
+            ):
+                response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response), self.png[10:20])
+                self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.png)}")
+
+                response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.png)}-")
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], f"bytes */{len(self.png)}")
+
+                # A stale If-Range gets the whole image
+                response = self.client.get(self.url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(SHORTENER_QR_SENDFILE="x-accel-redirect")
+    def test_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.short_url.qr_code_image.name}")
+
+    def test_zip_is_streamed_and_skips_missing_files(self):
+        missing = ShortUrl.objects.create(user=self.user, original_url="https://example.org/", short_code="qrdl2")
+        self.assertTrue(generate_qr_code(missing))
+        missing.refresh_from_db()
+        qr_storage().delete(missing.qr_code_image.name)
+        ShortUrl.objects.create(user=self.user, original_url="https://example.net/", short_code="qrdl3")
+
+        response = self.client.get("/qr/download-all/")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="qr_codes_qrdownload.zip"')
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ["qr_code_qrdl1.png"])
+            self.assertEqual(archive.read("qr_code_qrdl1.png"), self.png)
+
+
+class UserLinkStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("stats", password="pw")
+        UserLinkStats.objects.for_user(self.user)
+        self.short_url = ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="stats1")
+        ShortUrl.objects.create(user=self.user, original_url="https://example.com/", short_code="stats2")
+
+    def test_delete_subtracts_clicks_flushed_after_load(self):
+        buffer = ClickBuffer()
+        buffer.write_counts({("stats1", 1): 4, ("stats2", 1): 1})
+        # self.short_url still has click_count 0 in memory
+        self.short_url.delete()
+        stats = UserLinkStats.objects.get(user=self.user)
+        self.assertEqual((stats.total_links, stats.total_clicks), (1, 1))
+        self.assertEqual(UserLinkStats.objects.rebuild([self.user.pk]), 0)
+
+    def test_queryset_delete_subtracts_per_owner(self):
+        other = User.objects.create_user("stats-other", password="pw")
+        UserLinkStats.objects.for_user(other)
+        ShortUrl.objects.create(user=other, original_url="https://example.com/", short_code="stats3")
+        ClickBuffer().write_counts({("stats1", 1): 4, ("stats2", 1): 2, ("stats3", 1): 1})
+        ShortUrl.objects.filter(pk=self.short_url.pk).update(
+            qr_code_image="qr_codes/stats1.png", qr_code_generated_at=timezone.now()
+        )
+        UserLinkStats.objects.record_qr_change(self.user.pk, 1)
+
+        ShortUrl.objects.filter(short_code__in=["stats1", "stats3"]).delete()
+        stats = UserLinkStats.objects.get(user=self.user)
+        self.assertEqual((stats.total_links, stats.total_clicks, stats.links_with_qr), (1, 2, 0))
+        self.assertEqual(UserLinkStats.objects.rebuild([self.user.pk, other.pk]), 0)
+        self.assertEqual(self.user.daily_link_stats.get().links_created, 1)
+
+    def test_admin_actions_keep_stats(self):
+        self.client.force_login(User.objects.create_superuser("stats-admin", password="pw"))
+        for action in ("deactivate", "activate", "delete_selected"):
+            response = self.client.post("/admin/shortener/shorturl/", {
+                "action": action,
+                "_selected_action": [self.short_url.pk],
+                "post": "yes",
+            })
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserLinkStats.objects.get(user=self.user).total_links, 1)
+        self.assertEqual(UserLinkStats.objects.rebuild([self.user.pk]), 0)
+
+    def test_queryset_owner_change_moves_stats(self):
+        other = User.objects.create_user("stats-new", password="pw")
+        UserLinkStats.objects.for_user(other)
+        ShortUrl.objects.filter(pk=self.short_url.pk).update(user=other)
+        self.assertEqual(UserLinkStats.objects.get(user=self.user).total_links, 1)
+        self.assertEqual(UserLinkStats.objects.get(user=other).total_links, 1)
+
+    def test_deleting_a_file_without_qr_keeps_qr_total(self):
+        ShortUrl.objects.filter(pk=self.short_url.pk).update(qr_code_image="qr_codes/missing.png")
+        self.short_url.refresh_from_db()
+        self.assertFalse(self.short_url.has_qr_code)
+        self.assertTrue(delete_qr_code_file(self.short_url))
+        self.assertEqual(UserLinkStats.objects.get(user=self.user).links_with_qr, 0)
@@ -1,20 +1,40 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = "shortener"
 
+# Serve redirects from the async view when running under ASGI
+if getattr(settings, "SHORTENER_ASYNC_REDIRECT", False):
+    redirect_view = views.redirect_short_url_async
+else:
+    redirect_view = views.redirect_short_url
+
 urlpatterns = [
     path("", views.dashboard, name="home"),
     path("dashboard/", views.dashboard, name= "dashboard"),
     path("create/", views.create_short_url, name= "create_short_url"),
+    path("api/bulk-create/", views.bulk_create_short_urls, name="bulk_create_short_urls"),
     path("delete/<int:pk>", views.delete_short_url, name="delete_short_url"),
     path("urls/<int:pk>/edit/", views.edit_url, name="edit_url"),
+    path("api/urls/<int:pk>/clicks/", views.link_clicks, name="link_clicks"),
     
     # QR Code related URLs
     path("qr/<int:pk>/generate/", views.generate_qr_code_view, name="generate_qr_code"),
     path("qr/<int:pk>/view/", views.view_qr_code, name="view_qr_code"),
     path("qr/<int:pk>/download/", views.download_qr_code, name="download_qr_code"),
     path("qr/<int:pk>/regenerate/", views.regenerate_qr_code_view, name="regenerate_qr_code"),
+    path("qr/<int:pk>/status/", views.qr_code_status, name="qr_code_status"),
+    path("qr/generate-all/", views.generate_all_qr_codes, name="generate_all_qr_codes"),
+    path("qr/download-all/", views.download_all_qr_codes, name="download_all_qr_codes"),
+    path("qr/<str:short_code>/image/", views.qr_code_image, name="qr_code_image"),
+    
+    path("stats/cache/", views.cache_stats, name="cache_stats"),
+    path("stats/code-pool/", views.code_pool_stats, name="code_pool_stats"),
+    path("stats/bloom/", views.bloom_stats, name="bloom_stats"),
+    path("stats/click-events/", views.click_event_stats, name="click_event_stats"),
+    path("stats/hot-links/", views.hot_link_stats, name="hot_link_stats"),
+    path("metrics", views.prometheus_metrics, name="metrics"),
     
-    path("<str:short_code>/", views.redirect_short_url, name = "redirect"),
+    path("<str:short_code>/", redirect_view, name = "redirect"),
 ]
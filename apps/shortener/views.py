@@ -1,35 +1,152 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, HttpResponseRedirect, Http404, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseRedirect, Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.utils.cache import patch_cache_control
+import hmac
+import json
+import logging
+from .bulk import BulkStats, bulk_shorten, iter_csv_rows, iter_jsonl_rows
+from .cache import redirect_cache
+from .click_buffer import click_buffer
+from .downloads import serve_qr_image, stream_qr_zip
+from .events import click_events
+from .hot_links import WINDOW_NAMES, hot_links
+from .code_pool import code_pool
+from .metrics import metrics
 from .forms import ShortUrlForm, ShortUrlEditForm
-from .services import generate_unique_short_code
-from .models import ShortUrl
-from .qr_service import generate_qr_code, regenerate_qr_code
+from .services import shorten_url, get_redirect_target, aget_redirect_target
+from asgiref.sync import sync_to_async
+from .models import QrJob, ShortUrl, UserDailyLinkStats, UserLinkStats
+from .qr_jobs import enqueue_qr_job, enqueue_qr_jobs
+from .replicas import read_from_replicas
+from .qr_service import (
+    ERROR_CORRECTION_LEVELS, QR_BORDER, QR_ERROR_CORRECTION, QR_FORMAT,
+    get_full_short_url, qr_content_key, rendered_qr_bytes,
+)
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib import messages
+from django.db import IntegrityError
+from django.conf import settings
+from django.template.loader import render_to_string
+from .bloom import short_code_filter
+
+logger = logging.getLogger(__name__)
+
+# 404.html rendered once for visitors without a session (bots, scanners)
+_anonymous_not_found_body = None
+
+
+def anonymous_not_found_body():
+    global _anonymous_not_found_body
+    if _anonymous_not_found_body is None:
+        _anonymous_not_found_body = render_to_string("404.html").encode()
+    return _anonymous_not_found_body
+
+
+def has_session_cookie(request):
+    return settings.SESSION_COOKIE_NAME in request.COOKIES
+
+
+def short_code_not_found(request):
+    """404 for an unknown short code, served pre-rendered when there is no session"""
+    if has_session_cookie(request):
+        return render(request, "404.html", status = 404)
+    return HttpResponse(anonymous_not_found_body(), status = 404)
+
+# Columns the dashboard template reads; everything else stays in the DB
+DASHBOARD_FIELDS = (
+    "id", "short_code", "original_url", "click_count", "created_at",
+    "expires_at", "is_active", "qr_code_image", "qr_code_generated_at",
+)
+
+DASHBOARD_STATUSES = ("active", "inactive", "expired")
+DASHBOARD_SORTS = ("newest", "oldest")
+
+
+def filter_dashboard_urls(urls, params, now):
+    """Apply the dashboard's search box and filter dropdowns to a queryset"""
+    from django.db.models import Q
+
+    query = params.get("q", "").strip()
+    if query:
+        urls = urls.filter(Q(short_code__startswith=query) | Q(original_url__startswith=query))
+
+    status = params.get("status")
+    if status == "active":
+        urls = urls.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now), is_active=True)
+    elif status == "inactive":
+        urls = urls.filter(is_active=False)
+    elif status == "expired":
+        urls = urls.filter(expires_at__lte=now)
+
+    qr = params.get("qr")
+    if qr == "yes":
+        urls = urls.filter(qr_code_generated_at__isnull=False)
+    elif qr == "no":
+        urls = urls.filter(qr_code_generated_at__isnull=True)
+
+    return urls
+
 
 @login_required
+@read_from_replicas
 def dashboard(request):
-    from django.db.models import Sum, Count, Q
     from django.utils import timezone
+    from urllib.parse import urlencode
+    from .pagination import keyset_page
     
-    urls = ShortUrl.objects.filter(user=request.user).order_by("-created_at")
+    all_urls = ShortUrl.objects.filter(user=request.user)
     
-    # Calculate analytics using database aggregation for better performance
-    today = timezone.now().date()
-    
-    stats = urls.aggregate(
-        total_clicks=Sum('click_count'),
-        urls_with_qr=Count('id', filter=Q(qr_code_image__isnull=False)),
-        created_today=Count('id', filter=Q(created_at__date=today))
+    # Analytics come from the materialized per-user rows instead of
+    # aggregating every link the user owns
+    now = timezone.now()
+    stats = UserLinkStats.objects.for_user(request.user)
+    today = UserDailyLinkStats.objects.filter(
+        user=request.user, date=timezone.localdate(now)
+    ).first()
+
+    # Only the current page is fetched, seeking on (created_at, id)
+    filters = {
+        "q": request.GET.get("q", "").strip(),
+        "status": request.GET.get("status") if request.GET.get("status") in DASHBOARD_STATUSES else "",
+        "qr": request.GET.get("qr") if request.GET.get("qr") in ("yes", "no") else "",
+        "sort": request.GET.get("sort") if request.GET.get("sort") in DASHBOARD_SORTS else "newest",
+    }
+    urls = filter_dashboard_urls(all_urls, filters, now).only(*DASHBOARD_FIELDS)
+    page = keyset_page(
+        urls,
+        getattr(settings, "SHORTENER_DASHBOARD_PAGE_SIZE", 25),
+        newest_first=filters["sort"] == "newest",
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
     )
+
+    # Links whose QR code is still queued show a pending badge
+    pending_qr_ids = set(
+        QrJob.objects.filter(
+            short_url__in=[url.pk for url in page.items],
+            status__in=QrJob.OPEN_STATUSES,
+        ).values_list("short_url_id", flat=True)
+    )
+
+    # Pagination links keep the current filters
+    query_params = {k: v for k, v in filters.items() if v and v != "newest"}
+    prefix = f"?{urlencode(query_params)}&" if query_params else "?"
     
     context = {
-        "urls": urls,
-        "total_clicks": stats['total_clicks'] or 0,
-        "created_today": stats['created_today'],
-        "urls_with_qr": stats['urls_with_qr'],
+        "urls": page.items,
+        "filters": filters,
+        "is_filtered": any(filters[k] for k in ("q", "status", "qr")),
+        "next_url": f"{prefix}after={page.next_cursor}" if page.next_cursor else None,
+        "prev_url": f"{prefix}before={page.prev_cursor}" if page.prev_cursor else None,
+        "total_urls": stats.total_links,
+        "total_clicks": stats.total_clicks,
+        "created_today": today.links_created if today else 0,
+        "urls_with_qr": stats.links_with_qr,
+        "pending_qr_ids": pending_qr_ids,
     }
     
     return render(request, "shortener/dashboard.html", context)
@@ -54,40 +171,225 @@ def create_short_url(request):
             custom_code = form.cleaned_data["custom_short_code"]
             expires_at = form.cleaned_data["expires_at"]
 
-            short_code = custom_code if custom_code else generate_unique_short_code()
-
-            short_url = ShortUrl.objects.create(
-                user = request.user,
-                original_url = original_url,
-                short_code = short_code,
-                expires_at = expires_at
-
-            )
-            print(request.POST)
-            print(form.cleaned_data)
-            return render(request,
-                          "shortener/create_success.html",
-                          {"short_url": short_url})
+            try:
+                short_url = shorten_url(
+                    user = request.user,
+                    original_url = original_url,
+                    expires_at = expires_at,
+                    custom_code = custom_code
+                )
+            except IntegrityError:
+                # Another request took the custom code after validation
+                form.add_error("custom_short_code", "This short code is already taken.")
+            else:
+                logger.info("Created short URL %s", short_url.short_code, extra={"user_id": request.user.pk})
+                return render(request,
+                              "shortener/create_success.html",
+                              {"short_url": short_url})
     else:
         form = ShortUrlForm()
 
     return render(request,
                   "shortener/create.html", {"form": form})
 
+@login_required
+@require_POST
+def bulk_create_short_urls(request):
+    """
+    Create many short URLs from one request
+
+    Accepts JSON Lines (application/x-ndjson), CSV (text/csv) or a JSON
+    object {"urls": [...]}. Results are streamed back as JSON Lines, one per
+    input row, followed by a summary line with throughput.
+
+    Only JSON Lines and CSV are read as a stream; a JSON object has to be
+    parsed whole, so it is limited to SHORTENER_BULK_JSON_MAX_BYTES.
+    """
+    content_type = request.content_type
+    if content_type == "application/x-ndjson":
+        rows = iter_jsonl_rows(request)
+    elif content_type == "text/csv":
+        rows = iter_csv_rows(request)
+    else:
+        max_bytes = getattr(settings, "SHORTENER_BULK_JSON_MAX_BYTES", 1024 * 1024)
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > max_bytes:
+            return JsonResponse({
+                "error": f"JSON bodies are limited to {max_bytes} bytes; "
+                         "send large batches as application/x-ndjson or text/csv"
+            }, status=413)
+        try:
+            payload = json.loads(request.body)
+            urls = payload["urls"]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": 'Expected a JSON object with a "urls" list'}, status=400)
+        rows = (url if isinstance(url, dict) else {"original_url": url} for url in urls)
+
+    stats = BulkStats()
+
+    def stream():
+        for result in stats.track(bulk_shorten(request.user, rows)):
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": stats.summary()}) + "\n"
+
+    return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+@login_required
+def link_clicks(request, pk):
+    """
+    Click time series for one of the user's links, read from the buckets
+
+    Query params: `start` and `end` (ISO 8601, default the last 24 hours)
+    and optionally `granularity` (minute, hour or day), which is coarsened
+    when finer buckets have already been compacted away.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from django.utils.dateparse import parse_datetime
+    from .analytics import GRANULARITIES, click_series
+
+    short_url = get_object_or_404(ShortUrl, pk=pk, user=request.user)
+
+    try:
+        end = parse_datetime(request.GET["end"]) if "end" in request.GET else timezone.now()
+        start = parse_datetime(request.GET["start"]) if "start" in request.GET else end - timedelta(days=1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        return JsonResponse({"error": "start and end must be ISO 8601 datetimes"}, status=400)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    if start >= end:
+        return JsonResponse({"error": "start must be before end"}, status=400)
+
+    granularity = request.GET.get("granularity") or None
+    if granularity is not None and granularity not in GRANULARITIES:
+        return JsonResponse({"error": f"granularity must be one of {', '.join(GRANULARITIES)}"}, status=400)
+
+    granularity, points = click_series(short_url, start, end, granularity)
+    return JsonResponse({
+        "short_code": short_url.short_code,
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total": sum(clicks for _, clicks in points),
+        "points": [{"t": moment.isoformat(), "clicks": clicks} for moment, clicks in points],
+    })
+
 def redirect_short_url(request, short_code):
     """
-    Increments the user's short_url click count by 1
+    Buffers a click for the user's short_url (flushed in the background)
     Redirects to the user's original url
+    Returns 404 for unknown, inactive or expired links
     """
-    try:
-        short_url = ShortUrl.objects.get(short_code= short_code, is_active=True)
-    except ShortUrl.DoesNotExist:
-        return render(request,"404.html", status = 404)
+    target = get_redirect_target(short_code)
+    if not target.is_live():
+        return short_code_not_found(request)
     
-    short_url.click_count += 1
-    short_url.save(update_fields=['click_count'])
+    # HEAD requests (link checkers, previews) are not clicks
+    if request.method == "GET":
+        click_buffer.record(short_code)
+        hot_links.record(short_code)
+        click_events.record(
+            short_code,
+            request.META.get("HTTP_REFERER"),
+            request.META.get("HTTP_USER_AGENT"),
+            request.META.get("REMOTE_ADDR"),
+        )
+
+    return redirect_response(target)
 
-    response = HttpResponseRedirect(short_url.original_url)
+async def redirect_short_url_async(request, short_code):
+    """
+    Async twin of redirect_short_url for ASGI deployments
+    Resolves through the async cache/ORM APIs and never awaits a click write
+    """
+    target = await aget_redirect_target(short_code)
+    if not target.is_live():
+        if not has_session_cookie(request):
+            return HttpResponse(anonymous_not_found_body(), status = 404)
+        # The template touches request.user, which loads the session synchronously
+        return await sync_to_async(render)(request, "404.html", status = 404)
+
+    if request.method == "GET":
+        await click_buffer.arecord(short_code)
+        hot_links.record(short_code)
+        click_events.record(
+            short_code,
+            request.META.get("HTTP_REFERER"),
+            request.META.get("HTTP_USER_AGENT"),
+            request.META.get("REMOTE_ADDR"),
+        )
+
+    return redirect_response(target)
+
+def redirect_response(target):
+    """The link's redirect status with its Cache-Control policy"""
+    response = HttpResponseRedirect(target.original_url, status=target.redirect_type)
+    response["Cache-Control"] = target.cache_control()
+    return response
+
+@staff_member_required
+def cache_stats(request):
+    """Redirect cache hit/miss/eviction counters for this worker"""
+    return JsonResponse(redirect_cache.stats())
+
+@staff_member_required
+def bloom_stats(request):
+    """Short code Bloom filter size, fill level and false-positive rate"""
+    return JsonResponse(short_code_filter.stats())
+
+@staff_member_required
+def click_event_stats(request):
+    """Click event log buffer depth, sampling and drop counters"""
+    return JsonResponse(click_events.stats())
+
+@staff_member_required
+def hot_link_stats(request):
+    """Most clicked short codes in a sliding window (?window=1m|1h|24h&n=50)"""
+    window = request.GET.get("window", "1h")
+    if window not in WINDOW_NAMES:
+        return JsonResponse({"error": f"window must be one of {', '.join(WINDOW_NAMES)}"}, status=400)
+    try:
+        n = max(1, min(int(request.GET.get("n", 50)), 1000))
+    except ValueError:
+        return JsonResponse({"error": "n must be an integer"}, status=400)
+    return JsonResponse({
+        "window": window,
+        "workers": "all" if hot_links.cross_worker else "this",
+        "links": [
+            {"short_code": short_code, "clicks": clicks, "max_overcount": error}
+            for short_code, clicks, error in hot_links.top(window, n)
+        ],
+    })
+
+@staff_member_required
+def code_pool_stats(request):
+    """Short code pool depth and refill latency for this worker"""
+    return JsonResponse(code_pool.stats())
+
+def prometheus_metrics(request):
+    """
+    All workers' metrics in the Prometheus text format
+
+    Scrapers authenticate with "Authorization: Bearer <SHORTENER_METRICS_TOKEN>";
+    without a token configured the endpoint is staff only.
+    """
+    token = getattr(settings, "SHORTENER_METRICS_TOKEN", "")
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        allowed = hmac.compare_digest(supplied.encode(), token.encode())
+    else:
+        allowed = request.user.is_active and request.user.is_staff
+    if not allowed:
+        return HttpResponseForbidden("Not allowed")
+    response = HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    patch_cache_control(response, no_store=True)
     return response
 
 @login_required
@@ -138,24 +440,134 @@ def edit_url(request, pk):
     )
 
 
+QR_IMAGE_CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# The endpoint is public and every new parameter combination is a fresh
+# render, so only a few sizes are offered
+QR_IMAGE_SIZES = (128, 256, 512, 1024)
+
+
+def qr_image_params(request, short_code):
+    """
+    Rendering parameters for qr_code_image, or None if the query is invalid
+
+    Worked out once per request; the ETag check and the view share them.
+
+    Raises:
+        Http404: if the short code would not redirect (unknown, inactive
+            or expired)
+    """
+    if not hasattr(request, "qr_image_params"):
+        request.qr_image_params = _qr_image_params(request, short_code)
+    return request.qr_image_params
+
+
+def _qr_image_params(request, short_code):
+    if not get_redirect_target(short_code).is_live():
+        raise Http404("Unknown short code")
+    fmt = request.GET.get("format", QR_FORMAT)
+    error_correction = request.GET.get("ec", QR_ERROR_CORRECTION).upper()
+    try:
+        size = int(request.GET["size"]) if "size" in request.GET else None
+    except ValueError:
+        return None
+    if fmt not in QR_IMAGE_CONTENT_TYPES or error_correction not in ERROR_CORRECTION_LEVELS:
+        return None
+    if size is not None and size not in QR_IMAGE_SIZES:
+        return None
+    data = request.build_absolute_uri(f'/{short_code}/')
+    return {
+        "key": qr_content_key(data, error_correction, size or 0, QR_BORDER, fmt),
+        "data": data,
+        "fmt": fmt,
+        "error_correction": error_correction,
+        "size": size,
+    }
+
+
+def qr_image_etag(request, short_code):
+    params = qr_image_params(request, short_code)
+    return params["key"] if params else None
+
+
+@condition(etag_func=qr_image_etag)
+def qr_code_image(request, short_code):
+    """
+    QR code for a short code, rendered on demand (nothing is stored)
+
+    Query params: `format` (png or svg), `size` (pixels, one of
+    QR_IMAGE_SIZES) and
+    `ec` (error correction: L, M, Q or H). The output depends only on the
+    short URL and these parameters, so it gets a strong ETag, conditional
+    requests are answered with 304, and browsers and CDNs may cache it.
+    """
+    params = qr_image_params(request, short_code)
+    if params is None:
+        return JsonResponse(
+            {"error": f"format must be png or svg, ec one of L/M/Q/H and size one of {', '.join(map(str, QR_IMAGE_SIZES))}"},
+            status=400,
+        )
+    content = rendered_qr_bytes(
+        params["key"], params["data"], params["fmt"], params["error_correction"], params["size"]
+    )
+    response = HttpResponse(content, content_type=QR_IMAGE_CONTENT_TYPES[params["fmt"]])
+    response["Content-Disposition"] = f'inline; filename="qr_code_{short_code}.{params["fmt"]}"'
+    patch_cache_control(
+        response, public=True, max_age=getattr(settings, "SHORTENER_QR_CACHE_MAX_AGE", 86400)
+    )
+    return response
+
+
 @login_required
 def generate_qr_code_view(request, pk):
-    """Generate QR code for a short URL"""
+    """Queue QR code generation for a short URL"""
     short_url = get_object_or_404(
         ShortUrl,
         pk=pk,
         user=request.user
     )
     
-    # Generate QR code
-    success = generate_qr_code(short_url, request)
+    # The worker renders the PNG; this only inserts the job
+    job = enqueue_qr_job(short_url, get_full_short_url(short_url, request))
     
-    if success:
+    if job.status == QrJob.DONE:
         messages.success(request, "QR code generated successfully!")
-        return redirect("shortener:view_qr_code", pk=pk)
-    else:
+    elif job.status == QrJob.FAILED:
         messages.error(request, "Failed to generate QR code. Please try again.")
         return redirect("shortener:dashboard")
+    else:
+        messages.info(request, "Your QR code is being generated.")
+    return redirect("shortener:view_qr_code", pk=pk)
+
+
+@login_required
+@require_POST
+def generate_all_qr_codes(request):
+    """Queue QR codes for every link of the user that does not have one"""
+    queued = enqueue_qr_jobs(
+        ShortUrl.objects.filter(user=request.user, qr_code_generated_at__isnull=True),
+        lambda short_code: request.build_absolute_uri(f'/{short_code}/'),
+    )
+    if queued:
+        messages.info(request, f"Generating QR codes for {queued} links.")
+    else:
+        messages.info(request, "All your links already have a QR code.")
+    return redirect("shortener:dashboard")
+
+
+@login_required
+def qr_code_status(request, pk):
+    """Status of the latest QR job for a short URL"""
+    short_url = get_object_or_404(
+        ShortUrl,
+        pk=pk,
+        user=request.user
+    )
+    job = short_url.qr_jobs.order_by("-created_at", "-pk").first()
+    return JsonResponse({
+        "has_qr_code": short_url.has_qr_code,
+        "status": job.status if job else None,
+        "error": job.error if job else "",
+    })
 
 
 @login_required
@@ -166,15 +578,16 @@ def view_qr_code(request, pk):
         pk=pk,
         user=request.user
     )
+    qr_job = short_url.qr_jobs.filter(status__in=QrJob.OPEN_STATUSES).first()
     
-    if not short_url.has_qr_code:
+    if not short_url.has_qr_code and qr_job is None:
         messages.warning(request, "QR code has not been generated yet.")
         return redirect("shortener:dashboard")
     
     return render(
         request,
         "shortener/qr_code_view.html",
-        {"short_url": short_url}
+        {"short_url": short_url, "qr_job": qr_job}
     )
 
 
@@ -192,45 +605,37 @@ def download_qr_code(request, pk):
         return redirect("shortener:dashboard")
     
     try:
-        response = HttpResponse(
-            short_url.qr_code_image.read(),
-            content_type='image/png'
-        )
-        response['Content-Disposition'] = f'attachment; filename="qr_code_{short_url.short_code}.png"'
-        return response
+        return serve_qr_image(request, short_url)
     except Exception as e:
         messages.error(request, "Failed to download QR code.")
         return redirect("shortener:view_qr_code", pk=pk)
 
 
+@login_required
+def download_all_qr_codes(request):
+    """Download every generated QR code of the user as one ZIP archive"""
+    return stream_qr_zip(
+        ShortUrl.objects.filter(user=request.user),
+        filename=f"qr_codes_{request.user.username}.zip",
+    )
+
+
 @login_required
 def regenerate_qr_code_view(request, pk):
-    """Regenerate QR code for a short URL"""
+    """Queue a fresh QR code for a short URL (the old one stays until it is replaced)"""
     short_url = get_object_or_404(
         ShortUrl,
         pk=pk,
         user=request.user
     )
     
-    # Regenerate QR code
-    success = regenerate_qr_code(short_url, request)
+    job = enqueue_qr_job(short_url, get_full_short_url(short_url, request))
     
-    if success:
+    if job.status == QrJob.DONE:
         messages.success(request, "QR code regenerated successfully!")
-        return redirect("shortener:view_qr_code", pk=pk)
-    else:
+    elif job.status == QrJob.FAILED:
         messages.error(request, "Failed to regenerate QR code. Please try again.")
         return redirect("shortener:dashboard")
-
-
-
-
-
-
-
-
-
-
-
-
-
+    else:
+        messages.info(request, "Your QR code is being regenerated.")
+    return redirect("shortener:view_qr_code", pk=pk)
@@ -7,10 +7,27 @@ For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Warm the redirect cache of this worker before it serves requests; under
+# gunicorn this happens once more in post_worker_init, which then skips it
+try:
+    from apps.shortener.services import warm_redirect_cache_on_start
+
+    warm_redirect_cache_on_start()
+except Exception:
+    logging.getLogger(__name__).exception("Failed to pre-warm the redirect cache")
+
+# Answer cached short-code redirects before the middleware stack runs
+if getattr(settings, "SHORTENER_FAST_REDIRECT", True):
+    from apps.shortener.fastpath import FastRedirectASGI
+
+    application = FastRedirectASGI(application)
@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Answer cached short-code redirects before the middleware stack runs
+if getattr(settings, "SHORTENER_FAST_REDIRECT", True):
+    from apps.shortener.fastpath import FastRedirectWSGI
+
+    application = FastRedirectWSGI(application)
@@ -0,0 +1,38 @@
+# Gunicorn picks this file up automatically from the working directory.
+import os
+
+
+def on_starting(server):
+    """Drop the metrics files of the previous run"""
+    # Runs in the master before the application (and its settings) is loaded
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    from apps.shortener.metrics import clear_metrics_dir
+
+    clear_metrics_dir()
+
+
+def post_worker_init(worker):
+    """
+    Start building the short code Bloom filter and load the redirect
+    snapshot and the hot links into the redirect cache before the first
+    request
+    """
+    from apps.shortener.bloom import short_code_filter
+    from apps.shortener.services import warm_redirect_cache_on_start
+
+    short_code_filter.start()
+    try:
+        warm_redirect_cache_on_start()
+    except Exception:
+        worker.log.exception("Failed to pre-warm the redirect cache")
+
+
+def worker_exit(server, worker):
+    """Write buffered click counts, events and metrics before the worker goes away"""
+    from apps.shortener.click_buffer import click_buffer
+    from apps.shortener.events import click_events
+    from apps.shortener.metrics import metrics
+
+    click_buffer.flush()
+    click_events.close()
+    metrics.close()